@@ -1,13 +1,19 @@
-from typing import Dict, Any, Callable
-from fastapi import Depends, HTTPException, status
+import os
+import time
+from typing import Dict, Any, Callable, Optional
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt, JWTError
 
-from app.db.database import get_connection
-from app.core.security import SECRET_KEY, ALGORITHM  # deben existir en security.py
+from app.db.database import PooledConnection, get_db, get_connection
+from app.core.security import (  # deben existir en security.py
+    SECRET_KEY, ALGORITHM, TOKEN_CLAIMS, TIPO_TICKET_STREAM, token_revocado, canjear_ticket_stream,
+)
+from app.core.cache import TTLCache
 
 # ✅ CAMBIO: usar HTTPBearer (NO OAuth2PasswordBearer)
 bearer_scheme = HTTPBearer()
+bearer_opcional = HTTPBearer(auto_error=False)
 
 ROLE_NAME = {
     1: "CIUDADANO",
@@ -23,23 +29,40 @@ ESTADO_NAME = {
     4: "PENDIENTE",
 }
 
+# =========================
+# CACHÉ DE USUARIOS AUTENTICADOS
+# =========================
+# id_rol / id_estado_cuenta / id_entidad cambian muy poco: se cachean por id_usuario
+# y se invalidan explícitamente desde usuarios.py cuando cambian.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_MAX = int(os.getenv("USER_CACHE_MAX", "5000"))
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
-) -> Dict[str, Any]:
-    """
-    1) Lee token desde Authorization: Bearer <token>
-    2) Valida token
-    3) Saca sub = id_usuario
-    4) Consulta BD y devuelve usuario REAL con rol/estado/id_entidad
-    """
-    credentials_exc = HTTPException(
+usuarios_cache = TTLCache(maxsize=USER_CACHE_MAX, ttl=USER_CACHE_TTL)
+
+
+def invalidar_usuario(id_usuario: int) -> None:
+    """Saca al usuario de la caché; la próxima request lo relee de la BD."""
+    usuarios_cache.invalidate(id_usuario)
+
+
+def _credentials_exc() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Not authenticated",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    token = credentials.credentials  # ✅ aquí viene SOLO el token, sin "Bearer "
+
+def usuario_desde_token(token: str, conn: Optional[PooledConnection] = None) -> Dict[str, Any]:
+    """
+    1) Valida token
+    2) Saca sub = id_usuario
+    3) Devuelve usuario REAL con rol/estado/id_entidad:
+       - desde los claims del token (modo TOKEN_CLAIMS, si no fue revocado)
+       - desde la caché
+       - o consultando la BD (con `conn`, o una conexión del pool solo para esa consulta)
+    """
+    credentials_exc = _credentials_exc()
 
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -49,13 +72,45 @@ def get_current_user(
         id_usuario = int(sub)
     except (JWTError, ValueError):
         raise credentials_exc
+    # Un ticket de stream no es un access token
+    if payload.get("tipo") == TIPO_TICKET_STREAM:
+        raise credentials_exc
+
+    return _usuario_desde_claims(id_usuario, payload, conn)
+
+
+def _usuario_desde_claims(id_usuario: int, payload: Dict[str, Any],
+                          conn: Optional[PooledConnection] = None) -> Dict[str, Any]:
+    """Paso 3 de usuario_desde_token, con los claims ya validados (access token o ticket de stream)."""
+    credentials_exc = _credentials_exc()
+
+    # Emitido antes de una revocación (cambio de estado, contraseña restablecida):
+    # no vale en ningún modo; el cliente debe renovarlo con /auth/refresh o volver a entrar
+    if token_revocado(id_usuario, payload.get("iat")):
+        raise credentials_exc
 
-    conn = get_connection()
+    if TOKEN_CLAIMS and "id_estado_cuenta" in payload:
+        return {
+            "id_usuario": id_usuario,
+            "correo": payload.get("correo"),
+            "id_rol": payload.get("id_rol"),
+            "id_estado_cuenta": payload.get("id_estado_cuenta"),
+            "id_entidad": payload.get("id_entidad"),
+            "nombre_completo": payload.get("nombre_completo"),
+        }
+
+    cached = usuarios_cache.get(id_usuario)
+    if cached is not None:
+        return dict(cached)
+
+    propia = conn is None
+    if propia:
+        conn = get_connection()
     try:
         with conn.cursor() as cursor:
             cursor.execute(
                 """
-                SELECT id_usuario, correo, id_rol, id_estado_cuenta, id_entidad
+                SELECT id_usuario, correo, id_rol, id_estado_cuenta, id_entidad, nombre_completo
                 FROM usuarios
                 WHERE id_usuario = %s;
                 """,
@@ -63,14 +118,24 @@ def get_current_user(
             )
             user = cursor.fetchone()
     finally:
-        conn.close()
+        if propia:
+            conn.close()
 
     if not user:
         raise credentials_exc
 
+    usuarios_cache.set(id_usuario, dict(user))
     return user
 
 
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+    conn: PooledConnection = Depends(get_db),
+) -> Dict[str, Any]:
+    """Lee token desde Authorization: Bearer <token> y devuelve el usuario."""
+    return usuario_desde_token(credentials.credentials, conn)  # ✅ aquí viene SOLO el token, sin "Bearer "
+
+
 def require_active_user(
     user: Dict[str, Any] = Depends(get_current_user),
 ) -> Dict[str, Any]:
@@ -82,6 +147,57 @@ def require_active_user(
     return user
 
 
+def sesion_stream(
+    ticket: Optional[str] = Query(
+        None, description="Ticket de POST /notificaciones/stream/ticket (EventSource no permite headers)"
+    ),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_opcional),
+) -> Dict[str, Any]:
+    """
+    Claims con que se abre una conexión larga (stream): los del access token del
+    header Authorization o, para EventSource, los de un ticket de un solo uso en
+    ?ticket=. El access token nunca se acepta en la URL (quedaría en los logs).
+    """
+    if credentials:
+        try:
+            payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            raise _credentials_exc()
+        if payload.get("tipo") == TIPO_TICKET_STREAM:
+            raise _credentials_exc()
+        payload["sesion_exp"] = payload.get("exp")
+        return payload
+    payload = canjear_ticket_stream(ticket) if ticket else None
+    if payload is None:
+        raise _credentials_exc()
+    return payload
+
+
+def sesion_vigente(sesion: Dict[str, Any]) -> bool:
+    """False si la sesión del stream ya expiró o se revocó (revocar_tokens_usuario) después de abrirse."""
+    try:
+        id_usuario = int(sesion.get("sub"))
+    except (TypeError, ValueError):
+        return False
+    if sesion.get("sesion_exp") is not None and time.time() >= sesion["sesion_exp"]:
+        return False
+    return not token_revocado(id_usuario, sesion.get("iat"))
+
+
+def require_active_user_stream(sesion: Dict[str, Any] = Depends(sesion_stream)) -> Dict[str, Any]:
+    """
+    Igual que require_active_user, para conexiones largas (streams): acepta el Bearer
+    o un ticket de stream, y no retiene una conexión del pool mientras dure la
+    respuesta (solo la pide si el usuario no está en los claims ni en la caché).
+    Como solo se valida al conectar, el stream debe revisar sesion_vigente() mientras viva.
+    """
+    try:
+        id_usuario = int(sesion.get("sub"))
+    except (TypeError, ValueError):
+        raise _credentials_exc()
+    return require_active_user(_usuario_desde_claims(id_usuario, sesion))
+
+
 def require_roles(*allowed_roles: int) -> Callable:
     allowed = set(allowed_roles)
 
@@ -0,0 +1,86 @@
+import math
+from typing import Any, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+# =========================
+# UTILIDADES GEOGRÁFICAS
+# =========================
+RADIO_TIERRA_M = 6371008.8
+RADIO_MAX_M = 200_000          # 200 km cubre todo Cundinamarca
+METROS_POR_GRADO_LAT = math.pi * RADIO_TIERRA_M / 180
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distancia en metros sobre la esfera entre dos puntos (grados)."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * RADIO_TIERRA_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bbox_de_radio(lat: float, lon: float, radio_m: float) -> Tuple[float, float, float, float]:
+    """Caja (min_lon, min_lat, max_lon, max_lat) que contiene el círculo; sirve de prefiltro."""
+    dlat = radio_m / METROS_POR_GRADO_LAT
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    dlon = min(180.0, dlat / cos_lat)
+    return lon - dlon, max(-90.0, lat - dlat), lon + dlon, min(90.0, lat + dlat)
+
+
+def parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    """'min_lon,min_lat,max_lon,max_lat' -> tupla validada (HTTP 400 si es inválida)."""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox debe ser 'min_lon,min_lat,max_lon,max_lat'")
+    if not (-180 <= min_lon <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise HTTPException(status_code=400, detail="bbox fuera de rango o con mínimos mayores que máximos")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def filtro_espacial(
+    col_lat: str,
+    col_lon: str,
+    bbox: Optional[str] = None,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    radio_m: Optional[float] = None,
+) -> Tuple[List[str], List[Any]]:
+    """
+    Condiciones WHERE para limitar puntos a la vista del mapa:
+    - bbox: rango simple sobre latitud/longitud (usa el índice).
+    - lat + lon + radio_m: prefiltro por la caja del círculo (usa el índice)
+      y luego la distancia haversine exacta solo sobre esos candidatos.
+    """
+    centro = (lat, lon, radio_m)
+    if any(v is not None for v in centro) and not all(v is not None for v in centro):
+        raise HTTPException(status_code=400, detail="Para buscar por radio envía lat, lon y radio_m")
+    if bbox and radio_m is not None:
+        raise HTTPException(status_code=400, detail="Usa bbox o lat/lon/radio_m, no ambos")
+
+    if bbox:
+        min_lon, min_lat, max_lon, max_lat = parse_bbox(bbox)
+        return (
+            [f"{col_lat} BETWEEN %s AND %s", f"{col_lon} BETWEEN %s AND %s"],
+            [min_lat, max_lat, min_lon, max_lon],
+        )
+
+    if radio_m is not None:
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise HTTPException(status_code=400, detail="lat/lon fuera de rango")
+        if not (0 < radio_m <= RADIO_MAX_M):
+            raise HTTPException(status_code=400, detail=f"radio_m debe estar entre 0 y {RADIO_MAX_M}")
+        min_lon, min_lat, max_lon, max_lat = bbox_de_radio(lat, lon, radio_m)
+        haversine_sql = (
+            f"2 * {RADIO_TIERRA_M} * ASIN(SQRT("
+            f"POW(SIN(RADIANS({col_lat} - %s) / 2), 2) + "
+            f"COS(RADIANS(%s)) * COS(RADIANS({col_lat})) * "
+            f"POW(SIN(RADIANS({col_lon} - %s) / 2), 2))) <= %s"
+        )
+        return (
+            [f"{col_lat} BETWEEN %s AND %s", f"{col_lon} BETWEEN %s AND %s", haversine_sql],
+            [min_lat, max_lat, min_lon, max_lon, lat, lat, lon, radio_m],
+        )
+
+    return [], []
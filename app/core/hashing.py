@@ -0,0 +1,123 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.security import hash_password, verify_password, verify_and_update_password
+
+# =========================
+# POOL DE PROCESOS PARA PBKDF2
+# =========================
+# PBKDF2 es CPU puro: en el threadpool de FastAPI retiene el GIL y frena a todos
+# los demás endpoints. Aquí corre en procesos aparte, con una cola acotada:
+# si hay demasiados hashes pendientes se responde 503 en vez de encolar sin límite.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))  # 0 = sin procesos
+HASH_QUEUE_MAX = int(os.getenv("HASH_QUEUE_MAX", "64"))
+# Nunca "fork": copiar un proceso uvicorn con hilos (threadpool, pool de BD) puede
+# dejar locks tomados en el hijo. forkserver donde existe (Linux/macOS), si no spawn.
+HASH_START_METHOD = os.getenv(
+    "HASH_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn",
+)
+
+
+class HashPool:
+    def __init__(self, workers: int = HASH_WORKERS, queue_max: int = HASH_QUEUE_MAX):
+        self.workers = workers
+        self.queue_max = queue_max
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pendientes = 0
+        self._max_pendientes = 0
+        self._completados = 0
+        self._rechazados = 0
+        self._errores = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(HASH_START_METHOD),
+                )
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn, *args) -> Any:
+        with self._lock:
+            if self._pendientes >= self.queue_max:
+                self._rechazados += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail="Servidor ocupado validando contraseñas. Intenta de nuevo en unos segundos.",
+                    headers={"Retry-After": "1"},
+                )
+            self._pendientes += 1
+            self._max_pendientes = max(self._max_pendientes, self._pendientes)
+        try:
+            if self.workers <= 0:
+                resultado = await run_in_threadpool(fn, *args)
+            else:
+                loop = asyncio.get_running_loop()
+                resultado = await loop.run_in_executor(self._get_executor(), fn, *args)
+        except BrokenProcessPool:
+            # Un worker murió: se recrea el pool para las siguientes peticiones
+            self._reset_executor()
+            with self._lock:
+                self._errores += 1
+            raise HTTPException(status_code=503, detail="Pool de hashing reiniciado. Intenta de nuevo.")
+        except Exception:
+            with self._lock:
+                self._errores += 1
+            raise
+        finally:
+            with self._lock:
+                self._pendientes -= 1
+        with self._lock:
+            self._completados += 1
+        return resultado
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "start_method": HASH_START_METHOD,
+                "cola_max": self.queue_max,
+                "pendientes": self._pendientes,
+                "max_pendientes": self._max_pendientes,
+                "completados": self._completados,
+                "rechazados": self._rechazados,
+                "errores": self._errores,
+            }
+
+
+hash_pool = HashPool()
+
+
+async def hash_password_async(password: str) -> str:
+    return await hash_pool.run(hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await hash_pool.run(verify_password, plain_password, hashed_password)
+
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return await hash_pool.run(verify_and_update_password, plain_password, hashed_password)
@@ -1,6 +1,10 @@
+import hashlib
 import os
+import secrets
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 
 from dotenv import load_dotenv
 from jose import jwt, JWTError
@@ -12,9 +16,19 @@ load_dotenv()
 # =========================
 # PASSWORD HASHING (SIN BCRYPT)
 # =========================
+# Rondas PBKDF2 configurables (calibrar con: python tools_hash.py calibrar).
+# min_rounds = max_rounds = PBKDF2_ROUNDS hace que needs_update() marque
+# cualquier hash con otras rondas, y el login lo rehashea de forma transparente.
+PBKDF2_ROUNDS = int(os.getenv("PBKDF2_ROUNDS", "29000"))
+PBKDF2_SALT_SIZE = int(os.getenv("PBKDF2_SALT_SIZE", "16"))
+
 pwd_context = CryptContext(
     schemes=["pbkdf2_sha256"],  # ✅ estable en Windows/Python 3.13
-    deprecated="auto"
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=PBKDF2_ROUNDS,
+    pbkdf2_sha256__min_rounds=PBKDF2_ROUNDS,
+    pbkdf2_sha256__max_rounds=PBKDF2_ROUNDS,
+    pbkdf2_sha256__salt_size=PBKDF2_SALT_SIZE,
 )
 
 def hash_password(password: str) -> str:
@@ -23,20 +37,148 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifica la contraseña y, si el hash usa parámetros viejos, devuelve
+    también el hash nuevo a guardar: (valida, nuevo_hash | None).
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+def hash_soportado(hashed_password: str) -> bool:
+    """True si el hash es de un esquema que pwd_context sabe verificar."""
+    try:
+        return bool(hashed_password) and pwd_context.identify(hashed_password) is not None
+    except ValueError:
+        return False
+
 # =========================
 # JWT
 # =========================
 SECRET_KEY = os.getenv("SECRET_KEY", "CHANGE_ME_PLEASE")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+# Access token corto: la sesión se mantiene con el refresh token rotativo (/auth/refresh)
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+
+# Si está activo, el token lleva id_estado_cuenta / id_entidad / correo y
+# deps.get_current_user confía en ellos sin consultar MySQL.
+TOKEN_CLAIMS = os.getenv("TOKEN_CLAIMS", "false").strip().lower() in ("1", "true", "si", "yes")
 
 def create_access_token(data: Dict[str, Any], expires_minutes: Optional[int] = None) -> str:
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(
+    now = datetime.utcnow()
+    expire = now + timedelta(
         minutes=expires_minutes if expires_minutes is not None else ACCESS_TOKEN_EXPIRE_MINUTES
     )
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": now})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def build_access_claims(user: Dict[str, Any]) -> Dict[str, Any]:
+    """Claims del access token para un usuario (fila de la tabla usuarios)."""
+    claims = {
+        "sub": str(user["id_usuario"]),
+        "id_rol": user["id_rol"],
+    }
+    if TOKEN_CLAIMS:
+        claims.update({
+            "id_estado_cuenta": user["id_estado_cuenta"],
+            "id_entidad": user.get("id_entidad"),
+            "correo": user.get("correo"),
+            "nombre_completo": user.get("nombre_completo"),
+        })
+    return claims
+
+# =========================
+# REFRESH TOKENS
+# =========================
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+
+def hash_refresh_token(token: str) -> str:
+    """En BD solo se guarda el SHA-256 del refresh token (es aleatorio, no necesita PBKDF2)."""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def generar_refresh_token() -> Tuple[str, str, datetime]:
+    """Devuelve (token en claro, hash para BD, fecha de expiración)."""
+    token = secrets.token_urlsafe(48)
+    expira = datetime.now() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    return token, hash_refresh_token(token), expira
+
 def decode_token(token: str) -> Dict[str, Any]:
     return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+# =========================
+# REVOCACIÓN DE ACCESS TOKENS
+# =========================
+# id_usuario -> instante (epoch) de la revocación. Los tokens emitidos hasta ese
+# instante se rechazan (401) en cualquier modo, con o sin TOKEN_CLAIMS. Las entradas se
+# descartan cuando todos los tokens afectados ya expiraron, así que el mapa
+# solo contiene las revocaciones de la última ventana de expiración.
+_revocaciones: Dict[int, float] = {}
+_revocaciones_lock = threading.Lock()
+
+def _purgar_revocaciones(now: float) -> None:
+    limite = now - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    for id_usuario in [k for k, ts in _revocaciones.items() if ts < limite]:
+        del _revocaciones[id_usuario]
+
+def revocar_tokens_usuario(id_usuario: int) -> None:
+    now = time.time()
+    with _revocaciones_lock:
+        _purgar_revocaciones(now)
+        _revocaciones[id_usuario] = now
+
+def token_revocado(id_usuario: int, iat: Optional[int]) -> bool:
+    ts = _revocaciones.get(id_usuario)
+    if ts is None:
+        return False
+    # iat tiene resolución de segundos: ante la duda, se considera revocado
+    return iat is None or iat <= ts
+
+def revocaciones_activas() -> int:
+    with _revocaciones_lock:
+        _purgar_revocaciones(time.time())
+        return len(_revocaciones)
+
+# =========================
+# TICKETS DE STREAM (SSE)
+# =========================
+# EventSource no permite enviar headers, y un JWT en la URL queda escrito en los
+# logs de acceso y de los proxies. Por eso el navegador pide con su Bearer un
+# ticket (POST /notificaciones/stream/ticket) y abre el stream con ?ticket=:
+# vence en STREAM_TICKET_SEG, sirve una sola vez y no vale como access token.
+# Lleva el `exp` del access token que lo pidió: el stream no dura más que esa sesión.
+# El "un solo uso" es por proceso (cada worker recuerda los tickets que canjeó);
+# con varios workers, lo que acota una copia filtrada es el vencimiento corto.
+STREAM_TICKET_SEG = int(os.getenv("STREAM_TICKET_SEG", "30"))
+TIPO_TICKET_STREAM = "stream"
+
+_tickets_usados: Dict[str, float] = {}   # jti -> exp
+_tickets_lock = threading.Lock()
+
+def crear_ticket_stream(id_usuario: int, sesion_exp: int) -> str:
+    now = int(time.time())
+    return jwt.encode({
+        "sub": str(id_usuario),
+        "tipo": TIPO_TICKET_STREAM,
+        "jti": secrets.token_urlsafe(16),
+        "iat": now,
+        "exp": min(now + STREAM_TICKET_SEG, sesion_exp),
+        "sesion_exp": sesion_exp,
+    }, SECRET_KEY, algorithm=ALGORITHM)
+
+def canjear_ticket_stream(ticket: str) -> Optional[Dict[str, Any]]:
+    """Claims del ticket si es válido y es la primera vez que se usa; si no, None."""
+    try:
+        payload = jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    jti = payload.get("jti")
+    if payload.get("tipo") != TIPO_TICKET_STREAM or not jti:
+        return None
+    now = time.time()
+    with _tickets_lock:
+        for usado in [k for k, exp in _tickets_usados.items() if exp < now]:
+            del _tickets_usados[usado]
+        if jti in _tickets_usados:
+            return None
+        _tickets_usados[jti] = payload["exp"]
+    return payload
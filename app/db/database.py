@@ -1,10 +1,27 @@
 import pymysql
 import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
 from dotenv import load_dotenv
+from pymysql.constants import SERVER_STATUS
 
 load_dotenv()
 
-def get_connection():
+# =========================
+# CONFIGURACIÓN DEL POOL
+# =========================
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))              # seg. esperando una conexión libre
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))   # seg. ociosa antes de cerrarse
+DB_POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "3600"))            # edad máxima de una conexión
+DB_POOL_PING_INTERVAL = float(os.getenv("DB_POOL_PING_INTERVAL", "5"))   # ping solo si estuvo ociosa más que esto
+
+
+def _connect():
     return pymysql.connect(
         host=os.getenv("DB_HOST", "localhost"),
         port=int(os.getenv("DB_PORT", 3306)),
@@ -14,3 +31,272 @@ def get_connection():
         cursorclass=pymysql.cursors.DictCursor,
         autocommit=True
     )
+
+
+class PoolAgotado(pymysql.err.OperationalError):
+    """No hubo conexión libre dentro de DB_POOL_TIMEOUT."""
+
+
+class _Slot:
+    __slots__ = ("raw", "created_at", "last_used")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class PooledConnection:
+    """
+    Envoltura de una conexión PyMySQL prestada por el pool.
+    Se usa igual que la conexión original; close() la devuelve al pool
+    en vez de cerrar el socket.
+    """
+
+    def __init__(self, pool: "ConnectionPool", slot: _Slot):
+        self._pool = pool
+        self._slot = slot
+
+    def __getattr__(self, name):
+        slot = self.__dict__.get("_slot")
+        if slot is None:
+            raise pymysql.err.InterfaceError("La conexión ya fue devuelta al pool")
+        return getattr(slot.raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        slot, self._slot = self._slot, None
+        if slot is not None:
+            self._pool._release(slot)
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones acotado y thread-safe.
+    - Mantiene al menos `min_size` conexiones abiertas y nunca más de `max_size`.
+    - Al prestar una conexión hace ping si estuvo ociosa más de `ping_interval`.
+    - Cierra las ociosas más de `idle_timeout` (por encima del mínimo)
+      y las que superan `recycle` segundos de vida.
+    """
+
+    def __init__(self, connect=_connect, min_size: int = DB_POOL_MIN, max_size: int = DB_POOL_MAX,
+                 timeout: float = DB_POOL_TIMEOUT, idle_timeout: float = DB_POOL_IDLE_TIMEOUT,
+                 recycle: float = DB_POOL_RECYCLE, ping_interval: float = DB_POOL_PING_INTERVAL):
+        self._connect = connect
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+
+        self._idle = deque()          # LIFO: se reutiliza primero la más reciente
+        self._size = 0                # abiertas (ociosas + prestadas + conectando)
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._stats = {
+            "checkouts": 0,
+            "creadas": 0,
+            "cerradas": 0,
+            "recicladas": 0,
+            "pings_fallidos": 0,
+            "esperas": 0,
+            "timeouts": 0,
+        }
+
+    # ---------- préstamo ----------
+
+    def get(self) -> PooledConnection:
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            if self._closed:
+                raise pymysql.err.InterfaceError("El pool de conexiones está cerrado")
+            self._stats["checkouts"] += 1
+            while True:
+                self._purge_idle_locked()
+                if self._idle:
+                    slot = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    slot = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolAgotado(f"Pool de conexiones agotado ({self.max_size} en uso)")
+                self._stats["esperas"] += 1
+                self._cond.wait(remaining)
+
+        # La red se toca fuera del lock
+        if slot is not None:
+            slot = self._validate(slot)
+        if slot is None:
+            slot = self._new_slot()
+        return PooledConnection(self, slot)
+
+    def _new_slot(self) -> _Slot:
+        try:
+            raw = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats["creadas"] += 1
+        return _Slot(raw)
+
+    def _validate(self, slot: _Slot) -> Optional[_Slot]:
+        """Devuelve el slot si sigue vivo; si no, lo descarta (el cupo queda reservado)."""
+        now = time.monotonic()
+        if now - slot.created_at > self.recycle:
+            self._discard(slot, reserve=True, stat="recicladas")
+            return None
+        if now - slot.last_used > self.ping_interval:
+            try:
+                slot.raw.ping(reconnect=False)
+            except Exception:
+                self._discard(slot, reserve=True, stat="pings_fallidos")
+                return None
+        return slot
+
+    # ---------- devolución ----------
+
+    def _release(self, slot: _Slot):
+        raw = slot.raw
+        healthy = False
+        try:
+            # Nunca devolver al pool una transacción abierta o un resultado sin leer
+            if raw.open and raw.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                raw.rollback()
+            if not raw.get_autocommit():
+                raw.autocommit(True)
+            pending = raw._result is not None and raw._result.unbuffered_active
+            healthy = raw.open and not pending
+        except Exception:
+            healthy = False
+
+        if not healthy or time.monotonic() - slot.created_at > self.recycle:
+            self._discard(slot, reserve=False, stat="recicladas" if healthy else "cerradas")
+            return
+
+        slot.last_used = time.monotonic()
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                self._close_raw(raw)
+            else:
+                self._idle.append(slot)
+            self._cond.notify()
+
+    def _discard(self, slot: _Slot, reserve: bool, stat: str):
+        self._close_raw(slot.raw)
+        with self._cond:
+            self._stats[stat] += 1
+            if not reserve:
+                self._size -= 1
+                self._cond.notify()
+
+    def _purge_idle_locked(self):
+        """Cierra conexiones ociosas vencidas, respetando el mínimo. Requiere el lock."""
+        now = time.monotonic()
+        keep = deque()
+        while self._idle:
+            slot = self._idle.popleft()
+            expired = now - slot.created_at > self.recycle
+            idle_too_long = (now - slot.last_used > self.idle_timeout
+                             and self._size - 1 >= self.min_size)
+            if expired or idle_too_long:
+                self._size -= 1
+                self._stats["recicladas" if expired else "cerradas"] += 1
+                self._close_raw(slot.raw)
+            else:
+                keep.append(slot)
+        self._idle = keep
+
+    @staticmethod
+    def _close_raw(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    # ---------- ciclo de vida ----------
+
+    def warmup(self):
+        """Abre las conexiones mínimas (se llama al iniciar la app)."""
+        conns = []
+        try:
+            while True:
+                with self._cond:
+                    if self._size >= self.min_size:
+                        break
+                conns.append(self.get())
+        finally:
+            for conn in conns:
+                conn.close()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                slot = self._idle.pop()
+                self._size -= 1
+                self._close_raw(slot.raw)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "min": self.min_size,
+                "max": self.max_size,
+                "abiertas": self._size,
+                "ociosas": len(self._idle),
+                "en_uso": self._size - len(self._idle),
+                **self._stats,
+            }
+
+
+pool = ConnectionPool()
+
+
+def get_connection() -> PooledConnection:
+    """Presta una conexión del pool. conn.close() la devuelve al pool."""
+    return pool.get()
+
+
+def con_conexion(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    fn(conn, *args) con una conexión prestada solo mientras dura la llamada.
+    Para endpoints async que esperan algo lento (hash PBKDF2) entre dos accesos
+    a la BD: no retienen una conexión del pool mientras esperan.
+    """
+    conn = get_connection()
+    try:
+        return fn(conn, *args)
+    finally:
+        conn.close()
+
+
+def pool_stats() -> Dict[str, Any]:
+    return pool.stats()
+
+
+def get_db():
+    """
+    Dependencia FastAPI: una sola conexión por request.
+    FastAPI cachea la dependencia, así que get_current_user, require_roles
+    y el endpoint reciben la MISMA conexión (un único checkout del pool).
+    """
+    conn = get_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from app.core.deps import require_roles
-from app.db.database import get_connection
+from app.db.database import get_db
 import pymysql
 
 router = APIRouter(prefix="/auditoria", tags=["Auditoría"])
@@ -12,11 +12,10 @@ def listar_logs(
     modulo: str = None,
     id_usuario: int = None,
     limite: int = 100,
-    user=Depends(require_roles(ADMIN))
+    user=Depends(require_roles(ADMIN)),
+    conn=Depends(get_db)
 ):
-    conn = None
     try:
-        conn = get_connection()
         with conn.cursor() as cursor:
             query = """
                 SELECT 
@@ -45,16 +44,11 @@ def listar_logs(
         return {"total": len(logs), "logs": logs}
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"Error BD: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
 
 
 @router.get("/modulos", summary="Resumen de acciones por módulo (solo ADMIN)")
-def resumen_modulos(user=Depends(require_roles(ADMIN))):
-    conn = None
+def resumen_modulos(user=Depends(require_roles(ADMIN)), conn=Depends(get_db)):
     try:
-        conn = get_connection()
         with conn.cursor() as cursor:
             cursor.execute("""
                 SELECT modulo, COUNT(*) AS total_acciones
@@ -66,6 +60,3 @@ def resumen_modulos(user=Depends(require_roles(ADMIN))):
         return resultado
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"Error BD: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
@@ -1,16 +1,31 @@
-from typing import Dict, Any
+import asyncio
+import logging
+import os
+import secrets
+from datetime import datetime
+from typing import Dict, Any, Optional
 
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, Field
 
 from jose import JWTError
+import pymysql
 
-from app.db.database import get_connection
-from app.core.security import verify_password, create_access_token, decode_token
+from app.db.database import PooledConnection, get_db, con_conexion
+from app.core.hashing import verify_and_update_password_async
+from app.core.security import (
+    create_access_token, build_access_claims, decode_token, hash_soportado,
+    generar_refresh_token, hash_refresh_token,
+)
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 bearer_scheme = HTTPBearer()
+logger = logging.getLogger("geovisor")
+
+# Cada cuánto se borran los refresh tokens que ya no sirven (tarea de fondo)
+REFRESH_PURGA_INTERVALO_SEG = float(os.getenv("REFRESH_PURGA_INTERVALO_SEG", "3600"))
 
 # =========================
 # MODELOS
@@ -20,49 +35,108 @@ class LoginRequest(BaseModel):
     correo: str = Field(..., description="Correo del usuario")
     password: str = Field(..., min_length=1, description="Contraseña en texto plano (solo se envía para validar)")
 
+class RefreshRequest(BaseModel):
+    refresh_token: str = Field(..., min_length=1, description="Refresh token recibido en /auth/login o /auth/refresh")
+
 # =========================
 # HELPERS
 # =========================
 
-def _get_user_by_email(correo: str) -> Dict[str, Any]:
-    conn = get_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT
-                    id_usuario, id_rol, id_estado_cuenta, id_entidad,
-                    nombre_completo, correo, password_hash
-                FROM usuarios
-                WHERE correo = %s
-                LIMIT 1;
-            """, (correo,))
-            user = cursor.fetchone()
-        return user
-    finally:
-        conn.close()
+def _get_user_by_email(conn, correo: str) -> Dict[str, Any]:
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT
+                id_usuario, id_rol, id_estado_cuenta, id_entidad,
+                nombre_completo, correo, password_hash
+            FROM usuarios
+            WHERE correo = %s
+            LIMIT 1;
+        """, (correo,))
+        return cursor.fetchone()
+
+def _get_user_by_id(conn, id_usuario: int) -> Dict[str, Any]:
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT
+                id_usuario, id_rol, id_estado_cuenta, id_entidad,
+                nombre_completo, correo
+            FROM usuarios
+            WHERE id_usuario = %s
+            LIMIT 1;
+        """, (id_usuario,))
+        return cursor.fetchone()
 
-def _get_user_by_id(id_usuario: int) -> Dict[str, Any]:
+def _emitir_refresh_token(cursor, id_usuario: int, familia: Optional[str] = None) -> str:
+    """Guarda (hash) un nuevo refresh token y lo devuelve en claro. Misma familia al rotar."""
+    token, token_hash, expira = generar_refresh_token()
+    cursor.execute("""
+        INSERT INTO refresh_tokens (id_usuario, token_hash, familia, fecha_expiracion)
+        VALUES (%s, %s, %s, %s);
+    """, (id_usuario, token_hash, familia or secrets.token_hex(16), expira))
+    return token
+
+def purgar_refresh_tokens(conn) -> int:
+    """
+    Borra los refresh tokens expirados y los revocados cuya familia ya no tiene
+    ningún token vivo. Los revocados de una familia viva se conservan: sirven para
+    detectar la reutilización de un token rotado y revocar la sesión.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM refresh_tokens WHERE fecha_expiracion < NOW();")
+        borrados = cursor.rowcount
+        cursor.execute("""
+            DELETE t FROM refresh_tokens t
+            LEFT JOIN refresh_tokens viva
+                   ON viva.familia = t.familia AND viva.revocado = 0
+            WHERE t.revocado = 1 AND viva.id_refresh IS NULL;
+        """)
+        return borrados + cursor.rowcount
+
+def _purgar_refresh_tokens(get_connection) -> int:
     conn = get_connection()
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT
-                    id_usuario, id_rol, id_estado_cuenta, id_entidad,
-                    nombre_completo, correo
-                FROM usuarios
-                WHERE id_usuario = %s
-                LIMIT 1;
-            """, (id_usuario,))
-            user = cursor.fetchone()
-        return user
+        return purgar_refresh_tokens(conn)
     finally:
         conn.close()
 
+async def tarea_purga_refresh_tokens(get_connection) -> None:
+    """Tarea de fondo: cada REFRESH_PURGA_INTERVALO_SEG limpia la tabla refresh_tokens."""
+    while True:
+        try:
+            borrados = await asyncio.to_thread(_purgar_refresh_tokens, get_connection)
+            if borrados:
+                logger.info("Refresh tokens purgados: %s", borrados)
+        except Exception as e:
+            logger.warning("No se pudieron purgar los refresh tokens: %s", e)
+        await asyncio.sleep(REFRESH_PURGA_INTERVALO_SEG)
+
+def _actualizar_password_hash(conn, id_usuario: int, hash_anterior: str, hash_nuevo: str) -> None:
+    """Solo reemplaza si nadie cambió la contraseña mientras se verificaba."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "UPDATE usuarios SET password_hash = %s WHERE id_usuario = %s AND password_hash = %s;",
+            (hash_nuevo, id_usuario, hash_anterior)
+        )
+
+def _registrar_login(conn, id_usuario: int, hash_anterior: str, hash_nuevo: Optional[str]) -> str:
+    """Escrituras del login en un solo préstamo: rehash (si cambiaron las rondas) + sesión."""
+    if hash_nuevo:
+        # Cambiaron las rondas PBKDF2: se guarda el hash con los parámetros actuales
+        _actualizar_password_hash(conn, id_usuario, hash_anterior, hash_nuevo)
+    return _crear_sesion(conn, id_usuario)
+
+def _crear_sesion(conn, id_usuario: int) -> str:
+    with conn.cursor() as cursor:
+        return _emitir_refresh_token(cursor, id_usuario)
+
 # =========================
 # DEPENDENCY (PROTECCIÓN)
 # =========================
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)) -> Dict[str, Any]:
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+    conn: PooledConnection = Depends(get_db),
+) -> Dict[str, Any]:
     token = credentials.credentials
     try:
         payload = decode_token(token)
@@ -73,7 +147,7 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(bearer_
     except (JWTError, ValueError):
         raise HTTPException(status_code=401, detail="Token inválido")
 
-    user = _get_user_by_id(user_id)
+    user = _get_user_by_id(conn, user_id)
     if not user:
         raise HTTPException(status_code=401, detail="Usuario no existe")
 
@@ -84,8 +158,12 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(bearer_
 # =========================
 
 @router.post("/login", summary="Login: devuelve JWT")
-def login(payload: LoginRequest):
-    user = _get_user_by_email(payload.correo)
+async def login(payload: LoginRequest):
+    # async: el PBKDF2 va al pool de procesos y la BD al threadpool,
+    # así el event loop nunca queda bloqueado por la verificación.
+    # Sin get_db: cada acceso a la BD presta una conexión y la devuelve antes de
+    # esperar el hash, así una ráfaga de logins no agota el pool de conexiones.
+    user = await run_in_threadpool(con_conexion, _get_user_by_email, payload.correo)
 
     if not user:
         raise HTTPException(status_code=401, detail="Credenciales incorrectas")
@@ -96,19 +174,20 @@ def login(payload: LoginRequest):
 
     hashed = user.get("password_hash") or ""
     # Si tu BD aún tiene "HASH_TEMPORA" u otro placeholder, esto fallará.
-    if not hashed.startswith("$pbkdf2-sha256$"):
+    if not hash_soportado(hashed):
         raise HTTPException(
             status_code=500,
             detail="El password_hash de este usuario no está migrado a PBKDF2. Actualiza password_hash."
         )
 
-    if not verify_password(payload.password, hashed):
+    valida, nuevo_hash = await verify_and_update_password_async(payload.password, hashed)
+    if not valida:
         raise HTTPException(status_code=401, detail="Credenciales incorrectas")
 
-    token = create_access_token({
-        "sub": str(user["id_usuario"]),
-        "id_rol": user["id_rol"]
-    })
+    token = create_access_token(build_access_claims(user))
+    refresh_token = await run_in_threadpool(
+        con_conexion, _registrar_login, user["id_usuario"], hashed, nuevo_hash
+    )
 
     # devolver user sin password_hash
     user_public = {
@@ -120,7 +199,84 @@ def login(payload: LoginRequest):
         "correo": user["correo"],
     }
 
-    return {"access_token": token, "token_type": "bearer", "user": user_public}
+    return {
+        "access_token": token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "user": user_public,
+    }
+
+@router.post("/refresh", summary="Rota el refresh token y devuelve un nuevo access token")
+def refresh(payload: RefreshRequest, conn: PooledConnection = Depends(get_db)):
+    """
+    Cambia un refresh token válido por un access token nuevo y un refresh token nuevo
+    (el anterior queda revocado). No verifica la contraseña: el hash PBKDF2 se
+    valida una sola vez por sesión, en /auth/login.
+    Si llega un refresh token ya rotado (posible robo), se revoca toda la sesión.
+    """
+    token_hash = hash_refresh_token(payload.refresh_token)
+    conn.begin()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT
+                    rt.id_refresh, rt.familia, rt.fecha_expiracion, rt.revocado,
+                    u.id_usuario, u.id_rol, u.id_estado_cuenta, u.id_entidad, u.correo,
+                    u.nombre_completo
+                FROM refresh_tokens rt
+                JOIN usuarios u ON u.id_usuario = rt.id_usuario
+                WHERE rt.token_hash = %s
+                FOR UPDATE;
+            """, (token_hash,))
+            row = cursor.fetchone()
+
+            if not row:
+                raise HTTPException(status_code=401, detail="Refresh token inválido")
+
+            if row["revocado"]:
+                cursor.execute(
+                    "UPDATE refresh_tokens SET revocado = 1 WHERE familia = %s AND revocado = 0;",
+                    (row["familia"],)
+                )
+                conn.commit()
+                raise HTTPException(status_code=401, detail="Refresh token reutilizado: sesión revocada")
+
+            if datetime.now() > row["fecha_expiracion"]:
+                raise HTTPException(status_code=401, detail="Refresh token expirado")
+
+            if row["id_estado_cuenta"] != 1:
+                raise HTTPException(status_code=403, detail="Cuenta no activa")
+
+            cursor.execute(
+                "UPDATE refresh_tokens SET revocado = 1 WHERE id_refresh = %s;",
+                (row["id_refresh"],)
+            )
+            nuevo_refresh = _emitir_refresh_token(cursor, row["id_usuario"], row["familia"])
+        conn.commit()
+    except HTTPException:
+        raise
+    except pymysql.MySQLError as e:
+        raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
+
+    return {
+        "access_token": create_access_token(build_access_claims(row)),
+        "refresh_token": nuevo_refresh,
+        "token_type": "bearer",
+    }
+
+@router.post("/logout", summary="Revoca la sesión del refresh token")
+def logout(payload: RefreshRequest, conn: PooledConnection = Depends(get_db)):
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE refresh_tokens t
+                JOIN refresh_tokens actual ON actual.familia = t.familia
+                SET t.revocado = 1
+                WHERE actual.token_hash = %s AND t.revocado = 0;
+            """, (hash_refresh_token(payload.refresh_token),))
+    except pymysql.MySQLError as e:
+        raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
+    return {"message": "Sesión cerrada"}
 
 @router.get("/me", summary="Devuelve el usuario logueado (token)")
 def me(current_user: Dict[str, Any] = Depends(get_current_user)):
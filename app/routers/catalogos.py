@@ -1,32 +1,98 @@
-from fastapi import APIRouter, HTTPException
+import os
+from typing import Any, Optional
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import JSONResponse
 import pymysql
-from app.db.database import get_connection
+from app.db.database import PooledConnection, get_db, get_connection
+from app.core.deps import require_roles
+from app.services.catalogos import almacen_catalogos
 
 router = APIRouter(prefix="/catalogos", tags=["catalogos"])
 
-def fetch_all(query: str):
-    conn = get_connection()
+# Los catálogos se sirven desde memoria (cargados al arrancar). El cliente guarda
+# el ETag y revalida con If-None-Match: si nada cambió recibe un 304 sin cuerpo.
+CATALOGOS_MAX_AGE = int(os.getenv("CATALOGOS_MAX_AGE", "300"))
+
+
+def _asegurar_catalogos() -> None:
+    """Solo toca la BD si los catálogos no se pudieron cargar al arrancar."""
+    if almacen_catalogos.cargado:
+        return
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(query)
-            return cursor.fetchall()
+        conn = get_connection()
+        try:
+            almacen_catalogos.asegurar_cargado(conn)
+        finally:
+            conn.close()
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
+
+
+def _etag_coincide(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidatos = [v.strip().removeprefix("W/") for v in if_none_match.split(",")]
+    return etag in candidatos
+
+
+def _responder(request: Request, contenido: Any, version: Optional[str]) -> Response:
+    etag = f'"{version}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={CATALOGOS_MAX_AGE}, must-revalidate",
+    }
+    if _etag_coincide(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=contenido, headers=headers)
+
+
+def _catalogo(request: Request, catalogo: str) -> Response:
+    _asegurar_catalogos()
+    return _responder(request, almacen_catalogos.filas(catalogo), almacen_catalogos.hash(catalogo))
+
 
 @router.get("/estado-reporte")
-def estados_reporte():
-    return fetch_all("SELECT id_estado, nombre FROM estado_reporte ORDER BY id_estado;")
+def estados_reporte(request: Request):
+    return _catalogo(request, "estado_reporte")
 
 @router.get("/tipo-incidente")
-def tipos_incidente():
-    return fetch_all("SELECT id_tipo_incidente, nombre FROM tipo_incidente ORDER BY id_tipo_incidente;")
+def tipos_incidente(request: Request):
+    return _catalogo(request, "tipo_incidente")
 
 @router.get("/severidad")
-def severidades():
-    return fetch_all("SELECT id_severidad, nombre FROM severidad ORDER BY id_severidad;")
+def severidades(request: Request):
+    return _catalogo(request, "severidad")
 
 @router.get("/categoria-incidente")
-def categorias():
-    return fetch_all("SELECT id_categoria, nombre FROM categoria_incidente ORDER BY id_categoria;")
+def categorias(request: Request):
+    return _catalogo(request, "categoria_incidente")
+
+@router.get("/bootstrap", summary="Todos los catálogos en una sola respuesta (con ETag)")
+def bootstrap(
+    request: Request,
+    since: Optional[str] = Query(None, description="version que ya tiene el cliente: solo llegan los catálogos que cambiaron"),
+):
+    """
+    Lo que la app necesita al arrancar, en una sola petición. Con If-None-Match
+    igual a la versión que ya tiene, responde 304 sin cuerpo.
+    Con ?since=<version> responde solo los catálogos que cambiaron desde esa versión
+    (completo=false); si la versión no se reconoce, responde todo (completo=true).
+    """
+    _asegurar_catalogos()
+    version = almacen_catalogos.version
+    cambios = almacen_catalogos.cambios_desde(since) if since else None
+    completo = cambios is None
+    catalogos = almacen_catalogos.todos() if completo else cambios
+    return _responder(request, {"version": version, "completo": completo, **catalogos}, version)
+
+@router.post("/recargar", summary="Recargar los catálogos en memoria (solo ADMIN)")
+def recargar_catalogos(user=Depends(require_roles(4)), conn: PooledConnection = Depends(get_db)):
+    """Para cuando se edita un catálogo directamente en la BD: los nombres se vuelven a leer."""
+    try:
+        almacen_catalogos.recargar(conn)
+    except pymysql.MySQLError as e:
+        raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
+    return {"message": "Catálogos recargados", "version": almacen_catalogos.version}
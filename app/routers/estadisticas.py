@@ -0,0 +1,142 @@
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Literal, Optional
+from fastapi import APIRouter, HTTPException, Depends, Query
+import pymysql
+
+from app.db.database import PooledConnection, get_db
+from app.core.deps import require_roles
+from app.services import estadisticas
+
+router = APIRouter(prefix="/estadisticas", tags=["Estadísticas"])
+
+ROLE_ENTIDAD = 2
+
+# Puntos máximos por serie (evita pedir años día por día)
+SERIE_PUNTOS_MAX = 1000
+
+
+def _entidad_visible(user: Dict[str, Any], id_entidad: Optional[int]) -> Optional[int]:
+    """Un usuario ENTIDAD solo ve su propia entidad, pida lo que pida."""
+    if user["id_rol"] == ROLE_ENTIDAD:
+        if not user.get("id_entidad"):
+            raise HTTPException(status_code=403, detail="Usuario ENTIDAD sin id_entidad asignado")
+        return user["id_entidad"]
+    return id_entidad
+
+
+@router.get(
+    "/",
+    summary="Conteo de reportes por estado, tipo, severidad y entidad (ENTIDAD / MODERADOR / ADMIN)"
+)
+def resumen_estadisticas(
+    desde: Optional[datetime] = Query(None, description="created_at >= desde (por día)"),
+    hasta: Optional[datetime] = Query(None, description="created_at < hasta (por día)"),
+    id_entidad: Optional[int] = Query(None, ge=0, description="0 = reportes sin entidad"),
+    user: Dict[str, Any] = Depends(require_roles(2, 3, 4)),
+    conn: PooledConnection = Depends(get_db),
+) -> Dict[str, Any]:
+    """
+    Sale de la tabla resumen estadisticas_reportes: el costo depende del número
+    de grupos, no del número de reportes. Un usuario ENTIDAD solo ve su entidad.
+    """
+    id_entidad = _entidad_visible(user, id_entidad)
+
+    try:
+        return estadisticas.resumen(
+            conn,
+            desde=desde.date() if desde else None,
+            hasta=hasta.date() if hasta else None,
+            id_entidad=id_entidad,
+        )
+    except pymysql.MySQLError as e:
+        raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
+
+
+@router.get(
+    "/serie",
+    summary="Reportes creados y resueltos en el tiempo (ENTIDAD / MODERADOR / ADMIN)"
+)
+def serie_estadisticas(
+    desde: Optional[date] = Query(None, description="Inicio (incluido). Por defecto: hace 30 días"),
+    hasta: Optional[date] = Query(None, description="Fin (excluido). Por defecto: mañana"),
+    granularidad: Literal["dia", "semana", "mes"] = Query("dia"),
+    tipo: Optional[int] = Query(None, ge=1, description="id_tipo_incidente"),
+    id_entidad: Optional[int] = Query(None, ge=0, description="0 = reportes sin entidad"),
+    user: Dict[str, Any] = Depends(require_roles(2, 3, 4)),
+    conn: PooledConnection = Depends(get_db),
+) -> Dict[str, Any]:
+    """
+    Sale de los rollups diarios de estadisticas_diarias: el costo depende del número
+    de días del rango, no del número de reportes ni del tamaño del historial.
+    """
+    hasta = hasta or date.today() + timedelta(days=1)
+    desde = desde or hasta - timedelta(days=31)
+    if desde >= hasta:
+        raise HTTPException(status_code=400, detail="desde debe ser anterior a hasta")
+    dias_por_punto = {"dia": 1, "semana": 7, "mes": 28}[granularidad]
+    if (hasta - desde).days / dias_por_punto > SERIE_PUNTOS_MAX:
+        raise HTTPException(status_code=400, detail=f"Rango muy largo para granularidad={granularidad}")
+
+    try:
+        puntos = estadisticas.serie(
+            conn, desde, hasta, granularidad,
+            id_tipo_incidente=tipo,
+            id_entidad=_entidad_visible(user, id_entidad),
+        )
+    except pymysql.MySQLError as e:
+        raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
+
+    return {
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "granularidad": granularidad,
+        "serie": puntos,
+    }
+
+
+@router.get(
+    "/resolucion",
+    summary="Mediana y p90 del tiempo de resolución por entidad / tipo (ENTIDAD / MODERADOR / ADMIN)"
+)
+def tiempos_resolucion(
+    por: Literal["entidad", "tipo_incidente", "entidad_tipo"] = Query("entidad"),
+    desde: Optional[date] = Query(None, description="Resueltos desde (incluido)"),
+    hasta: Optional[date] = Query(None, description="Resueltos hasta (excluido)"),
+    tipo: Optional[int] = Query(None, ge=1, description="id_tipo_incidente"),
+    id_entidad: Optional[int] = Query(None, ge=0, description="0 = reportes sin entidad"),
+    user: Dict[str, Any] = Depends(require_roles(2, 3, 4)),
+    conn: PooledConnection = Depends(get_db),
+) -> Dict[str, Any]:
+    """
+    Tiempo desde la creación hasta el primer estado de ESTADOS_RESUELTOS, en horas.
+    Sale de reportes_resolucion (una fila por reporte resuelto), no del historial.
+    """
+    try:
+        grupos = estadisticas.tiempos_resolucion(
+            conn, por, desde, hasta,
+            id_entidad=_entidad_visible(user, id_entidad),
+            id_tipo_incidente=tipo,
+        )
+    except pymysql.MySQLError as e:
+        raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
+    return {"por": por, "grupos": grupos}
+
+
+@router.get(
+    "/tiempo-en-estado",
+    summary="Mediana y p90 del tiempo que los reportes pasan en cada estado (ENTIDAD / MODERADOR / ADMIN)"
+)
+def tiempo_en_estado(
+    desde: Optional[date] = Query(None, description="Tramos cerrados desde (incluido)"),
+    hasta: Optional[date] = Query(None, description="Tramos cerrados hasta (excluido)"),
+    id_entidad: Optional[int] = Query(None, ge=0, description="0 = reportes sin entidad"),
+    user: Dict[str, Any] = Depends(require_roles(2, 3, 4)),
+    conn: PooledConnection = Depends(get_db),
+) -> Dict[str, Any]:
+    try:
+        estados = estadisticas.tiempo_en_estado(
+            conn, desde, hasta, id_entidad=_entidad_visible(user, id_entidad),
+        )
+    except pymysql.MySQLError as e:
+        raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
+    return {"estados": estados}
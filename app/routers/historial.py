@@ -2,7 +2,7 @@ from typing import Any, Dict, List
 from fastapi import APIRouter, HTTPException, Depends
 import pymysql
 
-from app.db.database import get_connection
+from app.db.database import PooledConnection, get_db
 from app.core.deps import require_active_user
 
 # ✅ Sin prefix propio para no chocar con reportes.py
@@ -15,7 +15,8 @@ router = APIRouter(tags=["Historial"])
 )
 def historial_reporte(
     id_reporte: int,
-    user: Dict[str, Any] = Depends(require_active_user)
+    user: Dict[str, Any] = Depends(require_active_user),
+    conn: PooledConnection = Depends(get_db),
 ) -> List[Dict[str, Any]]:
     """
     Devuelve todos los cambios de estado de un reporte ordenados cronológicamente.
@@ -23,7 +24,6 @@ def historial_reporte(
     - ENTIDAD:   solo puede ver el historial de reportes de su entidad.
     - MODERADOR / ADMIN: pueden ver cualquier historial.
     """
-    conn = get_connection()
     try:
         with conn.cursor() as cursor:
             # Verificar que el reporte existe
@@ -74,5 +74,3 @@ def historial_reporte(
         raise
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
\ No newline at end of file
@@ -1,10 +1,20 @@
-from typing import Any, Dict, List, Optional
-from fastapi import APIRouter, HTTPException, Depends
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Literal, Optional
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 import pymysql
 
-from app.db.database import get_connection
+from app.db.database import PooledConnection, get_db
 from app.core.deps import require_active_user, require_roles
+from app.core.geo import filtro_espacial
+from app.services.puntos import capa_infraestructura
+from app.services.indice_espacial import indice_infraestructura
+from app.services.importacion import IMPORTACION_LOTE, ArchivoInvalido, importar
 
 router = APIRouter(prefix="/infraestructura", tags=["Infraestructura Hídrica"])
 
@@ -34,6 +44,76 @@ class InfraestructuraUpdate(BaseModel):
     estado: Optional[str] = Field(None, max_length=40)
 
 
+# =========================
+# HELPERS
+# =========================
+
+GEOJSON_CHUNK_BYTES = 64 * 1024
+
+# Margen al leer cambios: una fila con fecha_actualizacion anterior al token pudo
+# confirmarse después de la última sincronización (transacción larga). Repetir
+# unas filas es inofensivo para el cliente; perderlas no.
+SYNC_SOLAPE_SEG = float(os.getenv("SYNC_SOLAPE_SEG", "120"))
+
+# Importación: el cuerpo se copia a un archivo temporal (en memoria hasta
+# IMPORTACION_MEMORIA_BYTES, luego a disco) y se procesa fila por fila.
+IMPORTACION_MAX_BYTES = int(os.getenv("IMPORTACION_MAX_BYTES", str(200 * 1024 * 1024)))
+IMPORTACION_MEMORIA_BYTES = 8 * 1024 * 1024
+
+
+def _parse_since(since: str) -> datetime:
+    """Token de sincronización: fecha ISO (la que devolvió el servidor) o epoch en segundos."""
+    try:
+        return datetime.fromtimestamp(float(since))
+    except (ValueError, OverflowError, OSError):
+        pass
+    try:
+        return datetime.fromisoformat(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since debe ser una fecha ISO o un epoch en segundos")
+
+
+def _stream_geojson(conn: PooledConnection, sql: str, params: List[Any], precision: int) -> Iterator[bytes]:
+    """
+    FeatureCollection generado fila por fila desde un cursor sin buffer (SSDictCursor):
+    la memoria no crece con el tamaño de la tabla y el primer byte sale enseguida.
+    Usa la conexión del request: get_db la devuelve al pool recién cuando terminó
+    de enviarse el cuerpo, así que cada stream ocupa un solo lugar del pool.
+    """
+    with conn.cursor(pymysql.cursors.SSDictCursor) as cursor:
+        cursor.execute(sql, params)
+        buffer = bytearray(b'{"type":"FeatureCollection","features":[')
+        separador = b""
+        for row in cursor:
+            feature = {
+                "type": "Feature",
+                "id": row["id_infraestructura"],
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [
+                        round(float(row["longitud"]), precision),
+                        round(float(row["latitud"]), precision),
+                    ],
+                },
+                "properties": {
+                    "nombre": row["nombre"],
+                    "tipo": row["tipo"],
+                    "fuente": row["fuente"],
+                    "estado": row["estado"],
+                    "fecha_actualizacion": row["fecha_actualizacion"],
+                },
+            }
+            buffer += separador
+            buffer += json.dumps(feature, ensure_ascii=False, default=str,
+                                 separators=(",", ":")).encode("utf-8")
+            separador = b","
+            if len(buffer) >= GEOJSON_CHUNK_BYTES:
+                yield bytes(buffer)
+                buffer.clear()
+        buffer += b"]}"
+        yield bytes(buffer)
+
+
 # =========================
 # ENDPOINTS
 # =========================
@@ -43,34 +123,143 @@ class InfraestructuraUpdate(BaseModel):
     summary="Listar toda la infraestructura hídrica"
 )
 def listar_infraestructura(
-    user: Dict[str, Any] = Depends(require_active_user)  # ✅ Requiere token
+    bbox: Optional[str] = Query(None, description="Vista del mapa: min_lon,min_lat,max_lon,max_lat"),
+    lat: Optional[float] = Query(None, description="Centro para búsqueda por radio"),
+    lon: Optional[float] = Query(None, description="Centro para búsqueda por radio"),
+    radio_m: Optional[float] = Query(None, description="Radio en metros alrededor de lat/lon"),
+    formato: Literal["json", "geojson"] = Query("json", alias="format",
+                                                description="geojson = FeatureCollection en streaming"),
+    precision: int = Query(6, ge=0, le=10, description="Decimales de las coordenadas (solo geojson)"),
+    user: Dict[str, Any] = Depends(require_active_user),  # ✅ Requiere token
+    conn: PooledConnection = Depends(get_db),
 ) -> List[Dict[str, Any]]:
     """
-    Devuelve todos los puntos de infraestructura hídrica.
+    Devuelve los puntos de infraestructura hídrica.
     Estos datos se usan para pintar la capa en el mapa del geovisor.
+    Con bbox (o lat/lon/radio_m) solo devuelve los puntos dentro de la vista.
+    Con ?format=geojson responde un FeatureCollection en streaming (memoria constante).
     Accesible para todos los roles activos.
     """
-    conn = get_connection()
+    condiciones, params = filtro_espacial("latitud", "longitud", bbox, lat, lon, radio_m)
+    where = (" WHERE " + " AND ".join(condiciones)) if condiciones else ""
+    sql = f"""
+        SELECT
+            id_infraestructura,
+            nombre,
+            tipo,
+            latitud,
+            longitud,
+            fuente,
+            estado,
+            fecha_actualizacion
+        FROM infraestructura_hidrica
+        {where}
+        ORDER BY nombre ASC;
+    """
+
+    if formato == "geojson":
+        return StreamingResponse(
+            _stream_geojson(conn, sql, params, precision),
+            media_type="application/geo+json",
+        )
+
     try:
         with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT
-                    id_infraestructura,
-                    nombre,
-                    tipo,
-                    latitud,
-                    longitud,
-                    fuente,
-                    estado,
-                    fecha_actualizacion
-                FROM infraestructura_hidrica
-                ORDER BY nombre ASC;
-            """)
+            cursor.execute(sql, params)
             return cursor.fetchall()
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
+
+
+@router.get(
+    "/cercanos",
+    summary="Infraestructura más cercana a un punto (k vecinos)"
+)
+def infraestructura_cercana(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(5, ge=1, le=100),
+    tipo: Optional[str] = Query(None, description="Ej: PTAR, ACUEDUCTO, POZO"),
+    radio_max_m: Optional[float] = Query(None, gt=0, description="Distancia máxima en metros"),
+    user: Dict[str, Any] = Depends(require_active_user),
+    conn: PooledConnection = Depends(get_db),
+) -> List[Dict[str, Any]]:
+    """
+    Responde desde el índice espacial en memoria (grilla), sin recorrer la tabla:
+    los k puntos más cercanos con su distancia en metros.
+    """
+    try:
+        capa_infraestructura.asegurar_cargada(conn)
+    except pymysql.MySQLError as e:
+        raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
+
+    resultado = []
+    for distancia, id_infraestructura in indice_infraestructura.cercanos(lat, lon, k, tipo, radio_max_m):
+        registro = capa_infraestructura.obtener(id_infraestructura)
+        if registro is None:
+            continue
+        resultado.append({
+            "id_infraestructura": id_infraestructura,
+            "nombre": registro["nombre"],
+            "tipo": registro["tipo"],
+            "estado": registro["estado"],
+            "latitud": registro["latitud"],
+            "longitud": registro["longitud"],
+            "distancia_m": round(distancia, 1),
+        })
+    return resultado
+
+
+@router.get(
+    "/cambios",
+    summary="Cambios de infraestructura desde la última sincronización (delta)"
+)
+def cambios_infraestructura(
+    since: Optional[str] = Query(None, description="Token 'since' de la respuesta anterior; vacío = foto completa"),
+    user: Dict[str, Any] = Depends(require_active_user),
+    conn: PooledConnection = Depends(get_db),
+) -> Dict[str, Any]:
+    """
+    Feed para clientes móviles: solo los puntos creados/modificados (por fecha_actualizacion)
+    y los ids eliminados (lápidas) desde `since`. El cliente guarda el `since` de la
+    respuesta y lo envía en la siguiente sincronización.
+    """
+    desde = _parse_since(since) - timedelta(seconds=SYNC_SOLAPE_SEG) if since else None
+    try:
+        with conn.cursor() as cursor:
+            # El token se toma ANTES de leer: lo que cambie durante la lectura sale la próxima vez
+            cursor.execute("SELECT NOW() AS ahora;")
+            ahora = cursor.fetchone()["ahora"]
+
+            sql = """
+                SELECT id_infraestructura, nombre, tipo, latitud, longitud,
+                       fuente, estado, fecha_actualizacion
+                FROM infraestructura_hidrica
+            """
+            if desde is None:
+                cursor.execute(sql + " ORDER BY id_infraestructura;")
+                cambios = cursor.fetchall()
+                eliminados = []
+            else:
+                cursor.execute(
+                    sql + " WHERE fecha_actualizacion >= %s ORDER BY fecha_actualizacion, id_infraestructura;",
+                    (desde,)
+                )
+                cambios = cursor.fetchall()
+                cursor.execute(
+                    "SELECT id_infraestructura FROM infraestructura_eliminada WHERE fecha_eliminacion >= %s;",
+                    (desde,)
+                )
+                eliminados = [r["id_infraestructura"] for r in cursor.fetchall()]
+    except pymysql.MySQLError as e:
+        raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
+
+    return {
+        "since": ahora.isoformat(),
+        "completo": desde is None,
+        "cambios": cambios,
+        "eliminados": eliminados,
+    }
 
 
 @router.get(
@@ -79,9 +268,9 @@ def listar_infraestructura(
 )
 def detalle_infraestructura(
     id_infraestructura: int,
-    user: Dict[str, Any] = Depends(require_active_user)
+    user: Dict[str, Any] = Depends(require_active_user),
+    conn: PooledConnection = Depends(get_db),
 ) -> Dict[str, Any]:
-    conn = get_connection()
     try:
         with conn.cursor() as cursor:
             cursor.execute(
@@ -96,8 +285,6 @@ def detalle_infraestructura(
         raise
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
 
 
 @router.post(
@@ -107,9 +294,9 @@ def detalle_infraestructura(
 )
 def crear_infraestructura(
     data: InfraestructuraCreate,
-    user: Dict[str, Any] = Depends(require_roles(3, 4))  # ✅ Solo MODERADOR y ADMIN
+    user: Dict[str, Any] = Depends(require_roles(3, 4)),  # ✅ Solo MODERADOR y ADMIN
+    conn: PooledConnection = Depends(get_db),
 ) -> Dict[str, Any]:
-    conn = get_connection()
     try:
         with conn.cursor() as cursor:
             cursor.execute("""
@@ -122,14 +309,66 @@ def crear_infraestructura(
                 data.fuente, data.estado
             ))
             nuevo_id = cursor.lastrowid
+        capa_infraestructura.upsert({"id_infraestructura": nuevo_id, **data.model_dump()})
         return {
             "message": "Infraestructura registrada exitosamente",
             "id_infraestructura": nuevo_id
         }
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
+
+
+@router.post(
+    "/importar",
+    summary="Importar inventario de infraestructura en CSV o GeoJSON (MODERADOR / ADMIN)"
+)
+async def importar_infraestructura(
+    request: Request,
+    formato: Optional[Literal["csv", "geojson"]] = Query(
+        None, description="Por defecto según Content-Type (text/csv o application/geo+json)"),
+    fuente: str = Query("SIASAR", min_length=1, max_length=200),
+    lote: int = Query(IMPORTACION_LOTE, ge=1, le=5000, description="Filas por INSERT"),
+    user: Dict[str, Any] = Depends(require_roles(3, 4)),  # ✅ Solo MODERADOR y ADMIN
+    conn: PooledConnection = Depends(get_db),
+) -> Dict[str, Any]:
+    """
+    El cuerpo es el archivo tal cual (no multipart). Cada fila se valida como en
+    POST /infraestructura y se hace upsert por lotes sobre (fuente, codigo_externo):
+    reimportar el mismo inventario actualiza en vez de duplicar. Las filas inválidas
+    no detienen la importación; se reportan en `errores` con su número de fila.
+    """
+    if formato is None:
+        content_type = request.headers.get("content-type", "")
+        formato = "geojson" if "json" in content_type else "csv"
+
+    leidos = 0
+    with tempfile.SpooledTemporaryFile(max_size=IMPORTACION_MEMORIA_BYTES) as archivo:
+        async for bloque in request.stream():
+            leidos += len(bloque)
+            if leidos > IMPORTACION_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="Archivo demasiado grande")
+            archivo.write(bloque)
+        if not leidos:
+            raise HTTPException(status_code=400, detail="El archivo está vacío")
+        archivo.seek(0)
+
+        try:
+            resumen = await run_in_threadpool(
+                importar, conn, archivo, formato, fuente, InfraestructuraCreate, lote,
+            )
+        except pymysql.MySQLError as e:
+            raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
+        except ArchivoInvalido as e:
+            raise HTTPException(status_code=400, detail=f"Archivo mal formado: {str(e)}")
+        finally:
+            # Un solo recargo de la capa (y del índice espacial) al final, no punto por
+            # punto; también si falló a mitad, porque los lotes anteriores ya quedaron.
+            try:
+                await run_in_threadpool(capa_infraestructura.cargar, conn)
+            except pymysql.MySQLError:
+                pass
+
+    return resumen
 
 
 @router.put(
@@ -139,9 +378,9 @@ def crear_infraestructura(
 def actualizar_infraestructura(
     id_infraestructura: int,
     data: InfraestructuraUpdate,
-    user: Dict[str, Any] = Depends(require_roles(3, 4))  # ✅ Solo MODERADOR y ADMIN
+    user: Dict[str, Any] = Depends(require_roles(3, 4)),  # ✅ Solo MODERADOR y ADMIN
+    conn: PooledConnection = Depends(get_db),
 ) -> Dict[str, Any]:
-    conn = get_connection()
     try:
         with conn.cursor() as cursor:
             cursor.execute(
@@ -164,10 +403,35 @@ def actualizar_infraestructura(
                 f"WHERE id_infraestructura = %s;",
                 valores
             )
+        capa_infraestructura.actualizar(id_infraestructura, **campos)
         return {"message": "Infraestructura actualizada exitosamente"}
     except HTTPException:
         raise
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
+
+
+@router.delete(
+    "/{id_infraestructura}",
+    summary="Eliminar infraestructura hídrica (MODERADOR / ADMIN)"
+)
+def eliminar_infraestructura(
+    id_infraestructura: int,
+    user: Dict[str, Any] = Depends(require_roles(3, 4)),  # ✅ Solo MODERADOR y ADMIN
+    conn: PooledConnection = Depends(get_db),
+) -> Dict[str, Any]:
+    """El trigger de la BD deja la lápida en infraestructura_eliminada para el feed de cambios."""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM infraestructura_hidrica WHERE id_infraestructura = %s;",
+                (id_infraestructura,)
+            )
+            if cursor.rowcount == 0:
+                raise HTTPException(status_code=404, detail="Infraestructura no encontrada")
+        capa_infraestructura.eliminar(id_infraestructura)
+        return {"message": "Infraestructura eliminada exitosamente"}
+    except HTTPException:
+        raise
+    except pymysql.MySQLError as e:
+        raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
@@ -0,0 +1,41 @@
+from typing import Any, Dict, Literal
+from fastapi import APIRouter, HTTPException, Depends, Query
+import pymysql
+
+from app.db.database import PooledConnection, get_db
+from app.core.deps import require_active_user
+from app.core.geo import parse_bbox
+from app.services.puntos import CAPAS, alcance_reportes
+from app.services.clusters import clusters_tesela
+from app.services.teselas import ZOOM_MAX, teselas_de_bbox
+
+router = APIRouter(prefix="/mapa", tags=["Mapa"])
+
+
+@router.get(
+    "/clusters",
+    summary="Clusters de puntos por zoom para la vista del mapa"
+)
+def clusters(
+    capa: Literal["reportes", "infraestructura"],
+    z: int = Query(..., ge=0, le=ZOOM_MAX, description="Zoom del mapa"),
+    bbox: str = Query(..., description="Vista del mapa: min_lon,min_lat,max_lon,max_lat"),
+    user: Dict[str, Any] = Depends(require_active_user),
+    conn: PooledConnection = Depends(get_db),
+) -> Dict[str, Any]:
+    """
+    Devuelve los puntos ya agrupados en el servidor: por cada celda de la grilla
+    del zoom, el total, el centroide y el desglose por tipo (y severidad en reportes).
+    Los reportes respetan la misma visibilidad por rol que GET /reportes.
+    """
+    capa_puntos = CAPAS[capa]
+    alcance = alcance_reportes(user) if capa == "reportes" else None
+    try:
+        capa_puntos.asegurar_cargada(conn)
+    except pymysql.MySQLError as e:
+        raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
+
+    resultado = []
+    for x, y in teselas_de_bbox(parse_bbox(bbox), z):
+        resultado.extend(clusters_tesela(capa_puntos, z, x, y, alcance))
+    return {"capa": capa, "z": z, "clusters": resultado}
@@ -1,13 +1,30 @@
-from typing import Any, Dict, List
-from fastapi import APIRouter, HTTPException, Depends
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials
 from pydantic import BaseModel, Field
 import pymysql
 
-from app.db.database import get_connection
-from app.core.deps import require_active_user
+from app.db.database import PooledConnection, get_db, get_connection
+from app.core.deps import (
+    bearer_scheme, require_active_user, require_active_user_stream, sesion_stream, sesion_vigente,
+)
+from app.core.security import STREAM_TICKET_SEG, crear_ticket_stream, decode_token
+from app.services.canal_notificaciones import canal_notificaciones
 
 router = APIRouter(prefix="/notificaciones", tags=["Notificaciones"])
 
+# Comentario SSE cada N segundos: mantiene viva la conexión a través de proxies
+# y detecta clientes que se fueron.
+STREAM_KEEPALIVE_SEG = float(os.getenv("STREAM_KEEPALIVE_SEG", "20"))
+# Notificaciones reenviadas al reconectar con Last-Event-ID
+STREAM_REENVIO_MAX = 100
+
 
 class MarcarLeidaRequest(BaseModel):
     leida: bool = Field(True, description="true para marcar como leída, false para no leída")
@@ -19,13 +36,14 @@ class MarcarLeidaRequest(BaseModel):
 )
 def listar_mis_notificaciones(
     solo_no_leidas: bool = False,
-    user: Dict[str, Any] = Depends(require_active_user)  # ✅ id_usuario sale del token
+    user: Dict[str, Any] = Depends(require_active_user),  # ✅ id_usuario sale del token
+    conn: PooledConnection = Depends(get_db),
 ) -> Dict[str, Any]:
     """
     Devuelve las notificaciones del usuario autenticado.
     Parámetro opcional: ?solo_no_leidas=true para filtrar solo las pendientes.
+    Para enterarse de las nuevas no hace falta sondear: usar GET /notificaciones/stream.
     """
-    conn = get_connection()
     try:
         with conn.cursor() as cursor:
             query = """
@@ -61,19 +79,146 @@ def listar_mis_notificaciones(
         }
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
+
+
+# =========================
+# STREAM (SERVER-SENT EVENTS)
+# =========================
+
+def _evento(tipo: str, datos: Dict[str, Any], id_evento: Optional[int] = None) -> str:
+    datos = json.dumps(
+        datos, ensure_ascii=False, separators=(",", ":"),
+        default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v),
+    )
+    cabecera = f"id: {id_evento}\n" if id_evento is not None else ""
+    return f"{cabecera}event: {tipo}\ndata: {datos}\n\n"
+
+
+def _estado_inicial(id_usuario: int, ultimo_id: Optional[int]) -> Tuple[int, List[Dict[str, Any]]]:
+    """No leídas + lo que llegó mientras el cliente estaba desconectado (id > Last-Event-ID)."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) AS total FROM notificaciones WHERE id_usuario = %s AND leida = 0;",
+                (id_usuario,)
+            )
+            no_leidas = cursor.fetchone()["total"]
+            pendientes: List[Dict[str, Any]] = []
+            if ultimo_id is not None:
+                cursor.execute("""
+                    SELECT id_notificacion, id_usuario, id_reporte, tipo_notificacion,
+                           mensaje, leida, fecha_envio
+                    FROM notificaciones
+                    WHERE id_usuario = %s AND id_notificacion > %s
+                    ORDER BY id_notificacion
+                    LIMIT %s;
+                """, (id_usuario, ultimo_id, STREAM_REENVIO_MAX))
+                pendientes = list(cursor.fetchall())
+        return no_leidas, pendientes
     finally:
         conn.close()
 
 
+async def _eventos(request: Request, id_usuario: int, sesion: Dict[str, Any],
+                   ultimo_id: Optional[int]) -> AsyncIterator[str]:
+    # Suscribirse ANTES de leer la BD: lo que se confirme entre medio llega por la cola
+    cola = canal_notificaciones.suscribir(id_usuario)
+    try:
+        no_leidas, pendientes = await run_in_threadpool(_estado_inicial, id_usuario, ultimo_id)
+        yield "retry: 5000\n\n"
+        yield _evento("inicio", {"total_no_leidas": no_leidas})
+        enviados = set()
+        for notificacion in pendientes:
+            enviados.add(notificacion["id_notificacion"])
+            yield _evento("notificacion", notificacion, notificacion["id_notificacion"])
+
+        while True:
+            try:
+                notificacion = await asyncio.wait_for(cola.get(), timeout=STREAM_KEEPALIVE_SEG)
+            except asyncio.TimeoutError:
+                notificacion = False
+            # La sesión se validó al conectar: si el access token expira o se revoca
+            # (cuenta suspendida) el stream se cierra y el cliente debe reconectar.
+            if not sesion_vigente(sesion):
+                yield _evento("cerrado", {"motivo": "token_invalido"})
+                break
+            if notificacion is False:
+                if await request.is_disconnected():
+                    break
+                yield ": ping\n\n"
+                continue
+            if notificacion is None:       # el servidor se está apagando
+                break
+            if notificacion["id_notificacion"] in enviados:
+                continue
+            yield _evento("notificacion", notificacion, notificacion["id_notificacion"])
+    finally:
+        canal_notificaciones.cancelar(id_usuario, cola)
+
+
+@router.post(
+    "/stream/ticket",
+    summary="Ticket de un solo uso para abrir el stream desde EventSource"
+)
+def ticket_stream(
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+    user: Dict[str, Any] = Depends(require_active_user),
+) -> Dict[str, Any]:
+    """
+    EventSource no puede enviar Authorization, y un access token en la URL queda en
+    los logs. Este ticket va en ?ticket= de GET /notificaciones/stream: vence en
+    `expira_en` segundos, sirve para una sola conexión y no vale como access token.
+    Pedir uno nuevo antes de cada (re)conexión.
+    """
+    sesion_exp = decode_token(credentials.credentials)["exp"]
+    return {
+        "ticket": crear_ticket_stream(user["id_usuario"], sesion_exp),
+        "expira_en": STREAM_TICKET_SEG,
+    }
+
+
+@router.get(
+    "/stream",
+    summary="Notificaciones en vivo (Server-Sent Events)"
+)
+async def stream_notificaciones(
+    request: Request,
+    sesion: Dict[str, Any] = Depends(sesion_stream),
+    user: Dict[str, Any] = Depends(require_active_user_stream),  # ✅ Bearer o ?ticket=
+):
+    """
+    Reemplaza el sondeo de GET /notificaciones: la conexión queda abierta y recibe
+    cada notificación nueva apenas se confirma en la BD.
+    - `event: inicio`        -> {"total_no_leidas": n} al conectar
+    - `event: notificacion`  -> la notificación (id del evento = id_notificacion)
+    - `event: cerrado`       -> el token expiró o fue revocado; reconectar con uno nuevo
+    Con EventSource (no permite headers) se usa ?ticket= de POST /notificaciones/stream/ticket;
+    el access token no se acepta en la URL. Al reconectar, el navegador envía
+    Last-Event-ID y se reenvía lo que llegó mientras tanto.
+    """
+    ultimo = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+    try:
+        ultimo_id = int(ultimo) if ultimo else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Last-Event-ID inválido")
+
+    return StreamingResponse(
+        _eventos(request, user["id_usuario"], sesion, ultimo_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.put(
     "/marcar-todas-leidas",
     summary="Marcar todas mis notificaciones como leídas"
 )
 def marcar_todas_leidas(
-    user: Dict[str, Any] = Depends(require_active_user)
+    user: Dict[str, Any] = Depends(require_active_user),
+    conn: PooledConnection = Depends(get_db),
 ) -> Dict[str, Any]:
     """Marca todas las notificaciones no leídas del usuario autenticado."""
-    conn = get_connection()
     try:
         with conn.cursor() as cursor:
             cursor.execute(
@@ -83,8 +228,6 @@ def marcar_todas_leidas(
         return {"message": "Todas las notificaciones marcadas como leídas"}
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
 
 
 @router.put(
@@ -94,9 +237,9 @@ def marcar_todas_leidas(
 def marcar_leida(
     id_notificacion: int,
     payload: MarcarLeidaRequest,
-    user: Dict[str, Any] = Depends(require_active_user)  # ✅ Requiere token
+    user: Dict[str, Any] = Depends(require_active_user),  # ✅ Requiere token
+    conn: PooledConnection = Depends(get_db),
 ) -> Dict[str, Any]:
-    conn = get_connection()
     try:
         with conn.cursor() as cursor:
             # Verificar que existe y pertenece al usuario autenticado
@@ -126,5 +269,3 @@ def marcar_leida(
         raise
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
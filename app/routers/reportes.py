@@ -1,10 +1,21 @@
-from typing import Optional, Any, Dict, List
-from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel, Field
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Any, Dict, List, Tuple
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, ValidationError
 from pymysql.err import IntegrityError, ProgrammingError, OperationalError
 
-from app.db.database import get_connection
+from app.db.database import PooledConnection, get_db
 from app.core.deps import require_active_user
+from app.core.geo import filtro_espacial, parse_bbox
+from app.services.puntos import capa_reportes, alcance_reportes
+from app.services.heatmap import mapa_calor
+from app.services import estadisticas
+from app.services.catalogos import almacen_catalogos
+from app.services.municipios import indice_municipios
+from app.services.canal_notificaciones import canal_notificaciones
 
 router = APIRouter(prefix="/reportes", tags=["reportes"])
 
@@ -17,6 +28,16 @@ ROLE_ADMIN     = 4
 # Estado cuenta según tu tabla estado_cuenta:
 ESTADO_CUENTA_ACTIVO = 1
 
+# Estado con el que nace todo reporte (estado_reporte):
+ID_ESTADO_INICIAL = 1  # PENDIENTE
+
+# Paginación de GET /reportes
+REPORTES_LIMITE_DEFAULT = 50
+REPORTES_LIMITE_MAX     = 200
+
+# POST /reportes/lote
+LOTE_MAX = 500
+
 
 # =========================
 # MODELOS
@@ -31,12 +52,19 @@ class ReporteCreateRequest(BaseModel):
     id_severidad:      int  = Field(..., ge=1)
     descripcion:       str  = Field(..., min_length=1, max_length=5000)
     direccion:  Optional[str]   = Field(None, max_length=255)
-    latitud:    Optional[float] = None
-    longitud:   Optional[float] = None
+    latitud:    Optional[float] = Field(None, ge=-90, le=90)
+    longitud:   Optional[float] = Field(None, ge=-180, le=180)
     imagen_url: Optional[str]   = Field(None, max_length=500)
     fuente_reporte: str = Field("CIUDADANO", max_length=50)
 
 
+class ReporteLoteItem(ReporteCreateRequest):
+    clave_idempotencia: str = Field(
+        ..., min_length=1, max_length=64,
+        description="Generada por el cliente (ej. UUID). Reenviar la misma clave no duplica el reporte."
+    )
+
+
 class CambiarEstadoRequest(BaseModel):
     id_estado_nuevo:    int           = Field(..., ge=1)
     comentario: Optional[str]         = Field(None, max_length=500)
@@ -62,12 +90,31 @@ def _raise_db_error(e: Exception):
     raise HTTPException(status_code=500, detail=f"DB error: {e}")
 
 
-def _get_usuario_entidad(cursor, id_usuario: int) -> Optional[int]:
-    cursor.execute("SELECT id_entidad FROM usuarios WHERE id_usuario = %s;", (id_usuario,))
-    row = cursor.fetchone()
-    if not row:
-        raise HTTPException(status_code=400, detail="id_usuario no existe en la tabla usuarios")
-    return row.get("id_entidad")
+def _filtro_visibilidad(user: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    """Condiciones WHERE (sobre alias r) que limitan los reportes visibles según el rol."""
+    if user["id_rol"] == ROLE_CIUDADANO:
+        return ["r.id_usuario = %s"], [user["id_usuario"]]
+    if user["id_rol"] == ROLE_ENTIDAD:
+        if not user.get("id_entidad"):
+            raise HTTPException(status_code=403, detail="Usuario ENTIDAD sin id_entidad asignado")
+        return ["r.id_entidad = %s"], [user["id_entidad"]]
+    if user["id_rol"] in (ROLE_MODERADOR, ROLE_ADMIN):
+        return [], []
+    raise HTTPException(status_code=403, detail="Rol desconocido")
+
+
+def _codificar_cursor(row: Dict[str, Any]) -> str:
+    raw = json.dumps([row["created_at"].isoformat(), row["id_reporte"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decodificar_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        fecha, id_reporte = json.loads(raw)
+        return datetime.fromisoformat(fecha), int(id_reporte)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="cursor inválido")
 
 
 def _select_reporte_detalle_sql() -> str:
@@ -78,97 +125,250 @@ def _select_reporte_detalle_sql() -> str:
       r.direccion,
       r.latitud,
       r.longitud,
+      r.codigo_municipio,
+      r.municipio,
       r.imagen_url,
       r.fuente_reporte,
+      r.clave_idempotencia,
       r.created_at,
       r.id_usuario,
       r.id_entidad,
       r.id_tipo_incidente,
       r.id_severidad,
       r.id_estado,
-      u.nombre_completo AS usuario,
-      er.nombre         AS estado,
-      ti.nombre         AS tipo_incidente,
-      s.nombre          AS severidad
+      u.nombre_completo AS usuario
     FROM reportes r
-    JOIN usuarios      u  ON r.id_usuario        = u.id_usuario
-    JOIN estado_reporte er ON r.id_estado         = er.id_estado
-    JOIN tipo_incidente ti ON r.id_tipo_incidente = ti.id_tipo_incidente
-    JOIN severidad      s  ON r.id_severidad      = s.id_severidad
+    JOIN usuarios u ON r.id_usuario = u.id_usuario
+    """
+
+
+# Columnas id -> (catálogo, campo con el nombre) que se agregan en Python
+DECORACION_CATALOGOS = {
+    "id_estado":         ("estado_reporte", "estado"),
+    "id_tipo_incidente": ("tipo_incidente", "tipo_incidente"),
+    "id_severidad":      ("severidad",      "severidad"),
+}
+
+
+def _decorar(conn, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Agrega estado / tipo_incidente / severidad desde los catálogos en memoria
+    (en lugar de JOINs). Si falta algún id, recarga los catálogos una vez.
     """
+    almacen_catalogos.asegurar_cargado(conn)
+    for intento in range(2):
+        faltantes = False
+        for row in rows:
+            for columna, (catalogo, campo) in DECORACION_CATALOGOS.items():
+                nombre = almacen_catalogos.nombre(catalogo, row[columna])
+                faltantes |= nombre is None
+                row[campo] = nombre
+        if not faltantes or intento:
+            break
+        almacen_catalogos.recargar(conn)
+    return rows
 
 
 def _insertar_historial(cursor, id_reporte: int, estado_anterior: str,
                         estado_nuevo: str, id_usuario_accion: int,
-                        comentario: Optional[str] = None):
+                        comentario: Optional[str] = None,
+                        tramo_abierto: Optional[Dict[str, Any]] = None,
+                        alta: bool = False):
     """
     Inserta un registro en historial_reportes.
     Se llama tanto al CREAR un reporte como al CAMBIAR su estado.
+    También cierra/abre los tramos de reportes_duracion_estado (mismo cursor y transacción).
     """
     cursor.execute("""
         INSERT INTO historial_reportes
             (id_reporte, estado_anterior, estado_nuevo, comentario, id_usuario_accion, fecha_cambio)
         VALUES (%s, %s, %s, %s, %s, NOW());
     """, (id_reporte, estado_anterior, estado_nuevo, comentario, id_usuario_accion))
+    estadisticas.registrar_transicion(cursor, id_reporte, estado_anterior, estado_nuevo,
+                                      tramo_abierto=tramo_abierto, alta=alta)
 
 
 def _insertar_notificacion(cursor, id_usuario: int, id_reporte: int,
-                           tipo: str, mensaje: str):
-    """Inserta una notificación para el dueño del reporte."""
+                           tipo: str, mensaje: str) -> Dict[str, Any]:
+    """
+    Inserta una notificación para el dueño del reporte. Devuelve la notificación
+    para publicarla en canal_notificaciones DESPUÉS del commit.
+    """
     cursor.execute("""
         INSERT INTO notificaciones
             (id_usuario, id_reporte, tipo_notificacion, mensaje, leida, fecha_envio)
         VALUES (%s, %s, %s, %s, 0, NOW());
     """, (id_usuario, id_reporte, tipo, mensaje))
+    return {
+        "id_notificacion": cursor.lastrowid,
+        "id_usuario": id_usuario,
+        "id_reporte": id_reporte,
+        "tipo_notificacion": tipo,
+        "mensaje": mensaje,
+        "leida": 0,
+        "fecha_envio": datetime.now().replace(microsecond=0),
+    }
+
+
+def _placeholders(filas: int, columnas: int, fila: Optional[str] = None) -> str:
+    """'(%s, %s), (%s, %s), ...' para INSERTs multi-fila."""
+    fila = fila or "(" + ", ".join(["%s"] * columnas) + ")"
+    return ", ".join([fila] * filas)
+
+
+def _leer_lote(cuerpo: bytes, content_type: str) -> List[Any]:
+    """
+    Arreglo JSON o NDJSON (un objeto por línea). Las líneas NDJSON que no son JSON
+    válido quedan como error del item; un cuerpo que no es UTF-8 es un 400 con la línea.
+    """
+    try:
+        texto = cuerpo.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        linea = cuerpo[:e.start].count(b"\n") + 1
+        raise HTTPException(status_code=400, detail=f"Línea {linea}: el cuerpo no es UTF-8 válido")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        items = []
+        for n, linea in enumerate(texto.splitlines(), start=1):
+            if not linea.strip():
+                continue
+            try:
+                items.append(json.loads(linea))
+            except ValueError as e:
+                items.append(ValueError(f"Línea {n}: JSON inválido: {e}"))
+        return items
+    try:
+        items = json.loads(texto)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"JSON inválido: {e}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Se esperaba un arreglo JSON de reportes")
+    return items
 
 
 # =========================
 # ENDPOINTS
 # =========================
 
-@router.get("/", summary="Listar Reportes")
+@router.get("/", summary="Listar Reportes (paginado por cursor)")
 def listar_reportes(
-    user: Dict[str, Any] = Depends(require_active_user)
-) -> List[Dict[str, Any]]:
-
-    conn = get_connection()
+    limite:            int                = Query(REPORTES_LIMITE_DEFAULT, ge=1, le=REPORTES_LIMITE_MAX),
+    cursor:            Optional[str]      = Query(None, description="siguiente_cursor de la página anterior"),
+    id_estado:         Optional[int]      = Query(None, ge=1),
+    id_tipo_incidente: Optional[int]      = Query(None, ge=1),
+    id_severidad:      Optional[int]      = Query(None, ge=1),
+    id_entidad:        Optional[int]      = Query(None, ge=1),
+    desde:             Optional[datetime] = Query(None, description="created_at >= desde"),
+    hasta:             Optional[datetime] = Query(None, description="created_at < hasta"),
+    bbox:              Optional[str]      = Query(None, description="Vista del mapa: min_lon,min_lat,max_lon,max_lat"),
+    lat:               Optional[float]    = Query(None, description="Centro para búsqueda por radio"),
+    lon:               Optional[float]    = Query(None, description="Centro para búsqueda por radio"),
+    radio_m:           Optional[float]    = Query(None, description="Radio en metros alrededor de lat/lon"),
+    user: Dict[str, Any] = Depends(require_active_user),
+    conn: PooledConnection = Depends(get_db),
+) -> Dict[str, Any]:
+    """
+    Paginación keyset sobre (created_at, id_reporte), del más reciente al más antiguo.
+    Para la siguiente página se envía ?cursor=<siguiente_cursor>; es null en la última.
+    El costo de cada página es el mismo sin importar el tamaño de la tabla.
+    Con bbox (o lat/lon/radio_m) solo devuelve los reportes dentro de la vista del mapa.
+    """
     try:
-        base_sql = _select_reporte_detalle_sql()
-        params   = []
-
-        if user["id_rol"] == ROLE_CIUDADANO:
-            base_sql += " WHERE r.id_usuario = %s "
-            params.append(user["id_usuario"])
-        elif user["id_rol"] == ROLE_ENTIDAD:
-            if not user.get("id_entidad"):
-                raise HTTPException(status_code=403, detail="Usuario ENTIDAD sin id_entidad asignado")
-            base_sql += " WHERE r.id_entidad = %s "
-            params.append(user["id_entidad"])
-        elif user["id_rol"] in (ROLE_MODERADOR, ROLE_ADMIN):
-            pass
-        else:
-            raise HTTPException(status_code=403, detail="Rol desconocido")
-
-        sql = base_sql + " ORDER BY r.created_at DESC;"
-        with conn.cursor() as cursor:
-            cursor.execute(sql, params)
-            return cursor.fetchall()
+        condiciones, params = _filtro_visibilidad(user)
+
+        filtros = {
+            "r.id_estado":         id_estado,
+            "r.id_tipo_incidente": id_tipo_incidente,
+            "r.id_severidad":      id_severidad,
+            "r.id_entidad":        id_entidad,
+        }
+        for columna, valor in filtros.items():
+            if valor is not None:
+                condiciones.append(f"{columna} = %s")
+                params.append(valor)
+        if desde is not None:
+            condiciones.append("r.created_at >= %s")
+            params.append(desde)
+        if hasta is not None:
+            condiciones.append("r.created_at < %s")
+            params.append(hasta)
+
+        geo_condiciones, geo_params = filtro_espacial("r.latitud", "r.longitud", bbox, lat, lon, radio_m)
+        condiciones.extend(geo_condiciones)
+        params.extend(geo_params)
+
+        if cursor:
+            cursor_fecha, cursor_id = _decodificar_cursor(cursor)
+            condiciones.append("(r.created_at < %s OR (r.created_at = %s AND r.id_reporte < %s))")
+            params.extend([cursor_fecha, cursor_fecha, cursor_id])
+
+        sql = _select_reporte_detalle_sql()
+        if condiciones:
+            sql += " WHERE " + " AND ".join(condiciones)
+        sql += " ORDER BY r.created_at DESC, r.id_reporte DESC LIMIT %s;"
+        params.append(limite + 1)  # una fila extra para saber si hay otra página
+
+        with conn.cursor() as db_cursor:
+            db_cursor.execute(sql, params)
+            rows = _decorar(conn, list(db_cursor.fetchall()))
+
+        siguiente = None
+        if len(rows) > limite:
+            rows = rows[:limite]
+            siguiente = _codificar_cursor(rows[-1])
+
+        return {"items": rows, "limite": limite, "siguiente_cursor": siguiente}
 
     except HTTPException:
         raise
     except Exception as e:
         _raise_db_error(e)
-    finally:
-        conn.close()
+
+
+@router.get("/heatmap", summary="Mapa de calor de reportes (conteo por celda)")
+def heatmap_reportes(
+    id_tipo_incidente: Optional[int]      = Query(None, ge=1),
+    id_severidad:      Optional[int]      = Query(None, ge=1),
+    id_estado:         Optional[int]      = Query(None, ge=1),
+    desde:             Optional[datetime] = Query(None, description="created_at >= desde (por día)"),
+    hasta:             Optional[datetime] = Query(None, description="created_at < hasta (por día)"),
+    bbox:              Optional[str]      = Query(None, description="Vista del mapa: min_lon,min_lat,max_lon,max_lat"),
+    user: Dict[str, Any] = Depends(require_active_user),
+    conn: PooledConnection = Depends(get_db),
+) -> Dict[str, Any]:
+    """
+    Densidad de reportes para la capa de calor: celdas de HEATMAP_CELDA_GRADOS con su total.
+    Sale de conteos pre-agregados en memoria que se actualizan con cada alta o cambio
+    de estado, sin consultar la tabla. Respeta la visibilidad por rol de GET /reportes.
+    """
+    alcance = alcance_reportes(user)
+    try:
+        capa_reportes.asegurar_cargada(conn)
+    except Exception as e:
+        _raise_db_error(e)
+
+    celdas = mapa_calor.densidad(
+        id_tipo_incidente=id_tipo_incidente,
+        id_severidad=id_severidad,
+        id_estado=id_estado,
+        desde=desde.date() if desde else None,
+        hasta=hasta.date() if hasta else None,
+        bbox=parse_bbox(bbox) if bbox else None,
+        alcance=alcance,
+    )
+    return {
+        "celda_grados": mapa_calor.celda,
+        "max": max((c["total"] for c in celdas), default=0),
+        "celdas": celdas,
+    }
 
 
 @router.get("/{id_reporte}", summary="Obtener Reporte")
 def obtener_reporte(
     id_reporte: int,
-    user: Dict[str, Any] = Depends(require_active_user)
+    user: Dict[str, Any] = Depends(require_active_user),
+    conn: PooledConnection = Depends(get_db),
 ) -> Dict[str, Any]:
 
-    conn = get_connection()
     try:
         sql = _select_reporte_detalle_sql() + " WHERE r.id_reporte = %s;"
         with conn.cursor() as cursor:
@@ -177,6 +377,7 @@ def obtener_reporte(
 
         if not row:
             raise HTTPException(status_code=404, detail="Reporte no encontrado")
+        _decorar(conn, [row])
 
         if user["id_rol"] == ROLE_CIUDADANO and row["id_usuario"] != user["id_usuario"]:
             raise HTTPException(status_code=403, detail="No puedes ver reportes de otros usuarios")
@@ -189,14 +390,13 @@ def obtener_reporte(
         raise
     except Exception as e:
         _raise_db_error(e)
-    finally:
-        conn.close()
 
 
 @router.post("/", summary="Crear Reporte")
 def crear_reporte(
     payload: ReporteCreateRequest,
     user:    Dict[str, Any] = Depends(require_active_user),
+    conn:    PooledConnection = Depends(get_db),
 ) -> Dict[str, Any]:
 
     if user.get("id_estado_cuenta") != ESTADO_CUENTA_ACTIVO:
@@ -209,63 +409,299 @@ def crear_reporte(
     if payload.id_usuario is not None and payload.id_usuario != id_usuario_token:
         raise HTTPException(status_code=403, detail="No puedes crear reportes a nombre de otro usuario")
 
-    conn = get_connection()
     try:
+        # id_entidad ya viene cargado por la dependencia de autenticación
+        id_entidad = user.get("id_entidad")
+        if user["id_rol"] == ROLE_ENTIDAD and not id_entidad:
+            raise HTTPException(status_code=403, detail="Usuario ENTIDAD sin id_entidad asignado")
+
+        # Municipio por punto en polígono; el reporte ciudadano se enruta a la entidad del municipio
+        municipio = indice_municipios.localizar(payload.latitud, payload.longitud) or {}
+        if user["id_rol"] == ROLE_CIUDADANO and municipio.get("id_entidad"):
+            id_entidad = municipio["id_entidad"]
+
+        # Nombre del estado inicial desde el catálogo en memoria (sin consulta)
+        id_estado_inicial = ID_ESTADO_INICIAL
+        nombre_estado_inicial = (
+            almacen_catalogos.nombre_o_recargar(conn, "estado_reporte", id_estado_inicial) or "PENDIENTE"
+        )
+        fuente = "CIUDADANO" if user["id_rol"] == ROLE_CIUDADANO else "ENTIDAD"
+
+        # La respuesta se arma con lo que ya se sabe (sin releer el reporte): por eso
+        # created_at se envía en el INSERT en lugar de dejarlo al DEFAULT de la tabla
+        row = {
+            "id_reporte": None,
+            "descripcion": payload.descripcion,
+            "direccion": payload.direccion,
+            "latitud": payload.latitud,
+            "longitud": payload.longitud,
+            "codigo_municipio": municipio.get("codigo_municipio"),
+            "municipio": municipio.get("municipio"),
+            "imagen_url": payload.imagen_url,
+            "fuente_reporte": fuente,
+            "clave_idempotencia": None,
+            "created_at": datetime.now().replace(microsecond=0),
+            "id_usuario": id_usuario_token,
+            "id_entidad": id_entidad,
+            "id_tipo_incidente": payload.id_tipo_incidente,
+            "id_severidad": payload.id_severidad,
+            "id_estado": id_estado_inicial,
+            "usuario": user.get("nombre_completo"),
+        }
+
+        # Reporte, historial, notificación y estadísticas: una sola transacción (un solo commit)
+        conn.begin()
         with conn.cursor() as cursor:
-            id_entidad = _get_usuario_entidad(cursor, id_usuario_token)
-
-            if user["id_rol"] == ROLE_ENTIDAD and not id_entidad:
-                raise HTTPException(status_code=403, detail="Usuario ENTIDAD sin id_entidad asignado")
-
-            id_estado_inicial = 1  # PENDIENTE
-            fuente = "CIUDADANO" if user["id_rol"] == ROLE_CIUDADANO else "ENTIDAD"
-
             cursor.execute("""
                 INSERT INTO reportes (
                     id_usuario, id_entidad, id_tipo_incidente, id_severidad, id_estado,
-                    descripcion, direccion, latitud, longitud, imagen_url, fuente_reporte
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+                    descripcion, direccion, latitud, longitud, codigo_municipio, municipio,
+                    imagen_url, fuente_reporte, created_at
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
             """, (
                 id_usuario_token, id_entidad,
                 payload.id_tipo_incidente, payload.id_severidad, id_estado_inicial,
                 payload.descripcion, payload.direccion,
                 payload.latitud, payload.longitud,
-                payload.imagen_url, fuente,
+                row["codigo_municipio"], row["municipio"],
+                payload.imagen_url, fuente, row["created_at"],
             ))
-            new_id = cursor.lastrowid
+            new_id = row["id_reporte"] = cursor.lastrowid
 
             # ✅ REGISTRAR EN HISTORIAL: evento de creación
             _insertar_historial(
                 cursor,
                 id_reporte        = new_id,
                 estado_anterior   = "NINGUNO",   # no existía antes
-                estado_nuevo      = "PENDIENTE",  # estado inicial
+                estado_nuevo      = nombre_estado_inicial,
                 id_usuario_accion = id_usuario_token,
-                comentario        = "Reporte creado por el usuario"
+                comentario        = "Reporte creado por el usuario",
+                alta              = True,
             )
 
             # ✅ NOTIFICACIÓN: confirmación al creador
-            _insertar_notificacion(
+            notificacion = _insertar_notificacion(
                 cursor,
                 id_usuario = id_usuario_token,
                 id_reporte = new_id,
                 tipo       = "REPORTE_CREADO",
-                mensaje    = "Tu reporte fue creado exitosamente y está en estado PENDIENTE"
+                mensaje    = f"Tu reporte fue creado exitosamente y está en estado {nombre_estado_inicial}"
             )
 
-            # Retornar el reporte recién creado con todos los datos
-            sql = _select_reporte_detalle_sql() + " WHERE r.id_reporte = %s;"
-            cursor.execute(sql, (new_id,))
-            row = cursor.fetchone()
+            estadisticas.registrar_alta(cursor, row)
+
+            # El usuario autenticado trae su nombre; solo si no (token emitido antes) se consulta
+            if row["usuario"] is None:
+                cursor.execute("SELECT nombre_completo FROM usuarios WHERE id_usuario = %s;",
+                               (id_usuario_token,))
+                row["usuario"] = (cursor.fetchone() or {}).get("nombre_completo")
+        conn.commit()
+        canal_notificaciones.publicar([notificacion])
 
+        _decorar(conn, [row])
+        capa_reportes.upsert(row)
         return {"message": "created", "reporte": row}
 
     except HTTPException:
         raise
     except Exception as e:
         _raise_db_error(e)
-    finally:
-        conn.close()
+
+
+def _insertar_validos(conn: PooledConnection, user: Dict[str, Any],
+                      validos: Dict[str, Tuple[int, ReporteLoteItem]],
+                      nombre_estado_inicial: str) -> Tuple[Dict[str, int], List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Una transacción: inserta los items cuya clave no existe todavía.
+    Devuelve (existentes clave -> id_reporte, reportes creados, notificaciones).
+    """
+    id_usuario = user["id_usuario"]
+    id_entidad_usuario = user.get("id_entidad")
+    fuente = "CIUDADANO" if user["id_rol"] == ROLE_CIUDADANO else "ENTIDAD"
+    creados: List[Dict[str, Any]] = []
+    notificaciones: List[Dict[str, Any]] = []
+    claves = list(validos)
+    conn.begin()
+    with conn.cursor() as cursor:
+        # 2) Claves ya usadas (reintento del cliente): no se vuelven a crear
+        cursor.execute(
+            f"SELECT id_reporte, clave_idempotencia FROM reportes "
+            f"WHERE id_usuario = %s AND clave_idempotencia IN ({_placeholders(len(claves), 1, '%s')});",
+            [id_usuario, *claves],
+        )
+        existentes = {r["clave_idempotencia"]: r["id_reporte"] for r in cursor.fetchall()}
+        nuevos = [validos[c][1] for c in claves if c not in existentes]
+
+        if nuevos:
+            # 3) Municipio de todos los puntos de una vez
+            con_coords = [n for n in nuevos if n.latitud is not None and n.longitud is not None]
+            ubicaciones = dict(zip(
+                (n.clave_idempotencia for n in con_coords),
+                indice_municipios.localizar_lote([n.latitud for n in con_coords],
+                                                 [n.longitud for n in con_coords]),
+            ))
+
+            filas = []
+            for n in nuevos:
+                municipio = ubicaciones.get(n.clave_idempotencia) or {}
+                id_entidad = id_entidad_usuario
+                if user["id_rol"] == ROLE_CIUDADANO and municipio.get("id_entidad"):
+                    id_entidad = municipio["id_entidad"]
+                filas.extend([
+                    id_usuario, id_entidad, n.id_tipo_incidente, n.id_severidad, ID_ESTADO_INICIAL,
+                    n.descripcion, n.direccion, n.latitud, n.longitud,
+                    municipio.get("codigo_municipio"), municipio.get("municipio"),
+                    n.imagen_url, fuente, n.clave_idempotencia,
+                ])
+
+            # 4) Un INSERT multi-fila por tabla
+            cursor.execute(f"""
+                INSERT INTO reportes (
+                    id_usuario, id_entidad, id_tipo_incidente, id_severidad, id_estado,
+                    descripcion, direccion, latitud, longitud, codigo_municipio, municipio,
+                    imagen_url, fuente_reporte, clave_idempotencia
+                ) VALUES {_placeholders(len(nuevos), 14)};
+            """, filas)
+
+            claves_nuevas = [n.clave_idempotencia for n in nuevos]
+            cursor.execute(
+                _select_reporte_detalle_sql()
+                + f" WHERE r.id_usuario = %s AND r.clave_idempotencia IN ({_placeholders(len(claves_nuevas), 1, '%s')});",
+                [id_usuario, *claves_nuevas],
+            )
+            creados = list(cursor.fetchall())
+            ids = [r["id_reporte"] for r in creados]
+
+            cursor.execute(f"""
+                INSERT INTO historial_reportes
+                    (id_reporte, estado_anterior, estado_nuevo, comentario, id_usuario_accion, fecha_cambio)
+                VALUES {_placeholders(len(ids), 0, "(%s, 'NINGUNO', %s, 'Reporte creado por el usuario', %s, NOW())")};
+            """, [v for id_ in ids for v in (id_, nombre_estado_inicial, id_usuario)])
+            estadisticas.abrir_tramos(cursor, ids, nombre_estado_inicial)
+
+            cursor.execute(f"""
+                INSERT INTO notificaciones
+                    (id_usuario, id_reporte, tipo_notificacion, mensaje, leida, fecha_envio)
+                VALUES {_placeholders(len(ids), 0, "(%s, %s, 'REPORTE_CREADO', %s, 0, NOW())")};
+            """, [v for id_ in ids for v in (
+                id_usuario, id_,
+                f"Tu reporte fue creado exitosamente y está en estado {nombre_estado_inicial}",
+            )])
+            # Los ids de un INSERT multi-fila no son necesariamente consecutivos: se releen
+            cursor.execute(f"""
+                SELECT id_notificacion, id_usuario, id_reporte, tipo_notificacion,
+                       mensaje, leida, fecha_envio
+                FROM notificaciones
+                WHERE id_reporte IN ({_placeholders(len(ids), 1, '%s')})
+                  AND tipo_notificacion = 'REPORTE_CREADO';
+            """, ids)
+            notificaciones = list(cursor.fetchall())
+            estadisticas.registrar_altas(cursor, creados)
+    conn.commit()
+    return existentes, creados, notificaciones
+
+
+def _crear_lote(conn: PooledConnection, user: Dict[str, Any], items: List[Any]) -> Dict[str, Any]:
+    resultados: List[Dict[str, Any]] = [{"indice": i} for i in range(len(items))]
+    validos: Dict[str, Tuple[int, ReporteLoteItem]] = {}   # clave -> (índice, item)
+    almacen_catalogos.asegurar_cargado(conn)
+
+    # 1) Validación en bloque: cada item falla solo
+    for i, crudo in enumerate(items):
+        resultado = resultados[i]
+        try:
+            if isinstance(crudo, Exception):
+                raise crudo
+            item = ReporteLoteItem.model_validate(crudo)
+        except ValidationError as e:
+            resultado.update(estado="error", error="; ".join(
+                f"{'.'.join(map(str, err['loc'])) or 'item'}: {err['msg']}" for err in e.errors()
+            ))
+            continue
+        except ValueError as e:
+            resultado.update(estado="error", error=str(e))
+            continue
+        resultado["clave_idempotencia"] = item.clave_idempotencia
+        if item.id_usuario is not None and item.id_usuario != user["id_usuario"]:
+            resultado.update(estado="error", error="No puedes crear reportes a nombre de otro usuario")
+        elif almacen_catalogos.nombre("tipo_incidente", item.id_tipo_incidente) is None:
+            resultado.update(estado="error", error="id_tipo_incidente no existe")
+        elif almacen_catalogos.nombre("severidad", item.id_severidad) is None:
+            resultado.update(estado="error", error="id_severidad no existe")
+        elif item.clave_idempotencia in validos:
+            resultado.update(estado="duplicado_en_lote")
+        else:
+            validos[item.clave_idempotencia] = (i, item)
+
+    nombre_estado_inicial = almacen_catalogos.nombre("estado_reporte", ID_ESTADO_INICIAL) or "PENDIENTE"
+    por_clave: Dict[str, Dict[str, Any]] = {}
+
+    if validos:
+        for intento in range(2):
+            try:
+                existentes, creados, notificaciones = _insertar_validos(conn, user, validos, nombre_estado_inicial)
+                break
+            except IntegrityError as e:
+                conn.rollback()
+                # Un lote concurrente con las mismas claves se confirmó primero (UNIQUE
+                # uq_reportes_idempotencia): al repetir, esas claves se leen como existentes
+                if intento or "uq_reportes_idempotencia" not in str(e):
+                    raise
+        canal_notificaciones.publicar(notificaciones)
+
+        _decorar(conn, creados)
+        for row in creados:
+            capa_reportes.upsert(row)
+            por_clave[row["clave_idempotencia"]] = {"estado": "creado", "id_reporte": row["id_reporte"]}
+        for clave, id_reporte in existentes.items():
+            por_clave[clave] = {"estado": "existente", "id_reporte": id_reporte}
+
+    for resultado in resultados:
+        clave = resultado.get("clave_idempotencia")
+        if resultado.get("estado") in (None, "duplicado_en_lote") and clave in por_clave:
+            if resultado.get("estado") is None:
+                resultado.update(por_clave[clave])
+            else:
+                resultado["id_reporte"] = por_clave[clave]["id_reporte"]
+
+    conteo: Dict[str, int] = {}
+    for resultado in resultados:
+        conteo[resultado["estado"]] = conteo.get(resultado["estado"], 0) + 1
+    return {"total": len(items), "resumen": conteo, "resultados": resultados}
+
+
+@router.post("/lote", summary="Crear varios reportes (arreglo JSON o NDJSON, idempotente)")
+async def crear_reportes_lote(
+    request: Request,
+    user:    Dict[str, Any] = Depends(require_active_user),
+    conn:    PooledConnection = Depends(get_db),
+) -> Dict[str, Any]:
+    """
+    Para clientes que encolan reportes sin conexión: hasta LOTE_MAX reportes por petición,
+    cada uno con su `clave_idempotencia`. Cada item se valida por separado; los válidos
+    se insertan en una sola transacción con un INSERT multi-fila por tabla.
+    Reenviar un lote ya procesado devuelve `existente` con el id original.
+    Content-Type application/x-ndjson = un reporte JSON por línea.
+    """
+    if user.get("id_estado_cuenta") != ESTADO_CUENTA_ACTIVO:
+        raise HTTPException(status_code=403, detail="Tu cuenta no está ACTIVA")
+    if user.get("id_rol") not in (ROLE_CIUDADANO, ROLE_ENTIDAD):
+        raise HTTPException(status_code=403, detail="No tienes permisos para crear reportes")
+    if user["id_rol"] == ROLE_ENTIDAD and not user.get("id_entidad"):
+        raise HTTPException(status_code=403, detail="Usuario ENTIDAD sin id_entidad asignado")
+
+    items = _leer_lote(await request.body(), request.headers.get("content-type", ""))
+    if not items:
+        raise HTTPException(status_code=400, detail="El lote está vacío")
+    if len(items) > LOTE_MAX:
+        raise HTTPException(status_code=413, detail=f"Máximo {LOTE_MAX} reportes por lote")
+
+    try:
+        return await run_in_threadpool(_crear_lote, conn, user, items)
+    except HTTPException:
+        raise
+    except Exception as e:
+        _raise_db_error(e)
 
 
 @router.put("/{id_reporte}/estado", summary="Cambiar Estado")
@@ -273,21 +709,36 @@ def cambiar_estado(
     id_reporte: int,
     payload:    CambiarEstadoRequest,
     user:       Dict[str, Any] = Depends(require_active_user),
+    conn:       PooledConnection = Depends(get_db),
 ) -> Dict[str, Any]:
 
     if user["id_rol"] == ROLE_CIUDADANO:
         raise HTTPException(status_code=403, detail="No tienes permisos para cambiar el estado")
 
-    conn = get_connection()
     try:
+        # Nombre del nuevo estado desde el catálogo en memoria (recarga solo si el id no está)
+        nombre_estado_nuevo = almacen_catalogos.nombre_o_recargar(conn, "estado_reporte", payload.id_estado_nuevo)
+        if nombre_estado_nuevo is None:
+            raise HTTPException(status_code=400, detail="id_estado_nuevo no existe")
+
+        conn.begin()
         with conn.cursor() as cursor:
-            # Obtener reporte actual con su estado actual
+            # Reporte actual completo (bloqueado hasta el commit) + su tramo de estado abierto.
+            # Es también la respuesta: no se vuelve a leer después del UPDATE. El nombre
+            # del dueño va en una subconsulta, que no bloquea la fila de usuarios.
             cursor.execute("""
-                SELECT r.id_reporte, r.id_entidad, r.id_usuario,
-                       er.nombre AS estado_actual
+                SELECT r.id_reporte, r.descripcion, r.direccion, r.latitud, r.longitud,
+                       r.codigo_municipio, r.municipio, r.imagen_url, r.fuente_reporte,
+                       r.clave_idempotencia, r.created_at, r.id_usuario, r.id_entidad,
+                       r.id_tipo_incidente, r.id_severidad, r.id_estado,
+                       (SELECT u.nombre_completo FROM usuarios u
+                        WHERE u.id_usuario = r.id_usuario) AS usuario,
+                       d.estado AS tramo_estado, d.desde AS tramo_desde
                 FROM reportes r
-                JOIN estado_reporte er ON r.id_estado = er.id_estado
-                WHERE r.id_reporte = %s;
+                LEFT JOIN reportes_duracion_estado d
+                       ON d.id_reporte = r.id_reporte AND d.hasta IS NULL
+                WHERE r.id_reporte = %s
+                FOR UPDATE;
             """, (id_reporte,))
             rep = cursor.fetchone()
             if not rep:
@@ -299,34 +750,34 @@ def cambiar_estado(
                 if rep.get("id_entidad") != user["id_entidad"]:
                     raise HTTPException(status_code=403, detail="No puedes modificar reportes de otra entidad")
 
-            # Obtener nombre del nuevo estado
-            cursor.execute(
-                "SELECT nombre FROM estado_reporte WHERE id_estado = %s;",
-                (payload.id_estado_nuevo,)
+            estado_actual = almacen_catalogos.nombre("estado_reporte", rep["id_estado"]) or str(rep["id_estado"])
+            tramo_abierto = (
+                {"estado": rep["tramo_estado"], "desde": rep["tramo_desde"]}
+                if rep["tramo_desde"] is not None else None
             )
-            nuevo_estado_row = cursor.fetchone()
-            if not nuevo_estado_row:
-                raise HTTPException(status_code=400, detail="id_estado_nuevo no existe")
-            nombre_estado_nuevo = nuevo_estado_row["nombre"]
+            row = {k: v for k, v in rep.items() if k not in ("tramo_estado", "tramo_desde")}
+            row["id_estado"] = payload.id_estado_nuevo
 
             # Actualizar estado del reporte
             cursor.execute(
                 "UPDATE reportes SET id_estado = %s, updated_at = NOW() WHERE id_reporte = %s;",
                 (payload.id_estado_nuevo, id_reporte),
             )
+            estadisticas.registrar_cambio_estado(cursor, rep, rep["id_estado"], payload.id_estado_nuevo)
 
             # ✅ REGISTRAR EN HISTORIAL: cambio de estado
             _insertar_historial(
                 cursor,
                 id_reporte        = id_reporte,
-                estado_anterior   = rep["estado_actual"],
+                estado_anterior   = estado_actual,
                 estado_nuevo      = nombre_estado_nuevo,
                 id_usuario_accion = user["id_usuario"],
-                comentario        = payload.comentario
+                comentario        = payload.comentario,
+                tramo_abierto     = tramo_abierto,
             )
 
             # ✅ NOTIFICACIÓN: avisar al dueño del reporte
-            _insertar_notificacion(
+            notificacion = _insertar_notificacion(
                 cursor,
                 id_usuario = rep["id_usuario"],
                 id_reporte = id_reporte,
@@ -334,16 +785,14 @@ def cambiar_estado(
                 mensaje    = f"Tu reporte cambió a {nombre_estado_nuevo}"
             )
 
-            # Retornar reporte actualizado
-            sql = _select_reporte_detalle_sql() + " WHERE r.id_reporte = %s;"
-            cursor.execute(sql, (id_reporte,))
-            row = cursor.fetchone()
+        conn.commit()
+        canal_notificaciones.publicar([notificacion])
 
+        _decorar(conn, [row])
+        capa_reportes.actualizar(id_reporte, id_estado=payload.id_estado_nuevo)
         return {"message": "updated", "reporte": row}
 
     except HTTPException:
         raise
     except Exception as e:
         _raise_db_error(e)
-    finally:
-        conn.close()
\ No newline at end of file
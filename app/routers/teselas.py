@@ -0,0 +1,70 @@
+import secrets
+from typing import Any, Dict, Literal
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+import pymysql
+
+from app.db.database import PooledConnection, get_db
+from app.core.deps import require_active_user
+from app.services.puntos import CAPAS, alcance_reportes
+from app.services.mvt import tesela_mvt
+from app.services.teselas import validar_tesela
+
+router = APIRouter(prefix="/tiles", tags=["Mapa"])
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+# ETag = versión de la capa en memoria: cualquier cambio de un punto la sube, así
+# que el cliente revalida cada tesela (no-cache) y recibe 304 sin cuerpo si nada
+# cambió, en vez de ver hasta 60 s de datos viejos. Cada worker tiene su propia
+# capa y su propio contador, por eso el ETag lleva un id del proceso: en otro
+# worker simplemente no coincide (200 con la tesela), nunca da un 304 erróneo.
+_PROCESO = secrets.token_hex(4)
+
+
+def _etag_coincide(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidatos = [v.strip().removeprefix("W/") for v in if_none_match.split(",")]
+    return etag in candidatos
+
+
+@router.get(
+    "/{capa}/{z}/{x}/{y}.mvt",
+    summary="Tesela vectorial (Mapbox Vector Tile) de reportes o infraestructura",
+    response_class=Response,
+)
+def tesela(
+    capa: Literal["reportes", "infraestructura"],
+    z: int,
+    x: int,
+    y: int,
+    request: Request,
+    user: Dict[str, Any] = Depends(require_active_user),
+    conn: PooledConnection = Depends(get_db),
+) -> Response:
+    """
+    Protobuf MVT con los puntos de la tesela, cuantizados a 4096 unidades.
+    Propiedades: id_tipo_incidente / id_severidad / id_estado en reportes,
+    nombre / tipo / estado en infraestructura.
+    Los reportes respetan la misma visibilidad por rol que GET /reportes.
+    """
+    validar_tesela(z, x, y)
+    capa_puntos = CAPAS[capa]
+    alcance = alcance_reportes(user) if capa == "reportes" else None
+    try:
+        capa_puntos.asegurar_cargada(conn)
+    except pymysql.MySQLError as e:
+        raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
+
+    # La versión se lee antes de armar la tesela: el contenido es igual o más nuevo que el ETag
+    variante = "todos" if alcance is None else f"{alcance[0]}-{alcance[1]}"
+    etag = f'"{capa}-{_PROCESO}-{capa_puntos.version}-{variante}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_coincide(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    contenido = tesela_mvt(capa_puntos, z, x, y, alcance)
+    if not contenido:
+        return Response(status_code=204, headers=headers)
+    return Response(content=contenido, media_type=MVT_MEDIA_TYPE, headers=headers)
@@ -1,13 +1,15 @@
 from typing import Any, Dict, List, Optional
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field, EmailStr, field_validator
 import pymysql
 import secrets
 from datetime import datetime, timedelta
 
-from app.db.database import get_connection
-from app.core.security import hash_password
-from app.core.deps import require_active_user, require_roles
+from app.db.database import PooledConnection, get_db, con_conexion
+from app.core.security import revocar_tokens_usuario
+from app.core.hashing import hash_password_async
+from app.core.deps import require_active_user, require_roles, invalidar_usuario
 
 router = APIRouter(prefix="/usuarios", tags=["Usuarios"])
 
@@ -69,6 +71,107 @@ class RestablecerContrasena(BaseModel):
     nueva_password: str = Field(..., min_length=6)
 
 
+# =========================
+# HELPERS
+# =========================
+# Los endpoints que hashean contraseñas son async (el PBKDF2 corre en el pool de
+# procesos); su parte de BD vive en estas funciones y se ejecuta en el threadpool.
+
+def _verificar_duplicados(conn, data: RegistroUsuario) -> None:
+    with conn.cursor() as cursor:
+        # ✅ Verificar correo duplicado
+        cursor.execute(
+            "SELECT id_usuario FROM usuarios WHERE correo = %s;",
+            (data.correo,)
+        )
+        if cursor.fetchone():
+            raise HTTPException(
+                status_code=400,
+                detail="El correo ya está registrado"
+            )
+
+        # ✅ Verificar documento duplicado (solo si se envió)
+        if data.numero_documento:
+            cursor.execute(
+                "SELECT id_usuario FROM usuarios WHERE numero_documento = %s;",
+                (data.numero_documento,)
+            )
+            if cursor.fetchone():
+                raise HTTPException(
+                    status_code=400,
+                    detail="El número de documento ya está registrado"
+                )
+
+
+def _insertar_ciudadano(conn, data: RegistroUsuario, password_hash: str) -> int:
+    with conn.cursor() as cursor:
+        # ✅ INSERT con todos los campos
+        cursor.execute("""
+            INSERT INTO usuarios
+                (id_rol, id_estado_cuenta, nombre_completo, correo, password_hash,
+                 fecha_nacimiento, tipo_documento, numero_documento,
+                 telefono, pais, ciudad, direccion)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+        """, (
+            1,                      # CIUDADANO
+            4,                      # PENDIENTE (admin debe activar)
+            data.nombre_completo,
+            data.correo,
+            password_hash,          # ← siempre generado correctamente
+            data.fecha_nacimiento,
+            data.tipo_documento,
+            data.numero_documento,
+            data.telefono,
+            data.pais,
+            data.ciudad,
+            data.direccion
+        ))
+        return cursor.lastrowid
+
+
+def _validar_token_recuperacion(conn, token: str) -> Dict[str, Any]:
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT id_recuperacion, id_usuario, fecha_expiracion, usado
+            FROM recuperacion_contrasena
+            WHERE token = %s;
+        """, (token,))
+        registro = cursor.fetchone()
+
+    if not registro:
+        raise HTTPException(status_code=400, detail="Token inválido")
+    if registro["usado"]:
+        raise HTTPException(status_code=400, detail="El token ya fue utilizado")
+    if datetime.now() > registro["fecha_expiracion"]:
+        raise HTTPException(status_code=400, detail="El token ha expirado")
+    return registro
+
+
+def _guardar_nueva_contrasena(conn, registro: Dict[str, Any], nuevo_hash: str) -> None:
+    # La validación del token y esta escritura van en préstamos distintos (el hash
+    # se calcula entre medio): el token se consume primero y solo si sigue sin usar.
+    conn.begin()
+    with conn.cursor() as cursor:
+        # Invalidar token para que no se pueda reutilizar
+        cursor.execute(
+            "UPDATE recuperacion_contrasena SET usado = 1 WHERE id_recuperacion = %s AND usado = 0;",
+            (registro["id_recuperacion"],)
+        )
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=400, detail="El token ya fue utilizado")
+        # Actualizar contraseña
+        cursor.execute(
+            "UPDATE usuarios SET password_hash = %s, updated_at = NOW() WHERE id_usuario = %s;",
+            (nuevo_hash, registro["id_usuario"])
+        )
+        # Cerrar las sesiones abiertas con la contraseña anterior
+        cursor.execute(
+            "UPDATE refresh_tokens SET revocado = 1 WHERE id_usuario = %s AND revocado = 0;",
+            (registro["id_usuario"],)
+        )
+    conn.commit()
+
+
 # =========================
 # REGISTRO PÚBLICO
 # =========================
@@ -78,65 +181,23 @@ class RestablecerContrasena(BaseModel):
     status_code=201,
     summary="Registro público de ciudadanos (sin token)"
 )
-def registro_ciudadano(data: RegistroUsuario) -> Dict[str, Any]:
+async def registro_ciudadano(
+    data: RegistroUsuario,
+) -> Dict[str, Any]:
     """
     Endpoint público (no requiere token).
     Crea un usuario con rol CIUDADANO (id_rol=1)
     y estado PENDIENTE (id_estado_cuenta=4) hasta que un ADMIN lo active.
-    El hash de la contraseña se genera automáticamente.
+    El hash de la contraseña se genera automáticamente (en el pool de procesos),
+    sin retener una conexión de la BD mientras se espera.
     """
-    conn = get_connection()
     try:
-        with conn.cursor() as cursor:
-
-            # ✅ Verificar correo duplicado
-            cursor.execute(
-                "SELECT id_usuario FROM usuarios WHERE correo = %s;",
-                (data.correo,)
-            )
-            if cursor.fetchone():
-                raise HTTPException(
-                    status_code=400,
-                    detail="El correo ya está registrado"
-                )
+        await run_in_threadpool(con_conexion, _verificar_duplicados, data)
 
-            # ✅ Verificar documento duplicado (solo si se envió)
-            if data.numero_documento:
-                cursor.execute(
-                    "SELECT id_usuario FROM usuarios WHERE numero_documento = %s;",
-                    (data.numero_documento,)
-                )
-                if cursor.fetchone():
-                    raise HTTPException(
-                        status_code=400,
-                        detail="El número de documento ya está registrado"
-                    )
+        # ✅ Generar hash automáticamente SIEMPRE antes del INSERT
+        password_hash = await hash_password_async(data.password)
 
-            # ✅ Generar hash automáticamente SIEMPRE antes del INSERT
-            password_hash = hash_password(data.password)
-
-            # ✅ INSERT con todos los campos
-            cursor.execute("""
-                INSERT INTO usuarios
-                    (id_rol, id_estado_cuenta, nombre_completo, correo, password_hash,
-                     fecha_nacimiento, tipo_documento, numero_documento,
-                     telefono, pais, ciudad, direccion)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-            """, (
-                1,                      # CIUDADANO
-                4,                      # PENDIENTE (admin debe activar)
-                data.nombre_completo,
-                data.correo,
-                password_hash,          # ← siempre generado correctamente
-                data.fecha_nacimiento,
-                data.tipo_documento,
-                data.numero_documento,
-                data.telefono,
-                data.pais,
-                data.ciudad,
-                data.direccion
-            ))
-            nuevo_id = cursor.lastrowid
+        nuevo_id = await run_in_threadpool(con_conexion, _insertar_ciudadano, data, password_hash)
 
         return {
             "message": "Usuario registrado exitosamente. Su cuenta está pendiente de activación.",
@@ -148,8 +209,6 @@ def registro_ciudadano(data: RegistroUsuario) -> Dict[str, Any]:
         raise
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
 
 
 # =========================
@@ -160,13 +219,15 @@ def registro_ciudadano(data: RegistroUsuario) -> Dict[str, Any]:
     "/solicitar-recuperacion",
     summary="Solicitar token para restablecer contraseña (sin token)"
 )
-def solicitar_recuperacion(data: SolicitarRecuperacion) -> Dict[str, Any]:
+def solicitar_recuperacion(
+    data: SolicitarRecuperacion,
+    conn: PooledConnection = Depends(get_db),
+) -> Dict[str, Any]:
     """
     Genera un token de recuperación válido por 2 horas.
     En producción este token se enviaría por correo electrónico.
     Para el proyecto académico se devuelve en la respuesta.
     """
-    conn = get_connection()
     try:
         with conn.cursor() as cursor:
             cursor.execute(
@@ -197,58 +258,38 @@ def solicitar_recuperacion(data: SolicitarRecuperacion) -> Dict[str, Any]:
         }
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
 
 
 @router.post(
     "/restablecer-contrasena",
     summary="Restablecer contraseña usando el token recibido (sin token)"
 )
-def restablecer_contrasena(data: RestablecerContrasena) -> Dict[str, Any]:
+async def restablecer_contrasena(
+    data: RestablecerContrasena,
+) -> Dict[str, Any]:
     """
     Valida el token y establece la nueva contraseña.
     El token se invalida después de usarse (campo usado=1).
-    El nuevo hash se genera automáticamente.
+    El nuevo hash se genera automáticamente (en el pool de procesos),
+    sin retener una conexión de la BD mientras se espera.
     """
-    conn = get_connection()
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT id_recuperacion, id_usuario, fecha_expiracion, usado
-                FROM recuperacion_contrasena
-                WHERE token = %s;
-            """, (data.token,))
-            registro = cursor.fetchone()
+        registro = await run_in_threadpool(con_conexion, _validar_token_recuperacion, data.token)
 
-            if not registro:
-                raise HTTPException(status_code=400, detail="Token inválido")
-            if registro["usado"]:
-                raise HTTPException(status_code=400, detail="El token ya fue utilizado")
-            if datetime.now() > registro["fecha_expiracion"]:
-                raise HTTPException(status_code=400, detail="El token ha expirado")
+        # ✅ Hash generado automáticamente
+        nuevo_hash = await hash_password_async(data.nueva_password)
 
-            # ✅ Hash generado automáticamente
-            nuevo_hash = hash_password(data.nueva_password)
-
-            # Actualizar contraseña
-            cursor.execute(
-                "UPDATE usuarios SET password_hash = %s, updated_at = NOW() WHERE id_usuario = %s;",
-                (nuevo_hash, registro["id_usuario"])
-            )
-            # Invalidar token para que no se pueda reutilizar
-            cursor.execute(
-                "UPDATE recuperacion_contrasena SET usado = 1 WHERE id_recuperacion = %s;",
-                (registro["id_recuperacion"],)
-            )
+        await run_in_threadpool(con_conexion, _guardar_nueva_contrasena, registro, nuevo_hash)
+        # Igual que al cambiar el estado de la cuenta: los access tokens emitidos con la
+        # contraseña anterior dejan de valer (también en modo TOKEN_CLAIMS)
+        revocar_tokens_usuario(registro["id_usuario"])
+        invalidar_usuario(registro["id_usuario"])
 
         return {"message": "Contraseña restablecida exitosamente. Ya puedes iniciar sesión."}
     except HTTPException:
         raise
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
 
 
 # =========================
@@ -260,10 +301,10 @@ def restablecer_contrasena(data: RestablecerContrasena) -> Dict[str, Any]:
     summary="Ver mi perfil (usuario autenticado)"
 )
 def ver_perfil(
-    user: Dict[str, Any] = Depends(require_active_user)
+    user: Dict[str, Any] = Depends(require_active_user),
+    conn: PooledConnection = Depends(get_db),
 ) -> Dict[str, Any]:
     """El usuario autenticado consulta sus propios datos."""
-    conn = get_connection()
     try:
         with conn.cursor() as cursor:
             cursor.execute("""
@@ -290,8 +331,6 @@ def ver_perfil(
             return cursor.fetchone()
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
 
 
 @router.put(
@@ -300,10 +339,10 @@ def ver_perfil(
 )
 def actualizar_perfil(
     data: ActualizarPerfil,
-    user: Dict[str, Any] = Depends(require_active_user)
+    user: Dict[str, Any] = Depends(require_active_user),
+    conn: PooledConnection = Depends(get_db),
 ) -> Dict[str, Any]:
     """El usuario autenticado actualiza sus datos personales."""
-    conn = get_connection()
     try:
         with conn.cursor() as cursor:
             campos = {k: v for k, v in data.model_dump().items() if v is not None}
@@ -320,13 +359,12 @@ def actualizar_perfil(
                 f"UPDATE usuarios SET {set_clause}, updated_at = NOW() WHERE id_usuario = %s;",
                 valores
             )
+        invalidar_usuario(user["id_usuario"])
         return {"message": "Perfil actualizado exitosamente"}
     except HTTPException:
         raise
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
 
 
 # =========================
@@ -338,10 +376,10 @@ def actualizar_perfil(
     summary="Listar todos los usuarios (solo ADMIN)"
 )
 def listar_usuarios(
-    user: Dict[str, Any] = Depends(require_roles(4))
+    user: Dict[str, Any] = Depends(require_roles(4)),
+    conn: PooledConnection = Depends(get_db),
 ) -> List[Dict[str, Any]]:
     """Lista todos los usuarios con su rol y estado de cuenta."""
-    conn = get_connection()
     try:
         with conn.cursor() as cursor:
             cursor.execute("""
@@ -362,8 +400,6 @@ def listar_usuarios(
             return cursor.fetchall()
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
 
 
 @router.get(
@@ -371,10 +407,10 @@ def listar_usuarios(
     summary="Listar usuarios pendientes de activación (solo ADMIN)"
 )
 def listar_pendientes(
-    user: Dict[str, Any] = Depends(require_roles(4))
+    user: Dict[str, Any] = Depends(require_roles(4)),
+    conn: PooledConnection = Depends(get_db),
 ) -> List[Dict[str, Any]]:
     """Lista solo los usuarios con estado PENDIENTE para facilitar la activación."""
-    conn = get_connection()
     try:
         with conn.cursor() as cursor:
             cursor.execute("""
@@ -398,8 +434,6 @@ def listar_pendientes(
         }
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
 
 
 @router.get(
@@ -408,9 +442,9 @@ def listar_pendientes(
 )
 def detalle_usuario(
     id_usuario: int,
-    user: Dict[str, Any] = Depends(require_roles(4))
+    user: Dict[str, Any] = Depends(require_roles(4)),
+    conn: PooledConnection = Depends(get_db),
 ) -> Dict[str, Any]:
-    conn = get_connection()
     try:
         with conn.cursor() as cursor:
             cursor.execute("""
@@ -443,8 +477,6 @@ def detalle_usuario(
         raise
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
 
 
 @router.put(
@@ -454,13 +486,13 @@ def detalle_usuario(
 def cambiar_estado_usuario(
     id_usuario: int,
     data: CambiarEstadoCuenta,
-    user: Dict[str, Any] = Depends(require_roles(4))
+    user: Dict[str, Any] = Depends(require_roles(4)),
+    conn: PooledConnection = Depends(get_db),
 ) -> Dict[str, Any]:
     """
     Permite al ADMINISTRADOR cambiar el estado de cualquier cuenta.
     Estados: 1=ACTIVO, 2=INACTIVO, 3=SUSPENDIDO, 4=PENDIENTE
     """
-    conn = get_connection()
     try:
         with conn.cursor() as cursor:
             cursor.execute(
@@ -483,6 +515,15 @@ def cambiar_estado_usuario(
                 "UPDATE usuarios SET id_estado_cuenta = %s, updated_at = NOW() WHERE id_usuario = %s;",
                 (data.id_estado_cuenta, id_usuario)
             )
+            if data.id_estado_cuenta != 1:
+                # Una cuenta no activa no puede seguir renovando access tokens
+                cursor.execute(
+                    "UPDATE refresh_tokens SET revocado = 1 WHERE id_usuario = %s AND revocado = 0;",
+                    (id_usuario,)
+                )
+        invalidar_usuario(id_usuario)
+        # Los access tokens emitidos antes de este cambio dejan de valer
+        revocar_tokens_usuario(id_usuario)
 
         return {
             "message": "Estado de cuenta actualizado exitosamente",
@@ -493,5 +534,3 @@ def cambiar_estado_usuario(
         raise
     except pymysql.MySQLError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {str(e)}")
-    finally:
-        conn.close()
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# =========================
+# CANAL DE NOTIFICACIONES (PUB/SUB EN PROCESO)
+# =========================
+# Cada conexión abierta a GET /notificaciones/stream se suscribe con una cola
+# asyncio. Los handlers que insertan notificaciones publican DESPUÉS del commit
+# (nunca se avisa algo que luego se deshizo). Publicar es seguro desde los hilos
+# del threadpool: la entrega se agenda en el loop de cada suscriptor.
+# Es por proceso: con varios workers, cada uno avisa solo a sus propias
+# conexiones (el cliente igual se pone al día con Last-Event-ID al reconectar).
+COLA_MAX = 100   # si un cliente no lee, se descartan sus avisos más viejos
+
+Suscripcion = Tuple[asyncio.AbstractEventLoop, "asyncio.Queue[Optional[Dict[str, Any]]]"]
+
+
+class CanalNotificaciones:
+    def __init__(self):
+        self._suscripciones: Dict[int, List[Suscripcion]] = {}
+        self._lock = threading.Lock()
+        self._publicadas = 0
+        self._descartadas = 0
+
+    def suscribir(self, id_usuario: int) -> "asyncio.Queue[Optional[Dict[str, Any]]]":
+        """Se llama desde el loop; la cola recibe dicts de notificación (None = cerrar)."""
+        cola: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue(maxsize=COLA_MAX)
+        with self._lock:
+            self._suscripciones.setdefault(id_usuario, []).append((asyncio.get_running_loop(), cola))
+        return cola
+
+    def cancelar(self, id_usuario: int, cola) -> None:
+        with self._lock:
+            restantes = [s for s in self._suscripciones.get(id_usuario, []) if s[1] is not cola]
+            if restantes:
+                self._suscripciones[id_usuario] = restantes
+            else:
+                self._suscripciones.pop(id_usuario, None)
+
+    def publicar(self, notificaciones: List[Dict[str, Any]]) -> None:
+        """Entrega cada notificación a las conexiones abiertas de su id_usuario."""
+        with self._lock:
+            destinos = [
+                (n, list(self._suscripciones.get(n["id_usuario"], []))) for n in notificaciones
+            ]
+            self._publicadas += len(notificaciones)
+        for notificacion, suscripciones in destinos:
+            for loop, cola in suscripciones:
+                try:
+                    loop.call_soon_threadsafe(self._encolar, cola, notificacion)
+                except RuntimeError:
+                    pass   # loop cerrado: la conexión ya no existe
+
+    def _encolar(self, cola, notificacion: Optional[Dict[str, Any]]) -> None:
+        if cola.full():
+            cola.get_nowait()
+            with self._lock:
+                self._descartadas += 1
+        cola.put_nowait(notificacion)
+
+    def cerrar(self) -> None:
+        """Al apagar: termina todos los streams abiertos."""
+        with self._lock:
+            suscripciones = [s for lista in self._suscripciones.values() for s in lista]
+        for loop, cola in suscripciones:
+            try:
+                loop.call_soon_threadsafe(self._encolar, cola, None)
+            except RuntimeError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "usuarios": len(self._suscripciones),
+                "conexiones": sum(len(s) for s in self._suscripciones.values()),
+                "publicadas": self._publicadas,
+                "descartadas": self._descartadas,
+            }
+
+
+canal_notificaciones = CanalNotificaciones()
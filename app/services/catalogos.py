@@ -0,0 +1,107 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# =========================
+# CATÁLOGOS EN MEMORIA
+# =========================
+# estado_reporte, tipo_incidente, severidad y categoria_incidente son tablas
+# pequeñas que casi nunca cambian: se leen una vez y se sirven desde memoria.
+# Si llega un id que no está (catálogo editado a mano en la BD) se recarga
+# bajo demanda con recargar(). Cada carga calcula un hash del contenido
+# (por catálogo y global) que sirve de ETag fuerte para los clientes.
+# Se recuerdan las últimas versiones para poder responder solo los catálogos
+# que cambiaron desde la versión que tiene el cliente (?since=).
+VERSIONES_RECORDADAS = 32
+CATALOGOS = {
+    "estado_reporte":      ("id_estado",         "SELECT id_estado, nombre FROM estado_reporte ORDER BY id_estado;"),
+    "tipo_incidente":      ("id_tipo_incidente", "SELECT id_tipo_incidente, nombre FROM tipo_incidente ORDER BY id_tipo_incidente;"),
+    "severidad":           ("id_severidad",      "SELECT id_severidad, nombre FROM severidad ORDER BY id_severidad;"),
+    "categoria_incidente": ("id_categoria",      "SELECT id_categoria, nombre FROM categoria_incidente ORDER BY id_categoria;"),
+}
+
+
+class AlmacenCatalogos:
+    def __init__(self):
+        self._filas: Dict[str, List[Dict[str, Any]]] = {}
+        self._nombres: Dict[str, Dict[int, str]] = {}
+        self._hashes: Dict[str, str] = {}
+        self._version: Optional[str] = None
+        self._versiones: "OrderedDict[str, Dict[str, str]]" = OrderedDict()  # versión -> hashes
+        self._lock = threading.Lock()
+
+    def cargar(self, conn) -> None:
+        filas = {}
+        with conn.cursor() as cursor:
+            for catalogo, (_, sql) in CATALOGOS.items():
+                cursor.execute(sql)
+                filas[catalogo] = list(cursor.fetchall())
+        nombres = {
+            catalogo: {f[CATALOGOS[catalogo][0]]: f["nombre"] for f in rows}
+            for catalogo, rows in filas.items()
+        }
+        hashes = {catalogo: _hash(rows) for catalogo, rows in filas.items()}
+        with self._lock:
+            self._filas = filas
+            self._nombres = nombres
+            self._hashes = hashes
+            self._version = _hash(hashes)
+            self._versiones[self._version] = hashes
+            self._versiones.move_to_end(self._version)
+            while len(self._versiones) > VERSIONES_RECORDADAS:
+                self._versiones.popitem(last=False)
+
+    def recargar(self, conn) -> None:
+        self.cargar(conn)
+
+    def asegurar_cargado(self, conn) -> None:
+        if not self._filas:
+            self.cargar(conn)
+
+    @property
+    def cargado(self) -> bool:
+        return bool(self._filas)
+
+    @property
+    def version(self) -> Optional[str]:
+        """Hash de todos los catálogos: cambia si cambia cualquiera."""
+        return self._version
+
+    def hash(self, catalogo: str) -> Optional[str]:
+        return self._hashes.get(catalogo)
+
+    def filas(self, catalogo: str) -> List[Dict[str, Any]]:
+        return self._filas.get(catalogo, [])
+
+    def todos(self) -> Dict[str, List[Dict[str, Any]]]:
+        return dict(self._filas)
+
+    def cambios_desde(self, version: str) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+        """Catálogos cuyo contenido cambió desde `version`; None si la versión no se conoce."""
+        with self._lock:
+            anteriores = self._versiones.get(version)
+            if anteriores is None:
+                return None
+            return {c: filas for c, filas in self._filas.items() if anteriores.get(c) != self._hashes.get(c)}
+
+    def nombre(self, catalogo: str, id_: Optional[int]) -> Optional[str]:
+        return self._nombres.get(catalogo, {}).get(id_)
+
+    def nombre_o_recargar(self, conn, catalogo: str, id_: int) -> Optional[str]:
+        """Nombre desde memoria; si el id no está, recarga una vez (alguien editó el catálogo)."""
+        self.asegurar_cargado(conn)
+        nombre = self.nombre(catalogo, id_)
+        if nombre is None:
+            self.recargar(conn)
+            nombre = self.nombre(catalogo, id_)
+        return nombre
+
+
+def _hash(contenido: Any) -> str:
+    canonico = json.dumps(contenido, sort_keys=True, separators=(",", ":"), default=str, ensure_ascii=False)
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()[:32]
+
+
+almacen_catalogos = AlmacenCatalogos()
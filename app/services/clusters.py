@@ -0,0 +1,81 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.puntos import CapaPuntos, capa_reportes, capa_infraestructura
+from app.services.teselas import TeselaCache
+
+# =========================
+# CLUSTERS POR ZOOM
+# =========================
+# Cada tesela XYZ se divide en una grilla de CLUSTER_CELDAS x CLUSTER_CELDAS;
+# los puntos de cada celda se agregan en un cluster (conteo, centroide y
+# desglose por atributo). El resultado se cachea por tesela y se invalida
+# solo en las teselas donde cambió un punto.
+CLUSTER_CELDAS = int(os.getenv("CLUSTER_CELDAS", "8"))
+
+DESGLOSES = {
+    "reportes": ["id_tipo_incidente", "id_severidad"],
+    "infraestructura": ["tipo"],
+}
+
+cache_clusters = TeselaCache(maxsize=int(os.getenv("CLUSTER_CACHE_MAX", "4096")))
+capa_reportes.suscribir(cache_clusters.listener(capa_reportes.nombre))
+capa_infraestructura.suscribir(cache_clusters.listener(capa_infraestructura.nombre))
+
+
+def _calcular_tesela(capa: CapaPuntos, z: int, x: int, y: int,
+                     alcance: Optional[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    a = capa.arrays()
+    n = 1 << z
+    tx = a["mx"] * n
+    ty = a["my"] * n
+    sel = (np.floor(tx) == x) & (np.floor(ty) == y)
+    if alcance is not None:
+        columna, valor = alcance
+        sel &= a[columna] == valor
+    idx = np.nonzero(sel)[0]
+    if idx.size == 0:
+        return []
+
+    cx = np.minimum(((tx[idx] - x) * CLUSTER_CELDAS).astype(np.int64), CLUSTER_CELDAS - 1)
+    cy = np.minimum(((ty[idx] - y) * CLUSTER_CELDAS).astype(np.int64), CLUSTER_CELDAS - 1)
+    celdas, inv, totales = np.unique(cy * CLUSTER_CELDAS + cx, return_inverse=True, return_counts=True)
+    lat = np.bincount(inv, weights=a["latitud"][idx]) / totales
+    lon = np.bincount(inv, weights=a["longitud"][idx]) / totales
+
+    desgloses = {}
+    for atributo in DESGLOSES[capa.nombre]:
+        valores, vinv = np.unique(a[atributo][idx], return_inverse=True)
+        conteo = np.bincount(inv * len(valores) + vinv, minlength=len(celdas) * len(valores))
+        desgloses[atributo] = (valores, conteo.reshape(len(celdas), len(valores)))
+
+    ids = a[capa.id_col][idx]
+    clusters = []
+    for i in range(len(celdas)):
+        cluster = {
+            "lat": round(float(lat[i]), 6),
+            "lon": round(float(lon[i]), 6),
+            "total": int(totales[i]),
+        }
+        for atributo, (valores, conteo) in desgloses.items():
+            fila = conteo[i]
+            cluster[f"por_{atributo.removeprefix('id_')}"] = {
+                str(valores[j]): int(fila[j]) for j in np.nonzero(fila)[0]
+            }
+        if totales[i] == 1:
+            cluster[capa.id_col] = int(ids[inv == i][0])
+        clusters.append(cluster)
+    return clusters
+
+
+def clusters_tesela(capa: CapaPuntos, z: int, x: int, y: int,
+                    alcance: Optional[Tuple[str, int]] = None) -> List[Dict[str, Any]]:
+    version = cache_clusters.version(capa.nombre)
+    cached = cache_clusters.get(capa.nombre, z, x, y, alcance)
+    if cached is not None:
+        return cached
+    clusters = _calcular_tesela(capa, z, x, y, alcance)
+    cache_clusters.set(capa.nombre, z, x, y, alcance, clusters, version)
+    return clusters
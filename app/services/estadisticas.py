@@ -0,0 +1,543 @@
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pymysql
+
+logger = logging.getLogger("geovisor")
+
+# =========================
+# RESUMEN DE REPORTES (TABLA estadisticas_reportes)
+# =========================
+# Contadores por (día de creación, estado, tipo, severidad, entidad). Las funciones
+# reciben el cursor del endpoint para escribir en la MISMA transacción que el
+# reporte: si el alta o el cambio de estado se revierte, el contador también.
+
+def _dia(created_at: Union[date, datetime, None]) -> date:
+    if created_at is None:
+        return date.today()
+    return created_at.date() if isinstance(created_at, datetime) else created_at
+
+
+def _sumar(cursor, reporte: Dict[str, Any], deltas: Dict[int, int]) -> None:
+    """Suma deltas {id_estado: delta} en los grupos del reporte con un solo INSERT multi-fila."""
+    fila = (_dia(reporte.get("created_at")), reporte["id_tipo_incidente"],
+            reporte["id_severidad"], reporte.get("id_entidad") or 0)
+    params: List[Any] = []
+    for id_estado, delta in deltas.items():
+        params.extend([fila[0], id_estado, *fila[1:], delta])
+    cursor.execute(f"""
+        INSERT INTO estadisticas_reportes
+            (dia, id_estado, id_tipo_incidente, id_severidad, id_entidad, total)
+        VALUES {", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(deltas))}
+        ON DUPLICATE KEY UPDATE total = total + VALUES(total);
+    """, params)
+
+
+def registrar_alta(cursor, reporte: Dict[str, Any]) -> None:
+    """+1 en el grupo del reporte recién creado."""
+    _sumar(cursor, reporte, {reporte["id_estado"]: +1})
+
+
+def registrar_altas(cursor, reportes: List[Dict[str, Any]]) -> None:
+    """Alta de varios reportes: deltas agregados por grupo en un solo INSERT multi-fila."""
+    deltas: Dict[tuple, int] = {}
+    for r in reportes:
+        clave = (_dia(r.get("created_at")), r["id_estado"], r["id_tipo_incidente"],
+                 r["id_severidad"], r.get("id_entidad") or 0)
+        deltas[clave] = deltas.get(clave, 0) + 1
+    if not deltas:
+        return
+    cursor.execute(f"""
+        INSERT INTO estadisticas_reportes
+            (dia, id_estado, id_tipo_incidente, id_severidad, id_entidad, total)
+        VALUES {", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(deltas))}
+        ON DUPLICATE KEY UPDATE total = total + VALUES(total);
+    """, [v for clave, delta in deltas.items() for v in (*clave, delta)])
+
+
+def registrar_cambio_estado(cursor, reporte: Dict[str, Any], id_estado_anterior: int,
+                            id_estado_nuevo: int) -> None:
+    """Mueve el reporte de grupo: -1 en el estado anterior, +1 en el nuevo."""
+    if id_estado_anterior == id_estado_nuevo:
+        return
+    _sumar(cursor, reporte, {id_estado_anterior: -1, id_estado_nuevo: +1})
+
+
+def registrar_reasignaciones(cursor, cambios: List[Tuple[Dict[str, Any], int]]) -> None:
+    """
+    Reportes que cambian de entidad: pares (reporte con su id_entidad anterior, entidad nueva).
+    Mueve cada uno de grupo (-1 / +1, agregados en un solo INSERT multi-fila) y corrige
+    la entidad de su fila en reportes_resolucion. Los rollups diarios no se tocan aquí:
+    quien reasigna recalcula esos días con recalcular_dias.
+    """
+    deltas: Dict[tuple, int] = {}
+    for r, id_entidad_nueva in cambios:
+        base = (_dia(r.get("created_at")), r["id_estado"], r["id_tipo_incidente"], r["id_severidad"])
+        for id_entidad, delta in ((r.get("id_entidad") or 0, -1), (id_entidad_nueva or 0, +1)):
+            deltas[(*base, id_entidad)] = deltas.get((*base, id_entidad), 0) + delta
+    deltas = {clave: delta for clave, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    cursor.execute(f"""
+        INSERT INTO estadisticas_reportes
+            (dia, id_estado, id_tipo_incidente, id_severidad, id_entidad, total)
+        VALUES {", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(deltas))}
+        ON DUPLICATE KEY UPDATE total = total + VALUES(total);
+    """, [v for clave, delta in deltas.items() for v in (*clave, delta)])
+    cursor.executemany(
+        "UPDATE reportes_resolucion SET id_entidad = %s WHERE id_reporte = %s;",
+        [(id_entidad_nueva or 0, r["id_reporte"]) for r, id_entidad_nueva in cambios],
+    )
+
+
+SQL_RECALCULO = """
+    SELECT DATE(created_at) AS dia, id_estado, id_tipo_incidente, id_severidad,
+           COALESCE(id_entidad, 0) AS id_entidad, COUNT(*) AS total
+    FROM reportes
+    GROUP BY DATE(created_at), id_estado, id_tipo_incidente, id_severidad, COALESCE(id_entidad, 0)
+"""
+
+
+def reconstruir(conn) -> int:
+    """Recalcula toda la tabla desde reportes en una sola transacción. Devuelve los grupos escritos."""
+    conn.begin()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM estadisticas_reportes;")
+            cursor.execute(f"""
+                INSERT INTO estadisticas_reportes
+                    (dia, id_estado, id_tipo_incidente, id_severidad, id_entidad, total)
+                {SQL_RECALCULO};
+            """)
+            grupos = cursor.rowcount
+        conn.commit()
+        return grupos
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def diferencias(conn) -> Dict[str, Any]:
+    """Grupos cuyo contador no coincide con un conteo directo sobre reportes."""
+    with conn.cursor() as cursor:
+        cursor.execute(SQL_RECALCULO + ";")
+        real = {
+            (r["dia"], r["id_estado"], r["id_tipo_incidente"], r["id_severidad"], r["id_entidad"]): r["total"]
+            for r in cursor.fetchall()
+        }
+        cursor.execute("""
+            SELECT dia, id_estado, id_tipo_incidente, id_severidad, id_entidad, total
+            FROM estadisticas_reportes WHERE total <> 0;
+        """)
+        resumen = {
+            (r["dia"], r["id_estado"], r["id_tipo_incidente"], r["id_severidad"], r["id_entidad"]): r["total"]
+            for r in cursor.fetchall()
+        }
+    distintos = {k: (resumen.get(k, 0), real.get(k, 0))
+                 for k in real.keys() | resumen.keys() if resumen.get(k, 0) != real.get(k, 0)}
+    return {"grupos": len(real), "desajustados": len(distintos), "detalle": distintos}
+
+
+def resumen(conn, desde: Optional[date] = None, hasta: Optional[date] = None,
+            id_entidad: Optional[int] = None) -> Dict[str, Any]:
+    """Totales por estado, tipo, severidad y entidad, sumando grupos (no reportes)."""
+    condiciones, params = ["total <> 0"], []
+    if desde is not None:
+        condiciones.append("dia >= %s")
+        params.append(desde)
+    if hasta is not None:
+        condiciones.append("dia < %s")
+        params.append(hasta)
+    if id_entidad is not None:
+        condiciones.append("id_entidad = %s")
+        params.append(id_entidad)
+
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT id_estado, id_tipo_incidente, id_severidad, id_entidad, SUM(total) AS total
+            FROM estadisticas_reportes
+            WHERE {" AND ".join(condiciones)}
+            GROUP BY id_estado, id_tipo_incidente, id_severidad, id_entidad;
+        """, params)
+        grupos = cursor.fetchall()
+
+    dimensiones = {
+        "por_estado": "id_estado",
+        "por_tipo_incidente": "id_tipo_incidente",
+        "por_severidad": "id_severidad",
+        "por_entidad": "id_entidad",
+    }
+    resultado: Dict[str, Any] = {"total": 0, **{k: {} for k in dimensiones}}
+    for g in grupos:
+        total = int(g["total"])
+        resultado["total"] += total
+        for clave, columna in dimensiones.items():
+            valor = str(g[columna])
+            resultado[clave][valor] = resultado[clave].get(valor, 0) + total
+    return resultado
+
+
+# =========================
+# SERIE DE TIEMPO (TABLA estadisticas_diarias)
+# =========================
+# Rollups por día: los días cerrados no cambian, así que solo se recalculan una
+# vez (backfill); la tarea de fondo recalcula únicamente el día en curso.
+ESTADOS_RESUELTOS = [
+    e.strip().upper() for e in os.getenv("ESTADOS_RESUELTOS", "RESUELTO,CERRADO").split(",") if e.strip()
+]
+SERIE_INTERVALO_SEG = float(os.getenv("ESTADISTICAS_SERIE_INTERVALO_SEG", "60"))
+
+GRANULARIDADES = {
+    "dia": "dia",
+    "semana": "DATE_SUB(dia, INTERVAL WEEKDAY(dia) DAY)",   # lunes de la semana
+    "mes": "CAST(DATE_FORMAT(dia, '%%Y-%%m-01') AS DATE)",
+}
+
+
+def recalcular_dias(conn, desde: date, hasta: date) -> int:
+    """
+    Reescribe los rollups de [desde, hasta) desde reportes e historial_reportes.
+    Un resuelto es una transición desde un estado no resuelto (RESUELTO -> CERRADO no suma).
+    """
+    inicio = datetime.combine(desde, datetime.min.time())
+    fin = datetime.combine(hasta, datetime.min.time())
+    estados = ", ".join(["%s"] * len(ESTADOS_RESUELTOS)) or "NULL"
+    conn.begin()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM estadisticas_diarias WHERE dia >= %s AND dia < %s;", (desde, hasta))
+            cursor.execute(f"""
+                INSERT INTO estadisticas_diarias (dia, id_tipo_incidente, id_entidad, creados, resueltos)
+                SELECT dia, id_tipo_incidente, id_entidad, SUM(creados), SUM(resueltos)
+                FROM (
+                    SELECT DATE(created_at) AS dia, id_tipo_incidente,
+                           COALESCE(id_entidad, 0) AS id_entidad, 1 AS creados, 0 AS resueltos
+                    FROM reportes
+                    WHERE created_at >= %s AND created_at < %s
+                    UNION ALL
+                    SELECT DATE(h.fecha_cambio), r.id_tipo_incidente,
+                           COALESCE(r.id_entidad, 0), 0, 1
+                    FROM historial_reportes h
+                    JOIN reportes r ON r.id_reporte = h.id_reporte
+                    WHERE h.fecha_cambio >= %s AND h.fecha_cambio < %s
+                      AND UPPER(h.estado_nuevo) IN ({estados})
+                      AND (h.estado_anterior IS NULL OR UPPER(h.estado_anterior) NOT IN ({estados}))
+                ) t
+                GROUP BY dia, id_tipo_incidente, id_entidad;
+            """, (inicio, fin, inicio, fin, *ESTADOS_RESUELTOS, *ESTADOS_RESUELTOS))
+            grupos = cursor.rowcount
+        conn.commit()
+        return grupos
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def serie(conn, desde: date, hasta: date, granularidad: str,
+          id_tipo_incidente: Optional[int] = None, id_entidad: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Creados y resueltos por periodo en [desde, hasta), con los periodos vacíos en cero."""
+    periodo = GRANULARIDADES[granularidad]
+    condiciones, params = ["dia >= %s", "dia < %s"], [desde, hasta]
+    if id_tipo_incidente is not None:
+        condiciones.append("id_tipo_incidente = %s")
+        params.append(id_tipo_incidente)
+    if id_entidad is not None:
+        condiciones.append("id_entidad = %s")
+        params.append(id_entidad)
+
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT {periodo} AS periodo, SUM(creados) AS creados, SUM(resueltos) AS resueltos
+            FROM estadisticas_diarias
+            WHERE {" AND ".join(condiciones)}
+            GROUP BY periodo
+            ORDER BY periodo;
+        """, params)
+        filas = {_dia(r["periodo"]): r for r in cursor.fetchall()}
+
+    puntos = []
+    for inicio in _periodos(desde, hasta, granularidad):
+        fila = filas.get(inicio) or {}
+        puntos.append({
+            "periodo": inicio.isoformat(),
+            "creados": int(fila.get("creados") or 0),
+            "resueltos": int(fila.get("resueltos") or 0),
+        })
+    return puntos
+
+
+def _periodos(desde: date, hasta: date, granularidad: str):
+    if granularidad == "semana":
+        actual = desde - timedelta(days=desde.weekday())
+    elif granularidad == "mes":
+        actual = desde.replace(day=1)
+    else:
+        actual = desde
+    while actual < hasta:
+        yield actual
+        if granularidad == "dia":
+            actual += timedelta(days=1)
+        elif granularidad == "semana":
+            actual += timedelta(days=7)
+        else:
+            actual = (actual.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+async def tarea_dia_actual(get_connection) -> None:
+    """
+    Tarea de fondo: cada SERIE_INTERVALO_SEG recalcula los rollups de hoy.
+    Al cambiar de día recalcula una última vez el día que acaba de cerrar.
+    """
+    ultimo_dia: Optional[date] = None
+    while True:
+        hoy = date.today()
+        dias = [hoy] if ultimo_dia in (None, hoy) else [ultimo_dia, hoy]
+        try:
+            for dia in dias:
+                await asyncio.to_thread(_recalcular_un_dia, get_connection, dia)
+            ultimo_dia = hoy
+        except Exception as e:
+            logger.warning("No se pudo recalcular la serie del día: %s", e)
+        await asyncio.sleep(SERIE_INTERVALO_SEG)
+
+
+def _recalcular_un_dia(get_connection, dia: date) -> None:
+    conn = get_connection()
+    try:
+        recalcular_dias(conn, dia, dia + timedelta(days=1))
+    finally:
+        conn.close()
+
+
+# =========================
+# DURACIÓN POR ESTADO Y TIEMPO DE RESOLUCIÓN
+# =========================
+# Se mantienen en cada transición (mismo cursor y transacción que el historial),
+# así que los percentiles se calculan sobre una fila por reporte resuelto en
+# lugar de emparejar filas de historial_reportes con funciones de ventana.
+AGRUPACIONES_RESOLUCION = {
+    "entidad": ["id_entidad"],
+    "tipo_incidente": ["id_tipo_incidente"],
+    "entidad_tipo": ["id_entidad", "id_tipo_incidente"],
+}
+
+
+def es_resuelto(estado: Optional[str]) -> bool:
+    return (estado or "").upper() in ESTADOS_RESUELTOS
+
+
+def registrar_transicion(cursor, id_reporte: int, estado_anterior: Optional[str], estado_nuevo: str,
+                         tramo_abierto: Optional[Dict[str, Any]] = None, alta: bool = False) -> None:
+    """
+    Cierra el tramo abierto del reporte, abre el del nuevo estado y actualiza su resolución.
+    `tramo_abierto` = {estado, desde} del tramo abierto si el llamador ya lo leyó: así
+    cerrar y abrir van en un solo INSERT multi-fila en lugar de UPDATE + INSERT.
+    En el alta (`alta=True`) no hay tramo que cerrar.
+    """
+    if tramo_abierto is not None:
+        desde = tramo_abierto["desde"]
+        cursor.execute("""
+            INSERT INTO reportes_duracion_estado (id_reporte, estado, desde, hasta, segundos)
+            VALUES (%s, %s, %s, NOW(), TIMESTAMPDIFF(SECOND, %s, NOW())),
+                   (%s, %s, NOW(), NULL, NULL)
+            ON DUPLICATE KEY UPDATE hasta = VALUES(hasta), segundos = VALUES(segundos);
+        """, (id_reporte, tramo_abierto["estado"], desde, desde, id_reporte, estado_nuevo))
+    else:
+        if not alta:
+            cursor.execute("""
+                UPDATE reportes_duracion_estado
+                SET hasta = NOW(), segundos = TIMESTAMPDIFF(SECOND, desde, NOW())
+                WHERE id_reporte = %s AND hasta IS NULL;
+            """, (id_reporte,))
+        cursor.execute("""
+            INSERT INTO reportes_duracion_estado (id_reporte, estado, desde)
+            VALUES (%s, %s, NOW());
+        """, (id_reporte, estado_nuevo))
+
+    if es_resuelto(estado_nuevo):
+        # RESUELTO -> CERRADO no es una nueva resolución: se conserva la primera
+        if es_resuelto(estado_anterior):
+            return
+        cursor.execute("""
+            INSERT INTO reportes_resolucion
+                (id_reporte, id_entidad, id_tipo_incidente, creado, resuelto, segundos)
+            SELECT id_reporte, COALESCE(id_entidad, 0), id_tipo_incidente, created_at,
+                   NOW(), TIMESTAMPDIFF(SECOND, created_at, NOW())
+            FROM reportes WHERE id_reporte = %s
+            ON DUPLICATE KEY UPDATE
+                id_entidad = VALUES(id_entidad),
+                resuelto   = VALUES(resuelto),
+                segundos   = VALUES(segundos);
+        """, (id_reporte,))
+    elif es_resuelto(estado_anterior):
+        cursor.execute("DELETE FROM reportes_resolucion WHERE id_reporte = %s;", (id_reporte,))
+
+
+def abrir_tramos(cursor, ids_reporte: List[int], estado: str) -> None:
+    """Primer tramo de varios reportes recién creados, en un solo INSERT multi-fila."""
+    if not ids_reporte:
+        return
+    cursor.execute(f"""
+        INSERT INTO reportes_duracion_estado (id_reporte, estado, desde)
+        VALUES {", ".join(["(%s, %s, NOW())"] * len(ids_reporte))};
+    """, [v for id_ in ids_reporte for v in (id_, estado)])
+
+
+def _percentiles(segundos: List[int]) -> Dict[str, Any]:
+    valores = np.asarray(segundos, dtype=np.float64) / 3600.0
+    mediana, p90 = np.percentile(valores, [50, 90])
+    return {
+        "n": int(valores.size),
+        "mediana_horas": round(float(mediana), 2),
+        "p90_horas": round(float(p90), 2),
+        "promedio_horas": round(float(valores.mean()), 2),
+    }
+
+
+def _agrupar_percentiles(filas: List[Dict[str, Any]], columnas: List[str]) -> List[Dict[str, Any]]:
+    grupos: Dict[tuple, List[int]] = {}
+    for fila in filas:
+        grupos.setdefault(tuple(fila[c] for c in columnas), []).append(fila["segundos"])
+    return [
+        {**dict(zip(columnas, clave)), **_percentiles(valores)}
+        for clave, valores in sorted(grupos.items())
+    ]
+
+
+def tiempos_resolucion(conn, por: str, desde: Optional[date] = None, hasta: Optional[date] = None,
+                       id_entidad: Optional[int] = None,
+                       id_tipo_incidente: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Mediana y p90 (horas) desde la creación hasta la resolución, por grupo. Filtra por fecha de resolución."""
+    columnas = AGRUPACIONES_RESOLUCION[por]
+    condiciones, params = ["1=1"], []
+    if desde is not None:
+        condiciones.append("resuelto >= %s")
+        params.append(desde)
+    if hasta is not None:
+        condiciones.append("resuelto < %s")
+        params.append(hasta)
+    if id_entidad is not None:
+        condiciones.append("id_entidad = %s")
+        params.append(id_entidad)
+    if id_tipo_incidente is not None:
+        condiciones.append("id_tipo_incidente = %s")
+        params.append(id_tipo_incidente)
+
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT {", ".join(columnas)}, segundos
+            FROM reportes_resolucion
+            WHERE {" AND ".join(condiciones)};
+        """, params)
+        filas = cursor.fetchall()
+    return _agrupar_percentiles(filas, columnas)
+
+
+def tiempo_en_estado(conn, desde: Optional[date] = None, hasta: Optional[date] = None,
+                     id_entidad: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Mediana y p90 (horas) de los tramos ya cerrados de cada estado."""
+    condiciones, params = ["d.hasta IS NOT NULL"], []
+    if desde is not None:
+        condiciones.append("d.hasta >= %s")
+        params.append(desde)
+    if hasta is not None:
+        condiciones.append("d.hasta < %s")
+        params.append(hasta)
+    join = ""
+    if id_entidad is not None:
+        join = "JOIN reportes r ON r.id_reporte = d.id_reporte"
+        condiciones.append("COALESCE(r.id_entidad, 0) = %s")
+        params.append(id_entidad)
+
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT d.estado, d.segundos
+            FROM reportes_duracion_estado d
+            {join}
+            WHERE {" AND ".join(condiciones)};
+        """, params)
+        filas = cursor.fetchall()
+    return _agrupar_percentiles(filas, ["estado"])
+
+
+def reconstruir_duraciones(conn_lectura, conn_escritura, lote: int = 5000) -> Dict[str, int]:
+    """
+    Rellena reportes_duracion_estado y reportes_resolucion desde historial_reportes
+    (una sola pasada ordenada por reporte y fecha). Para datos anteriores a la migración.
+    La lectura va por un cursor sin buffer en su propia conexión; la escritura es
+    una sola transacción en la otra.
+    """
+    conn_escritura.begin()
+    with conn_escritura.cursor() as cursor:
+        cursor.execute("DELETE FROM reportes_duracion_estado;")
+        cursor.execute("DELETE FROM reportes_resolucion;")
+
+    tramos, resoluciones = [], []
+    totales = {"tramos": 0, "resueltos": 0}
+
+    def _volcar():
+        if not tramos and not resoluciones:
+            return
+        with conn_escritura.cursor() as cursor:
+            if tramos:
+                cursor.executemany("""
+                    INSERT INTO reportes_duracion_estado (id_reporte, estado, desde, hasta, segundos)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE hasta = VALUES(hasta), segundos = VALUES(segundos);
+                """, tramos)
+            if resoluciones:
+                cursor.executemany("""
+                    INSERT INTO reportes_resolucion
+                        (id_reporte, id_entidad, id_tipo_incidente, creado, resuelto, segundos)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE resuelto = VALUES(resuelto), segundos = VALUES(segundos);
+                """, resoluciones)
+        totales["tramos"] += len(tramos)
+        totales["resueltos"] += len(resoluciones)
+        tramos.clear()
+        resoluciones.clear()
+
+    def _cerrar_reporte(actual, historial):
+        for i, h in enumerate(historial):
+            siguiente = historial[i + 1]["fecha_cambio"] if i + 1 < len(historial) else None
+            segundos = int((siguiente - h["fecha_cambio"]).total_seconds()) if siguiente else None
+            tramos.append((actual["id_reporte"], h["estado_nuevo"], h["fecha_cambio"], siguiente, segundos))
+        if not es_resuelto(historial[-1]["estado_nuevo"]):
+            return
+        # Resolución = primera entrada a un estado resuelto después de la última reapertura
+        primera = len(historial) - 1
+        while primera > 0 and es_resuelto(historial[primera - 1]["estado_nuevo"]):
+            primera -= 1
+        resuelto = historial[primera]["fecha_cambio"]
+        resoluciones.append((
+            actual["id_reporte"], actual["id_entidad"] or 0, actual["id_tipo_incidente"],
+            actual["created_at"], resuelto,
+            int((resuelto - actual["created_at"]).total_seconds()),
+        ))
+
+    with conn_lectura.cursor(pymysql.cursors.SSDictCursor) as cursor:
+        cursor.execute("""
+            SELECT h.id_reporte, h.estado_nuevo, h.fecha_cambio,
+                   r.created_at, r.id_entidad, r.id_tipo_incidente
+            FROM historial_reportes h
+            JOIN reportes r ON r.id_reporte = h.id_reporte
+            ORDER BY h.id_reporte, h.fecha_cambio, h.id_historial;
+        """)
+        actual, historial = None, []
+        for fila in cursor:
+            if actual is not None and fila["id_reporte"] != actual["id_reporte"]:
+                _cerrar_reporte(actual, historial)
+                historial = []
+                if len(tramos) >= lote:
+                    _volcar()
+            actual = fila
+            historial.append(fila)
+        if actual is not None:
+            _cerrar_reporte(actual, historial)
+    _volcar()
+    conn_escritura.commit()
+    return totales
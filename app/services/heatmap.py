@@ -0,0 +1,190 @@
+import math
+import os
+import threading
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.puntos import CapaPuntos, capa_reportes
+
+# =========================
+# MAPA DE CALOR (DENSIDAD POR CELDA)
+# =========================
+# Conteos de reportes pre-agregados por (celda, tipo, severidad, estado, entidad, día).
+# Se calcula una vez desde la capa en memoria con binning de NumPy y luego cada
+# alta o cambio de estado solo suma/resta 1 en su grupo (listener de la capa).
+# Una consulta filtra los grupos (no los reportes) y suma por celda.
+HEATMAP_CELDA_GRADOS = float(os.getenv("HEATMAP_CELDA_GRADOS", "0.01"))  # ~1.1 km
+HEATMAP_CACHE_MAX = int(os.getenv("HEATMAP_CACHE_MAX", "256"))
+
+# Columnas de la clave de cada grupo
+CX, CY, TIPO, SEVERIDAD, ESTADO, ENTIDAD, DIA = range(7)
+_EPOCA = date(1970, 1, 1)
+
+
+def _dia(valor: Any) -> int:
+    """Días desde 1970-01-01 (-1 si no hay fecha)."""
+    if valor is None:
+        return -1
+    if isinstance(valor, datetime):
+        valor = valor.date()
+    return (valor - _EPOCA).days
+
+
+def _sumar_por_celda(cx: np.ndarray, cy: np.ndarray, pesos: np.ndarray,
+                     celda: float) -> List[Dict[str, Any]]:
+    if cx.size == 0:
+        return []
+    pares = np.stack([cx, cy], axis=1)
+    celdas, inv = np.unique(pares, axis=0, return_inverse=True)
+    totales = np.bincount(inv.ravel(), weights=pesos, minlength=len(celdas)).astype(np.int64)
+    return [
+        {"lat": round((cy_ + 0.5) * celda, 6), "lon": round((cx_ + 0.5) * celda, 6), "total": int(t)}
+        for (cx_, cy_), t in zip(celdas.tolist(), totales.tolist()) if t > 0
+    ]
+
+
+class MapaCalor:
+    def __init__(self, capa: CapaPuntos, celda: float = HEATMAP_CELDA_GRADOS):
+        self.capa = capa
+        self.celda = celda
+        self._conteos: Dict[Tuple[int, ...], int] = {}
+        self._claves: Optional[np.ndarray] = None   # (grupos, 7), se rearma solo si hubo cambios
+        self._pesos: Optional[np.ndarray] = None
+        self._version = 0
+        self._cache: Dict[tuple, List[Dict[str, Any]]] = {}
+        self._lock = threading.RLock()
+        capa.suscribir(self._on_cambio)
+
+    # ---------- mantenimiento ----------
+
+    def _clave(self, r: Dict[str, Any]) -> Tuple[int, ...]:
+        return (
+            math.floor(float(r["longitud"]) / self.celda),
+            math.floor(float(r["latitud"]) / self.celda),
+            r.get("id_tipo_incidente") or -1,
+            r.get("id_severidad") or -1,
+            r.get("id_estado") or -1,
+            r.get("id_entidad") or -1,
+            _dia(r.get("created_at")),
+        )
+
+    def _claves_capa(self, a: Dict[str, np.ndarray]) -> np.ndarray:
+        """Matriz de claves (n, 7) para toda la capa, vectorizada."""
+        dias = a["created_at"].astype("datetime64[D]")
+        dias = np.where(np.isnat(dias), -1, dias.astype(np.int64))
+        return np.stack([
+            np.floor(a["longitud"] / self.celda).astype(np.int64),
+            np.floor(a["latitud"] / self.celda).astype(np.int64),
+            a["id_tipo_incidente"], a["id_severidad"], a["id_estado"], a["id_entidad"],
+            dias,
+        ], axis=1)
+
+    def reconstruir(self) -> None:
+        a = self.capa.arrays()
+        conteos: Dict[Tuple[int, ...], int] = {}
+        if len(a["latitud"]):
+            grupos, totales = np.unique(self._claves_capa(a), axis=0, return_counts=True)
+            conteos = {tuple(g): int(t) for g, t in zip(grupos.tolist(), totales.tolist())}
+        with self._lock:
+            self._conteos = conteos
+            self._cambio()
+
+    def _sumar(self, registro: Dict[str, Any], delta: int) -> None:
+        clave = self._clave(registro)
+        total = self._conteos.get(clave, 0) + delta
+        if total > 0:
+            self._conteos[clave] = total
+        else:
+            self._conteos.pop(clave, None)
+
+    def _cambio(self) -> None:
+        self._claves = None
+        self._pesos = None
+        self._version += 1
+        self._cache.clear()
+
+    def _on_cambio(self, anterior: Optional[Dict[str, Any]], nuevo: Optional[Dict[str, Any]]) -> None:
+        if anterior is None and nuevo is None:
+            self.reconstruir()
+            return
+        with self._lock:
+            if anterior is not None:
+                self._sumar(anterior, -1)
+            if nuevo is not None:
+                self._sumar(nuevo, +1)
+            self._cambio()
+
+    # ---------- consulta ----------
+
+    @staticmethod
+    def _mascara(claves: np.ndarray, filtros: Dict[int, Optional[int]],
+                 desde: Optional[date], hasta: Optional[date],
+                 bbox: Optional[Tuple[float, float, float, float]], celda: float) -> np.ndarray:
+        sel = np.ones(len(claves), dtype=bool)
+        for columna, valor in filtros.items():
+            if valor is not None:
+                sel &= claves[:, columna] == valor
+        if desde is not None:
+            sel &= claves[:, DIA] >= _dia(desde)
+        if hasta is not None:
+            sel &= claves[:, DIA] < _dia(hasta)
+        if bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            sel &= (claves[:, CX] >= math.floor(min_lon / celda)) & (claves[:, CX] <= math.floor(max_lon / celda))
+            sel &= (claves[:, CY] >= math.floor(min_lat / celda)) & (claves[:, CY] <= math.floor(max_lat / celda))
+        return sel
+
+    def densidad(self, id_tipo_incidente: Optional[int] = None, id_severidad: Optional[int] = None,
+                 id_estado: Optional[int] = None, desde: Optional[date] = None, hasta: Optional[date] = None,
+                 bbox: Optional[Tuple[float, float, float, float]] = None,
+                 alcance: Optional[Tuple[str, int]] = None) -> List[Dict[str, Any]]:
+        """
+        Celdas con su conteo. `alcance` = visibilidad por rol (ver alcance_reportes):
+        por entidad se resuelve sobre los grupos; por usuario se cuenta sobre la capa.
+        """
+        filtros = {TIPO: id_tipo_incidente, SEVERIDAD: id_severidad, ESTADO: id_estado}
+        if alcance is not None and alcance[0] == "id_usuario":
+            return self._densidad_capa(filtros, desde, hasta, bbox, alcance[1])
+        if alcance is not None:
+            filtros[ENTIDAD] = alcance[1]
+
+        llave = (tuple(filtros.items()), desde, hasta, bbox)
+        with self._lock:
+            cached = self._cache.get(llave)
+            if cached is not None:
+                return cached
+            if self._claves is None:
+                self._claves = np.array(list(self._conteos.keys()), dtype=np.int64).reshape(-1, 7)
+                self._pesos = np.array(list(self._conteos.values()), dtype=np.float64)
+            claves, pesos, version = self._claves, self._pesos, self._version
+
+        sel = self._mascara(claves, filtros, desde, hasta, bbox, self.celda)
+        celdas = _sumar_por_celda(claves[sel, CX], claves[sel, CY], pesos[sel], self.celda)
+        with self._lock:
+            if version == self._version:
+                if len(self._cache) >= HEATMAP_CACHE_MAX:
+                    self._cache.pop(next(iter(self._cache)))
+                self._cache[llave] = celdas
+        return celdas
+
+    def _densidad_capa(self, filtros, desde, hasta, bbox, id_usuario: int) -> List[Dict[str, Any]]:
+        a = self.capa.arrays()
+        propios = np.nonzero(a["id_usuario"] == id_usuario)[0]
+        claves = self._claves_capa({k: v[propios] for k, v in a.items()})
+        sel = self._mascara(claves, filtros, desde, hasta, bbox, self.celda)
+        return _sumar_por_celda(claves[sel, CX], claves[sel, CY],
+                                np.ones(int(sel.sum()), dtype=np.float64), self.celda)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "grupos": len(self._conteos),
+                "reportes": sum(self._conteos.values()),
+                "consultas_cacheadas": len(self._cache),
+                "celda_grados": self.celda,
+            }
+
+
+mapa_calor = MapaCalor(capa_reportes)
@@ -0,0 +1,272 @@
+import codecs
+import csv
+import hashlib
+import io
+import json
+import os
+import time
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+# =========================
+# IMPORTACIÓN MASIVA DE INFRAESTRUCTURA (SIASAR)
+# =========================
+# Lee CSV o GeoJSON de forma incremental (nunca el archivo completo en memoria),
+# valida cada fila con el mismo modelo que POST /infraestructura y hace upsert
+# por lotes con INSERT multi-fila ... ON DUPLICATE KEY UPDATE sobre la clave
+# natural (fuente, codigo_externo). Si la fila no trae código se deriva uno
+# estable de nombre + tipo + coordenadas.
+IMPORTACION_LOTE = int(os.getenv("IMPORTACION_LOTE", "500"))
+IMPORTACION_ERRORES_MAX = 100          # detalle de errores que se devuelve (se cuentan todos)
+LECTURA_BYTES = 64 * 1024
+
+# Nombres de columna/propiedad aceptados (SIASAR y genéricos), en minúsculas
+ALIAS = {
+    "codigo_externo": ("codigo_externo", "codigo", "siasar_id", "id_siasar", "id", "code"),
+    "nombre":         ("nombre", "name", "nombre_sistema", "sistema"),
+    "tipo":           ("tipo", "type", "tipo_infraestructura", "tipologia"),
+    "latitud":        ("latitud", "lat", "latitude", "y"),
+    "longitud":       ("longitud", "lon", "lng", "long", "longitude", "x"),
+    "estado":         ("estado", "status", "estado_funcionamiento"),
+}
+
+
+def _normalizar(crudo: Dict[str, Any]) -> Dict[str, Any]:
+    minusculas = {str(k).strip().lower(): v for k, v in crudo.items()}
+    fila = {}
+    for campo, alias in ALIAS.items():
+        for nombre in alias:
+            valor = minusculas.get(nombre)
+            if valor not in (None, ""):
+                fila[campo] = valor.strip() if isinstance(valor, str) else valor
+                break
+    return fila
+
+
+def clave_natural(fila: Dict[str, Any]) -> str:
+    """codigo_externo de la fuente o, si no viene, un hash estable del punto."""
+    if fila.get("codigo_externo") not in (None, ""):
+        return str(fila["codigo_externo"])[:100]
+    base = "|".join([
+        str(fila.get("nombre", "")).strip().upper(),
+        str(fila.get("tipo", "")).strip().upper(),
+        f"{float(fila['latitud']):.6f}",
+        f"{float(fila['longitud']):.6f}",
+    ])
+    return "auto:" + hashlib.sha1(base.encode("utf-8")).hexdigest()[:32]
+
+
+class ArchivoInvalido(ValueError):
+    """El archivo no se puede leer (estructura rota); distinto de una fila que no valida."""
+
+
+# ---------- lectores incrementales ----------
+
+def leer_csv(archivo: BinaryIO) -> Iterator[Dict[str, Any]]:
+    texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", newline="")
+    try:
+        muestra = texto.read(4096)
+        # Del sniffer solo se toma el separador: sus demás conjeturas (ej. doublequote)
+        # dependen de la muestra y romperían comillas escapadas más adelante.
+        try:
+            separador = csv.Sniffer().sniff(muestra, delimiters=",;\t").delimiter
+        except csv.Error:
+            separador = ","
+        lineas = _reinyectar(muestra, texto)
+        # strict: una comilla sin cerrar es un error, no "el resto del archivo en un campo"
+        for crudo in csv.DictReader(lineas, dialect=csv.excel, delimiter=separador, strict=True):
+            yield _normalizar(crudo)
+    finally:
+        texto.detach()
+
+
+def _reinyectar(muestra: str, resto: io.TextIOBase) -> Iterator[str]:
+    """Vuelve a entregar la muestra leída para detectar el separador, y luego el resto línea por línea."""
+    yield from io.StringIO(muestra + resto.readline())
+    yield from resto
+
+
+def leer_geojson(archivo: BinaryIO) -> Iterator[Dict[str, Any]]:
+    """
+    Features de un FeatureCollection sin cargar el documento completo: se recorre
+    el texto contando anidamiento ({} y [], fuera de strings) y se extrae cada
+    objeto del arreglo "features" del PRIMER nivel (un "features" dentro de otra
+    propiedad, ej. metadata, no cuenta).
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    nivel = 0               # 1 = dentro del objeto raíz, 2 = dentro de su arreglo "features"
+    en_string = escape = False
+    inicio_string = None    # comilla de apertura del string en curso
+    clave = None            # último string cerrado en el primer nivel (candidato a clave)
+    en_features = encontrado = False
+    inicio = None           # primer carácter del feature en curso
+
+    i = 0                   # siguiente carácter por examinar dentro de buffer
+    while True:
+        bloque = archivo.read(LECTURA_BYTES)
+        buffer += decoder.decode(bloque, final=not bloque)
+        while i < len(buffer):
+            c = buffer[i]
+            if en_string:
+                if escape:
+                    escape = False
+                elif c == "\\":
+                    escape = True
+                elif c == '"':
+                    en_string = False
+                    if nivel == 1:
+                        clave = buffer[inicio_string + 1:i]
+            elif c == '"':
+                en_string, inicio_string = True, i
+            elif c in "{[":
+                if c == "[" and nivel == 1 and clave == "features":
+                    en_features = encontrado = True
+                elif c == "{" and en_features and nivel == 2:
+                    inicio = i
+                nivel += 1
+            elif c in "}]":
+                nivel -= 1
+                if c == "}" and en_features and nivel == 2 and inicio is not None:
+                    yield _feature_a_fila(json.loads(buffer[inicio:i + 1]))
+                    inicio = None
+                elif c == "]" and en_features and nivel == 1:
+                    return
+            elif c == "," and nivel == 1:
+                clave = None
+            i += 1
+        # Solo se conserva el feature (o la clave del primer nivel) a medio leer
+        if inicio is not None:
+            corte = inicio
+        elif en_string and nivel == 1:
+            corte = inicio_string
+        else:
+            corte = i
+        buffer, i = buffer[corte:], i - corte
+        if inicio is not None:
+            inicio -= corte
+        if inicio_string is not None:
+            inicio_string -= corte
+        if not bloque:
+            if not encontrado:
+                raise ArchivoInvalido('El GeoJSON no tiene un arreglo "features" en el primer nivel')
+            return
+
+
+def _feature_a_fila(feature: Dict[str, Any]) -> Dict[str, Any]:
+    fila = _normalizar(feature.get("properties") or {})
+    geom = feature.get("geometry") or {}
+    if geom.get("type") == "Point" and len(geom.get("coordinates") or []) >= 2:
+        fila["longitud"], fila["latitud"] = geom["coordinates"][0], geom["coordinates"][1]
+    if feature.get("id") is not None and "codigo_externo" not in fila:
+        fila["codigo_externo"] = feature["id"]
+    return fila
+
+
+LECTORES = {"csv": leer_csv, "geojson": leer_geojson}
+
+
+# ---------- upsert por lotes ----------
+
+def _upsert_lote(conn, lote: List[Dict[str, Any]]) -> Tuple[int, int, int]:
+    """INSERT multi-fila con ON DUPLICATE KEY UPDATE. Devuelve (insertados, actualizados, sin_cambios)."""
+    fuente = lote[0]["fuente"]
+    claves = [f["codigo_externo"] for f in lote]
+    conn.begin()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT COUNT(*) AS n FROM infraestructura_hidrica "
+                f"WHERE fuente = %s AND codigo_externo IN ({', '.join(['%s'] * len(claves))});",
+                [fuente, *claves],
+            )
+            existentes = cursor.fetchone()["n"]
+            cursor.execute(f"""
+                INSERT INTO infraestructura_hidrica
+                    (codigo_externo, fuente, nombre, tipo, latitud, longitud, estado)
+                VALUES {", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(lote))}
+                ON DUPLICATE KEY UPDATE
+                    nombre   = VALUES(nombre),
+                    tipo     = VALUES(tipo),
+                    latitud  = VALUES(latitud),
+                    longitud = VALUES(longitud),
+                    estado   = VALUES(estado);
+            """, [v for f in lote for v in (
+                f["codigo_externo"], f["fuente"], f["nombre"], f["tipo"], f["latitud"], f["longitud"], f["estado"],
+            )])
+            afectadas = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    # MySQL cuenta 1 por fila insertada, 2 por actualizada y 0 si no cambió nada
+    insertados = len(lote) - existentes
+    actualizados = max(0, (afectadas - insertados) // 2)
+    return insertados, actualizados, existentes - actualizados
+
+
+def _filas(lector: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Convierte los errores de lectura (comillas sin cerrar, bytes NUL, JSON roto) en ArchivoInvalido."""
+    n = 0
+    while True:
+        try:
+            fila = next(lector)
+        except StopIteration:
+            return
+        except (csv.Error, json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise ArchivoInvalido(f"Fila {n + 1}: {e}") from e
+        n += 1
+        yield fila
+
+
+def importar(conn, archivo: BinaryIO, formato: str, fuente: str, modelo: Type[BaseModel],
+             lote: int = IMPORTACION_LOTE,
+             progreso: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Importa el archivo completo. `modelo` valida cada fila (InfraestructuraCreate).
+    Cada lote es su propia transacción; un lote fallido detiene la importación y
+    lo ya confirmado queda (reimportar es seguro: es un upsert). Un archivo roto
+    levanta ArchivoInvalido con el número de fila.
+    """
+    t0 = time.perf_counter()
+    resumen: Dict[str, Any] = {
+        "formato": formato, "fuente": fuente, "leidos": 0, "insertados": 0,
+        "actualizados": 0, "sin_cambios": 0, "invalidos": 0, "duplicados": 0, "errores": [],
+    }
+    pendientes: Dict[str, Dict[str, Any]] = {}
+
+    def _vaciar():
+        if not pendientes:
+            return
+        ins, act, igual = _upsert_lote(conn, list(pendientes.values()))
+        resumen["insertados"] += ins
+        resumen["actualizados"] += act
+        resumen["sin_cambios"] += igual
+        pendientes.clear()
+        if progreso:
+            progreso(resumen)
+
+    for n, fila in enumerate(_filas(LECTORES[formato](archivo)), start=1):
+        resumen["leidos"] = n
+        try:
+            valido = modelo.model_validate({**fila, "fuente": fuente})
+            clave = clave_natural({**fila, "latitud": valido.latitud, "longitud": valido.longitud})
+        except (ValidationError, ValueError, KeyError, TypeError) as e:
+            resumen["invalidos"] += 1
+            if len(resumen["errores"]) < IMPORTACION_ERRORES_MAX:
+                detalle = (
+                    "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+                    if isinstance(e, ValidationError) else f"falta o es inválido: {e}"
+                )
+                resumen["errores"].append({"fila": n, "error": detalle})
+            continue
+        if clave in pendientes:
+            resumen["duplicados"] += 1   # la última aparición en el lote gana
+        pendientes[clave] = {**valido.model_dump(), "codigo_externo": clave}
+        if len(pendientes) >= lote:
+            _vaciar()
+    _vaciar()
+
+    resumen["segundos"] = round(time.perf_counter() - t0, 2)
+    return resumen
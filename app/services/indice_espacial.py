@@ -0,0 +1,137 @@
+import heapq
+import math
+import os
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.core.geo import METROS_POR_GRADO_LAT, haversine_m
+from app.services.puntos import CapaPuntos, capa_infraestructura
+
+# =========================
+# ÍNDICE ESPACIAL EN GRILLA (K VECINOS MÁS CERCANOS)
+# =========================
+# Grilla regular en grados: cada celda guarda los ids de los puntos que caen en ella.
+# La búsqueda recorre anillos de celdas alrededor del punto consultado y se
+# detiene cuando ningún anillo siguiente puede tener algo más cerca que el
+# k-ésimo encontrado. Se mantiene sincronizada con la capa de puntos vía listener.
+INDICE_CELDA_GRADOS = float(os.getenv("INDICE_CELDA_GRADOS", "0.05"))  # ~5.5 km
+
+
+class IndiceGrilla:
+    def __init__(self, capa: CapaPuntos, celda: float = INDICE_CELDA_GRADOS):
+        self.capa = capa
+        self.celda = celda
+        self._celdas: Dict[Tuple[int, int], Set[int]] = {}
+        self._puntos: Dict[int, Tuple[float, float, Any]] = {}  # id -> (lat, lon, tipo)
+        self._limites: Optional[Tuple[int, int, int, int]] = None  # celdas extremas ocupadas
+        self._lock = threading.RLock()
+        capa.suscribir(self._on_cambio)
+
+    def _celda_de(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lon / self.celda)), int(math.floor(lat / self.celda))
+
+    # ---------- mantenimiento ----------
+
+    def _agregar(self, registro: Dict[str, Any]) -> None:
+        id_ = registro[self.capa.id_col]
+        lat, lon = float(registro["latitud"]), float(registro["longitud"])
+        self._puntos[id_] = (lat, lon, registro.get("tipo"))
+        cx, cy = self._celda_de(lat, lon)
+        self._celdas.setdefault((cx, cy), set()).add(id_)
+        if self._limites is not None:
+            x0, y0, x1, y1 = self._limites
+            self._limites = (min(x0, cx), min(y0, cy), max(x1, cx), max(y1, cy))
+
+    def _quitar(self, id_: int) -> None:
+        punto = self._puntos.pop(id_, None)
+        if punto is None:
+            return
+        key = self._celda_de(punto[0], punto[1])
+        ids = self._celdas.get(key)
+        if ids is not None:
+            ids.discard(id_)
+            if not ids:
+                del self._celdas[key]
+                self._limites = None
+
+    def reconstruir(self) -> None:
+        with self._lock:
+            self._celdas.clear()
+            self._puntos.clear()
+            self._limites = None
+            for registro in self.capa.registros():
+                self._agregar(registro)
+
+    def _on_cambio(self, anterior: Optional[Dict[str, Any]], nuevo: Optional[Dict[str, Any]]) -> None:
+        if anterior is None and nuevo is None:
+            self.reconstruir()
+            return
+        with self._lock:
+            if anterior is not None:
+                self._quitar(anterior[self.capa.id_col])
+            if nuevo is not None:
+                self._agregar(nuevo)
+
+    # ---------- consulta ----------
+
+    def cercanos(self, lat: float, lon: float, k: int, tipo: Optional[str] = None,
+                 radio_max_m: Optional[float] = None) -> List[Tuple[float, int]]:
+        """Hasta k pares (distancia_m, id) ordenados por distancia."""
+        with self._lock:
+            if not self._celdas:
+                return []
+            if self._limites is None:
+                xs = [c[0] for c in self._celdas]
+                ys = [c[1] for c in self._celdas]
+                self._limites = (min(xs), min(ys), max(xs), max(ys))
+            x0, y0, x1, y1 = self._limites
+            cx, cy = self._celda_de(lat, lon)
+            anillo_max = max(abs(cx - x0), abs(cx - x1), abs(cy - y0), abs(cy - y1))
+
+            tipo_norm = tipo.upper() if tipo else None
+
+            heap: List[Tuple[float, int]] = []  # max-heap con distancias negadas
+            for r in range(anillo_max + 1):
+                # Todo punto del anillo r (o más allá) está al menos a (r - 1) lados de celda
+                cota = max(r - 1, 0) * self._lado_min_m(lat, r)
+                if len(heap) == k and -heap[0][0] <= cota:
+                    break
+                if radio_max_m is not None and cota > radio_max_m:
+                    break
+                for key in self._anillo(cx, cy, r):
+                    for id_ in self._celdas.get(key, ()):
+                        p_lat, p_lon, p_tipo = self._puntos[id_]
+                        if tipo_norm and (p_tipo or "").upper() != tipo_norm:
+                            continue
+                        d = haversine_m(lat, lon, p_lat, p_lon)
+                        if radio_max_m is not None and d > radio_max_m:
+                            continue
+                        if len(heap) < k:
+                            heapq.heappush(heap, (-d, id_))
+                        elif d < -heap[0][0]:
+                            heapq.heapreplace(heap, (-d, id_))
+            return sorted((-d, id_) for d, id_ in heap)
+
+    def _lado_min_m(self, lat: float, r: int) -> float:
+        """Lado más corto (m) de las celdas hasta el anillo r: la longitud se encoge con la latitud."""
+        lat_extrema = min(abs(lat) + (r + 1) * self.celda, 90.0)
+        return self.celda * METROS_POR_GRADO_LAT * max(math.cos(math.radians(lat_extrema)), 1e-6)
+
+    @staticmethod
+    def _anillo(cx: int, cy: int, r: int):
+        if r == 0:
+            yield cx, cy
+            return
+        for dx in range(-r, r + 1):
+            yield cx + dx, cy - r
+            yield cx + dx, cy + r
+        for dy in range(-r + 1, r):
+            yield cx - r, cy + dy
+            yield cx + r, cy + dy
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"puntos": len(self._puntos), "celdas": len(self._celdas), "celda_grados": self.celda}
+
+
+indice_infraestructura = IndiceGrilla(capa_infraestructura)
@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger("geovisor")
+
+# =========================
+# MUNICIPIOS / ÁREAS DE SERVICIO (PUNTO EN POLÍGONO)
+# =========================
+# Polígonos de los municipios de Cundinamarca leídos de un GeoJSON local
+# (p. ej. el MGN del DANE filtrado al departamento). Cada polígono se guarda
+# "preparado": anillos como arreglos NumPy de aristas y su bbox, de modo que
+# ubicar un punto es un prefiltro por bbox sobre todos los municipios a la vez
+# y un ray casting vectorizado sobre las aristas de los pocos candidatos.
+MUNICIPIOS_GEOJSON = os.getenv("MUNICIPIOS_GEOJSON", "data/municipios_cundinamarca.geojson")
+
+# Nombres de propiedades aceptados (formato propio o MGN del DANE)
+PROPS_CODIGO = ("codigo", "codigo_municipio", "MPIO_CDPMP", "MPIO_CCNCT")
+PROPS_NOMBRE = ("nombre", "municipio", "MPIO_CNMBR")
+PROPS_ENTIDAD = ("id_entidad",)
+
+# Puntos por bloque al ubicar lotes (acota la matriz puntos x aristas)
+LOTE_ARISTAS_MAX = int(os.getenv("MUNICIPIOS_LOTE_ARISTAS_MAX", "2000000"))
+
+
+def _prop(props: Dict[str, Any], nombres) -> Any:
+    for nombre in nombres:
+        if props.get(nombre) not in (None, ""):
+            return props[nombre]
+    return None
+
+
+def _aristas(anillo) -> np.ndarray:
+    """Anillo [[lon, lat], ...] -> matriz (n, 4) de aristas x0, y0, x1, y1."""
+    pts = np.asarray(anillo, dtype=np.float64)[:, :2]
+    if len(pts) and not np.array_equal(pts[0], pts[-1]):
+        pts = np.vstack([pts, pts[:1]])
+    return np.hstack([pts[:-1], pts[1:]])
+
+
+def _cruces(aristas: np.ndarray, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """Paridad de cruces del rayo horizontal hacia el este, para cada punto (vectorizado)."""
+    x0, y0, x1, y1 = (aristas[:, i][None, :] for i in range(4))
+    px, py = lon[:, None], lat[:, None]
+    cruza = (y0 > py) != (y1 > py)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_corte = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+    return (np.count_nonzero(cruza & (px < x_corte), axis=1) % 2) == 1
+
+
+class Municipio:
+    def __init__(self, codigo: str, nombre: str, id_entidad: Optional[int], poligonos: List[List[np.ndarray]]):
+        self.codigo = codigo
+        self.nombre = nombre
+        self.id_entidad = id_entidad
+        # Un solo arreglo de aristas por municipio: con la regla par-impar los
+        # huecos y las partes de un MultiPolygon se resuelven solos.
+        self.aristas = np.vstack([a for poligono in poligonos for a in poligono])
+        xs, ys = self.aristas[:, [0, 2]], self.aristas[:, [1, 3]]
+        self.bbox = (float(xs.min()), float(ys.min()), float(xs.max()), float(ys.max()))
+
+    def contiene(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        resultado = np.zeros(len(lon), dtype=bool)
+        paso = max(1, LOTE_ARISTAS_MAX // max(len(self.aristas), 1))
+        for i in range(0, len(lon), paso):
+            resultado[i:i + paso] = _cruces(self.aristas, lon[i:i + paso], lat[i:i + paso])
+        return resultado
+
+    def como_dict(self) -> Dict[str, Any]:
+        return {"codigo_municipio": self.codigo, "municipio": self.nombre, "id_entidad": self.id_entidad}
+
+
+class IndiceMunicipios:
+    def __init__(self):
+        self._municipios: List[Municipio] = []
+        self._bboxes = np.empty((0, 4), dtype=np.float64)
+        self._entidades: Dict[str, int] = {}  # codigo_municipio -> id_entidad (tabla municipio_entidad)
+        self._lock = threading.Lock()
+
+    # ---------- carga ----------
+
+    def cargar(self, ruta: str = MUNICIPIOS_GEOJSON) -> int:
+        with open(ruta, encoding="utf-8") as f:
+            coleccion = json.load(f)
+
+        municipios = []
+        for feature in coleccion.get("features", []):
+            geom = feature.get("geometry") or {}
+            props = feature.get("properties") or {}
+            if geom.get("type") == "Polygon":
+                poligonos = [geom["coordinates"]]
+            elif geom.get("type") == "MultiPolygon":
+                poligonos = geom["coordinates"]
+            else:
+                continue
+            codigo = _prop(props, PROPS_CODIGO)
+            if codigo is None:
+                continue
+            id_entidad = _prop(props, PROPS_ENTIDAD)
+            municipios.append(Municipio(
+                codigo=str(codigo),
+                nombre=str(_prop(props, PROPS_NOMBRE) or codigo),
+                id_entidad=int(id_entidad) if id_entidad is not None else None,
+                poligonos=[[_aristas(anillo) for anillo in poligono] for poligono in poligonos],
+            ))
+
+        with self._lock:
+            self._municipios = municipios
+            self._bboxes = np.array([m.bbox for m in municipios], dtype=np.float64).reshape(-1, 4)
+        return len(municipios)
+
+    def cargar_entidades(self, conn) -> None:
+        """Entidad responsable por municipio; tiene prioridad sobre la propiedad id_entidad del GeoJSON."""
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT codigo_municipio, id_entidad FROM municipio_entidad;")
+            rows = cursor.fetchall()
+        self._entidades = {str(r["codigo_municipio"]): r["id_entidad"] for r in rows}
+
+    @property
+    def cargado(self) -> bool:
+        return bool(self._municipios)
+
+    # ---------- consulta ----------
+
+    def _resultado(self, municipio: Municipio) -> Dict[str, Any]:
+        resultado = municipio.como_dict()
+        resultado["id_entidad"] = self._entidades.get(municipio.codigo, municipio.id_entidad)
+        return resultado
+
+    def localizar(self, lat: Optional[float], lon: Optional[float]) -> Optional[Dict[str, Any]]:
+        """Municipio que contiene el punto: {codigo_municipio, municipio, id_entidad} o None."""
+        if lat is None or lon is None or not self._municipios:
+            return None
+        b = self._bboxes
+        candidatos = np.nonzero((b[:, 0] <= lon) & (lon <= b[:, 2]) & (b[:, 1] <= lat) & (lat <= b[:, 3]))[0]
+        lon_a, lat_a = np.array([lon], dtype=np.float64), np.array([lat], dtype=np.float64)
+        for i in candidatos:
+            municipio = self._municipios[i]
+            if municipio.contiene(lon_a, lat_a)[0]:
+                return self._resultado(municipio)
+        return None
+
+    def localizar_lote(self, lats, lons) -> List[Optional[Dict[str, Any]]]:
+        """Igual que localizar() para muchos puntos: un ray casting vectorizado por municipio."""
+        lat = np.asarray(lats, dtype=np.float64)
+        lon = np.asarray(lons, dtype=np.float64)
+        asignado = np.full(len(lat), -1, dtype=np.int64)
+        for i, municipio in enumerate(self._municipios):
+            x0, y0, x1, y1 = municipio.bbox
+            sel = np.nonzero((asignado < 0) & (lon >= x0) & (lon <= x1) & (lat >= y0) & (lat <= y1))[0]
+            if sel.size:
+                asignado[sel[municipio.contiene(lon[sel], lat[sel])]] = i
+        return [self._resultado(self._municipios[i]) if i >= 0 else None for i in asignado.tolist()]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "municipios": len(self._municipios),
+            "aristas": int(sum(len(m.aristas) for m in self._municipios)),
+            "entidades_asignadas": len(self._entidades),
+        }
+
+
+indice_municipios = IndiceMunicipios()
+
+
+def cargar_municipios(conn=None) -> None:
+    """Carga polígonos (y, si hay conexión, la tabla municipio_entidad). Solo registra advertencias."""
+    try:
+        n = indice_municipios.cargar()
+        logger.info("Municipios cargados: %s", n)
+    except (OSError, ValueError) as e:
+        logger.warning("No se pudieron cargar los polígonos de municipios (%s): %s", MUNICIPIOS_GEOJSON, e)
+    if conn is not None:
+        try:
+            indice_municipios.cargar_entidades(conn)
+        except Exception as e:
+            logger.warning("No se pudo cargar municipio_entidad: %s", e)
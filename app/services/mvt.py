@@ -0,0 +1,145 @@
+import os
+import struct
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.puntos import CapaPuntos, capa_reportes, capa_infraestructura
+from app.services.teselas import TeselaCache
+
+# =========================
+# CODIFICADOR MAPBOX VECTOR TILE (SOLO PUNTOS)
+# =========================
+# Implementación mínima de la especificación MVT 2.1 para capas de puntos:
+# no hace falta una librería de protobuf para codificar Tile/Layer/Feature/Value.
+# https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+
+EXTENT = 4096
+GEOM_POINT = 1
+CMD_MOVE_TO = 1
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _len_delimited(field: int, payload: bytes) -> bytes:
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+
+def _packed(field: int, values: Iterable[int]) -> bytes:
+    return _len_delimited(field, b"".join(_varint(v) for v in values))
+
+
+def _value(v: Any) -> bytes:
+    """Mensaje Value: string, bool, entero (sint) o double."""
+    if isinstance(v, bool):
+        return _key(7, 0) + _varint(int(v))
+    if isinstance(v, int):
+        return _key(6, 0) + _varint(_zigzag(v))
+    if isinstance(v, float):
+        return _key(3, 1) + struct.pack("<d", v)
+    return _len_delimited(1, str(v).encode("utf-8"))
+
+
+def encode_layer(nombre: str, features: List[Tuple[int, int, int, Dict[str, Any]]],
+                 extent: int = EXTENT) -> bytes:
+    """
+    Codifica una capa de puntos. `features` es una lista de (id, px, py, propiedades)
+    con px/py ya cuantizados a [0, extent) en coordenadas de la tesela.
+    """
+    keys: Dict[str, int] = {}
+    values: Dict[Tuple[type, Any], int] = {}
+    cuerpo = bytearray()
+
+    for fid, px, py, props in features:
+        tags = []
+        for k, v in props.items():
+            if v is None:
+                continue
+            tags.append(keys.setdefault(k, len(keys)))
+            tags.append(values.setdefault((type(v), v), len(values)))
+        feature = (
+            _key(1, 0) + _varint(fid)
+            + (_packed(2, tags) if tags else b"")
+            + _key(3, 0) + _varint(GEOM_POINT)
+            + _packed(4, [(CMD_MOVE_TO & 0x7) | (1 << 3), _zigzag(px), _zigzag(py)])
+        )
+        cuerpo += _len_delimited(2, feature)
+
+    layer = (
+        _key(15, 0) + _varint(2)
+        + _len_delimited(1, nombre.encode("utf-8"))
+        + bytes(cuerpo)
+        + b"".join(_len_delimited(3, k.encode("utf-8")) for k in keys)
+        + b"".join(_len_delimited(4, _value(v)) for (_, v) in values)
+        + _key(5, 0) + _varint(extent)
+    )
+    return _len_delimited(3, layer)
+
+
+# =========================
+# TESELAS VECTORIALES DE LAS CAPAS
+# =========================
+BUFFER = 64  # margen (en unidades de EXTENT) para que los íconos del borde no se corten
+
+PROPIEDADES = {
+    "reportes": ["id_tipo_incidente", "id_severidad", "id_estado"],
+    "infraestructura": ["nombre", "tipo", "estado"],
+}
+
+cache_mvt = TeselaCache(maxsize=int(os.getenv("MVT_CACHE_MAX", "4096")), margen=BUFFER / EXTENT)
+capa_reportes.suscribir(cache_mvt.listener(capa_reportes.nombre))
+capa_infraestructura.suscribir(cache_mvt.listener(capa_infraestructura.nombre))
+
+
+def _construir_tesela(capa: CapaPuntos, z: int, x: int, y: int,
+                      alcance: Optional[Tuple[str, int]]) -> bytes:
+    a = capa.arrays()
+    n = 1 << z
+    px = np.round((a["mx"] * n - x) * EXTENT).astype(np.int64)
+    py = np.round((a["my"] * n - y) * EXTENT).astype(np.int64)
+    sel = (px >= -BUFFER) & (px < EXTENT + BUFFER) & (py >= -BUFFER) & (py < EXTENT + BUFFER)
+    if alcance is not None:
+        columna, valor = alcance
+        sel &= a[columna] == valor
+    idx = np.nonzero(sel)[0]
+    if idx.size == 0:
+        return b""
+
+    ids = a[capa.id_col][idx].tolist()
+    px_sel, py_sel = px[idx].tolist(), py[idx].tolist()
+    props = {col: a[col][idx].tolist() for col in PROPIEDADES[capa.nombre]}
+    features = [
+        (ids[i], px_sel[i], py_sel[i],
+         {col: (None if v in (-1, "") else v) for col, v in ((c, props[c][i]) for c in props)})
+        for i in range(len(ids))
+    ]
+    return encode_layer(capa.nombre, features)
+
+
+def tesela_mvt(capa: CapaPuntos, z: int, x: int, y: int,
+               alcance: Optional[Tuple[str, int]] = None) -> bytes:
+    version = cache_mvt.version(capa.nombre)
+    cached = cache_mvt.get(capa.nombre, z, x, y, alcance)
+    if cached is not None:
+        return cached
+    tile = _construir_tesela(capa, z, x, y, alcance)
+    cache_mvt.set(capa.nombre, z, x, y, alcance, tile, version)
+    return tile
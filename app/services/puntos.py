@@ -0,0 +1,243 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+
+# =========================
+# CAPAS DE PUNTOS EN MEMORIA
+# =========================
+# Copia en memoria (columnar, NumPy) de los puntos que pinta el geovisor.
+# Se carga una vez desde MySQL con la conexión del request que la necesite,
+# los endpoints de escritura la actualizan de forma incremental y, como cada
+# worker de uvicorn tiene su propia copia, se recarga completa cada
+# PUNTOS_RECARGA_SEG para recoger cambios hechos por otros procesos.
+# Una sola recarga a la vez por capa: mientras corre, los demás requests siguen
+# con la copia anterior (o esperan, si la capa nunca se cargó). Los listeners se
+# notifican dentro del lock de la capa, en el mismo orden en que se aplicaron
+# los cambios, así un delta nunca llega antes que la recarga que lo precede.
+PUNTOS_RECARGA_SEG = float(os.getenv("PUNTOS_RECARGA_SEG", "300"))
+
+Listener = Callable[[Optional[Dict[str, Any]], Optional[Dict[str, Any]]], None]
+
+
+class CapaPuntos:
+    """
+    Puntos de una tabla con latitud/longitud.
+    - `registros`: id -> dict con las columnas cargadas.
+    - `arrays()`: vista columnar (np.ndarray por columna), reconstruida solo si hubo cambios.
+    - Los listeners reciben (anterior, nuevo) en cada cambio; (None, None) significa
+      "se recargó toda la capa". Se llaman con el lock de la capa tomado (es
+      reentrante: pueden leer `registros()`/`arrays()`), así que deben ser rápidos
+      y no esperar a otro hilo que use la capa.
+    """
+
+    def __init__(self, nombre: str, id_col: str, sql: str, columnas: List[str]):
+        self.nombre = nombre
+        self.id_col = id_col
+        self.sql = sql
+        self.columnas = columnas
+        self._registros: Dict[int, Dict[str, Any]] = {}
+        self._arrays: Optional[Dict[str, np.ndarray]] = None
+        self._cargada_en: Optional[float] = None
+        self._version = 0
+        self._lock = threading.RLock()
+        self._cargada = threading.Condition(self._lock)
+        self._recargando = False
+        self._listeners: List[Listener] = []
+
+    # ---------- carga ----------
+
+    def cargar(self, conn) -> None:
+        with self._lock:
+            if self._recargando:
+                return
+            self._recargando = True
+        self._recargar(conn)
+
+    def _recargar(self, conn) -> None:
+        """Quien llama ya marcó _recargando. La consulta corre fuera del lock."""
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(self.sql)
+                rows = cursor.fetchall()
+            registros = {
+                row[self.id_col]: row for row in rows
+                if row.get("latitud") is not None and row.get("longitud") is not None
+            }
+            with self._lock:
+                self._registros = registros
+                self._arrays = None
+                self._cargada_en = time.monotonic()
+                self._version += 1
+                self._notificar(None, None)
+        finally:
+            with self._lock:
+                self._recargando = False
+                self._cargada.notify_all()
+
+    def asegurar_cargada(self, conn) -> None:
+        """
+        Recarga si la copia venció. Si otro request ya está recargando, no se
+        repite la consulta: se sigue con la copia actual o, si la capa todavía no
+        existe, se espera a que termine esa carga.
+        """
+        with self._lock:
+            cargada_en = self._cargada_en
+            if cargada_en is not None and time.monotonic() - cargada_en <= PUNTOS_RECARGA_SEG:
+                return
+            if self._recargando:
+                if cargada_en is None:
+                    self._cargada.wait_for(lambda: not self._recargando)
+                    if self._cargada_en is None:   # la carga del otro request falló
+                        raise HTTPException(status_code=503, detail=f"Capa {self.nombre} no disponible")
+                return
+            self._recargando = True
+        self._recargar(conn)
+
+    @property
+    def cargada(self) -> bool:
+        return self._cargada_en is not None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    # ---------- cambios incrementales ----------
+
+    def upsert(self, registro: Dict[str, Any]) -> None:
+        """Inserta o reemplaza un punto (registro completo). No hace nada si la capa no está cargada."""
+        if not self.cargada:
+            return
+        id_ = registro[self.id_col]
+        nuevo = {c: registro.get(c) for c in self.columnas}
+        if nuevo.get("latitud") is None or nuevo.get("longitud") is None:
+            nuevo = None
+        with self._lock:
+            anterior = self._registros.pop(id_, None)
+            if nuevo is not None:
+                self._registros[id_] = nuevo
+            self._arrays = None
+            self._version += 1
+            self._notificar(anterior, nuevo)
+
+    def actualizar(self, id_: int, **campos: Any) -> None:
+        """Cambia algunas columnas de un punto existente."""
+        with self._lock:
+            anterior = self._registros.get(id_)
+            if anterior is None:
+                return
+            nuevo = {**anterior, **{k: v for k, v in campos.items() if k in self.columnas}}
+        self.upsert(nuevo)
+
+    def eliminar(self, id_: int) -> None:
+        with self._lock:
+            anterior = self._registros.pop(id_, None)
+            if anterior is None:
+                return
+            self._arrays = None
+            self._version += 1
+            self._notificar(anterior, None)
+
+    def obtener(self, id_: int) -> Optional[Dict[str, Any]]:
+        return self._registros.get(id_)
+
+    def registros(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._registros.values())
+
+    # ---------- lectura ----------
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        with self._lock:
+            if self._arrays is None:
+                rows = list(self._registros.values())
+                arrays = {}
+                for col in self.columnas:
+                    valores = [r.get(col) for r in rows]
+                    if col in ("latitud", "longitud"):
+                        arrays[col] = np.asarray(valores, dtype=np.float64)
+                    elif col.endswith("_at"):
+                        arrays[col] = np.asarray(
+                            [np.datetime64(v, "s") if v is not None else np.datetime64("NaT") for v in valores],
+                            dtype="datetime64[s]",
+                        )
+                    elif col == self.id_col or col.startswith("id_"):
+                        arrays[col] = np.asarray([-1 if v is None else v for v in valores], dtype=np.int64)
+                    else:
+                        arrays[col] = np.asarray(["" if v is None else str(v) for v in valores], dtype=object)
+                arrays["mx"], arrays["my"] = mercator(arrays["latitud"], arrays["longitud"])
+                self._arrays = arrays
+            return self._arrays
+
+    def __len__(self) -> int:
+        return len(self._registros)
+
+    # ---------- listeners ----------
+
+    def suscribir(self, listener: Listener) -> None:
+        self._listeners.append(listener)
+
+    def _notificar(self, anterior, nuevo) -> None:
+        """Siempre con self._lock tomado: los eventos llegan en el orden de los cambios."""
+        for listener in self._listeners:
+            listener(anterior, nuevo)
+
+
+def mercator(lat, lon):
+    """Coordenadas Web Mercator normalizadas a [0, 1) (x hacia el este, y hacia el sur)."""
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -85.05112878, 85.05112878)
+    lon = np.asarray(lon, dtype=np.float64)
+    x = (lon + 180.0) / 360.0
+    lat_rad = np.radians(lat)
+    y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / np.pi) / 2.0
+    eps = 1e-12
+    return np.clip(x, 0.0, 1.0 - eps), np.clip(y, 0.0, 1.0 - eps)
+
+
+# =========================
+# CAPAS DEL GEOVISOR
+# =========================
+capa_reportes = CapaPuntos(
+    nombre="reportes",
+    id_col="id_reporte",
+    sql="""
+        SELECT id_reporte, latitud, longitud, id_tipo_incidente, id_severidad,
+               id_estado, id_usuario, id_entidad, created_at
+        FROM reportes
+        WHERE latitud IS NOT NULL AND longitud IS NOT NULL;
+    """,
+    columnas=["id_reporte", "latitud", "longitud", "id_tipo_incidente", "id_severidad",
+              "id_estado", "id_usuario", "id_entidad", "created_at"],
+)
+
+capa_infraestructura = CapaPuntos(
+    nombre="infraestructura",
+    id_col="id_infraestructura",
+    sql="""
+        SELECT id_infraestructura, nombre, tipo, estado, latitud, longitud
+        FROM infraestructura_hidrica;
+    """,
+    columnas=["id_infraestructura", "nombre", "tipo", "estado", "latitud", "longitud"],
+)
+
+CAPAS = {
+    capa_reportes.nombre: capa_reportes,
+    capa_infraestructura.nombre: capa_infraestructura,
+}
+
+
+def alcance_reportes(user: Dict[str, Any]) -> Optional[Tuple[str, int]]:
+    """
+    Qué reportes puede ver el usuario en el mapa, como (columna, valor) o None = todos.
+    Mismo criterio que GET /reportes.
+    """
+    if user["id_rol"] == 1:  # CIUDADANO
+        return ("id_usuario", user["id_usuario"])
+    if user["id_rol"] == 2:  # ENTIDAD
+        if not user.get("id_entidad"):
+            raise HTTPException(status_code=403, detail="Usuario ENTIDAD sin id_entidad asignado")
+        return ("id_entidad", user["id_entidad"])
+    return None  # MODERADOR (3) y ADMIN (4)
@@ -0,0 +1,170 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterator, Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+# =========================
+# TESELAS (ESQUEMA XYZ / WEB MERCATOR)
+# =========================
+ZOOM_MAX = int(os.getenv("TESELAS_ZOOM_MAX", "20"))
+TESELAS_POR_CONSULTA_MAX = int(os.getenv("TESELAS_POR_CONSULTA_MAX", "64"))
+
+
+def _coordenadas_tesela(lat: float, lon: float, z: int) -> Tuple[float, float]:
+    """Posición fraccionaria del punto en la grilla de teselas de zoom z."""
+    lat = max(min(float(lat), 85.05112878), -85.05112878)
+    n = 1 << z
+    lat_rad = math.radians(lat)
+    fx = (float(lon) + 180.0) / 360.0 * n
+    fy = (1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n
+    return fx, fy
+
+
+def tesela_de_punto(lat: float, lon: float, z: int) -> Tuple[int, int]:
+    """Tesela (x, y) de zoom z que contiene el punto."""
+    fx, fy = _coordenadas_tesela(lat, lon, z)
+    n = 1 << z
+    return min(max(int(fx), 0), n - 1), min(max(int(fy), 0), n - 1)
+
+
+def teselas_con_margen(lat: float, lon: float, z: int, margen: float) -> Set[Tuple[int, int]]:
+    """Teselas que contienen el punto o lo incluyen en su margen (fracción del lado)."""
+    fx, fy = _coordenadas_tesela(lat, lon, z)
+    n = 1 << z
+    xs = {min(max(int(fx + d), 0), n - 1) for d in (-margen, 0.0, margen)}
+    ys = {min(max(int(fy + d), 0), n - 1) for d in (-margen, 0.0, margen)}
+    return {(x, y) for x in xs for y in ys}
+
+
+def validar_tesela(z: int, x: int, y: int) -> None:
+    if not (0 <= z <= ZOOM_MAX):
+        raise HTTPException(status_code=400, detail=f"z debe estar entre 0 y {ZOOM_MAX}")
+    n = 1 << z
+    if not (0 <= x < n and 0 <= y < n):
+        raise HTTPException(status_code=400, detail="Tesela fuera de rango para ese zoom")
+
+
+def teselas_de_bbox(bbox: Tuple[float, float, float, float], z: int) -> Iterator[Tuple[int, int]]:
+    """Teselas de zoom z que cubren el bbox (acotado a TESELAS_POR_CONSULTA_MAX)."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    x0, y0 = tesela_de_punto(max_lat, min_lon, z)   # esquina noroeste
+    x1, y1 = tesela_de_punto(min_lat, max_lon, z)   # esquina sureste
+    total = (x1 - x0 + 1) * (y1 - y0 + 1)
+    if total > TESELAS_POR_CONSULTA_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"La vista cubre {total} teselas a zoom {z}; baja el zoom (máx {TESELAS_POR_CONSULTA_MAX})",
+        )
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            yield x, y
+
+
+# =========================
+# CACHÉ POR TESELA
+# =========================
+
+class TeselaCache:
+    """
+    Caché LRU de resultados por tesela: clave (capa, z, x, y, variante).
+    `variante` distingue lo que cambia para la misma tesela (alcance por rol, formato...).
+    Se invalida de forma dirigida: cuando un punto cambia solo se descartan
+    las teselas que lo contienen, en todos los zooms. Si las teselas incluyen
+    puntos vecinos (`margen`, fracción del lado), también se descartan las
+    teselas en cuyo margen cae el punto.
+    Una tesela calculada antes de una invalidación no debe guardarse después de
+    ella: quien calcula lee `version(capa)` antes y la pasa a `set`, que descarta
+    el valor si la capa se invalidó mientras tanto.
+    """
+
+    def __init__(self, maxsize: int = 4096, margen: float = 0.0):
+        self.maxsize = maxsize
+        self.margen = margen
+        self._data: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._por_tesela: Dict[tuple, Set[tuple]] = {}
+        self._versiones: Dict[str, int] = {}   # capa -> invalidaciones recibidas
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidaciones = 0
+        self.descartadas = 0
+
+    def version(self, capa: str) -> int:
+        with self._lock:
+            return self._versiones.get(capa, 0)
+
+    def get(self, capa: str, z: int, x: int, y: int, variante: Hashable = None) -> Optional[Any]:
+        key = (capa, z, x, y, variante)
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, capa: str, z: int, x: int, y: int, variante: Hashable, valor: Any,
+            version: Optional[int] = None) -> None:
+        """`version`: la de `version(capa)` leída antes de calcular el valor."""
+        key = (capa, z, x, y, variante)
+        with self._lock:
+            if version is not None and version != self._versiones.get(capa, 0):
+                self.descartadas += 1
+                return
+            self._data[key] = valor
+            self._data.move_to_end(key)
+            self._por_tesela.setdefault(key[:4], set()).add(key)
+            while len(self._data) > self.maxsize:
+                viejo, _ = self._data.popitem(last=False)
+                self._quitar_indice(viejo)
+
+    def _quitar_indice(self, key: tuple) -> None:
+        claves = self._por_tesela.get(key[:4])
+        if claves is not None:
+            claves.discard(key)
+            if not claves:
+                del self._por_tesela[key[:4]]
+
+    def invalidar_punto(self, capa: str, lat: float, lon: float) -> None:
+        with self._lock:
+            self._versiones[capa] = self._versiones.get(capa, 0) + 1
+            for z in range(ZOOM_MAX + 1):
+                for x, y in teselas_con_margen(lat, lon, z, self.margen):
+                    for key in self._por_tesela.pop((capa, z, x, y), ()):
+                        self._data.pop(key, None)
+                        self.invalidaciones += 1
+
+    def invalidar_capa(self, capa: str) -> None:
+        with self._lock:
+            self._versiones[capa] = self._versiones.get(capa, 0) + 1
+            for key in [k for k in self._data if k[0] == capa]:
+                del self._data[key]
+                self._quitar_indice(key)
+                self.invalidaciones += 1
+
+    def listener(self, capa: str):
+        """Callback para CapaPuntos.suscribir: invalida la posición vieja y la nueva."""
+        def _on_cambio(anterior: Optional[Dict[str, Any]], nuevo: Optional[Dict[str, Any]]) -> None:
+            if anterior is None and nuevo is None:
+                self.invalidar_capa(capa)
+                return
+            for registro in (anterior, nuevo):
+                if registro is not None:
+                    self.invalidar_punto(capa, registro["latitud"], registro["longitud"])
+        return _on_cambio
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entradas": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidaciones": self.invalidaciones,
+                "descartadas": self.descartadas,
+                "hit_ratio": round(self.hits / total, 4) if total else None,
+            }
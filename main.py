@@ -1,8 +1,15 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.db.database import get_connection
-from app.routers.auth import router as auth_router
+from app.db.database import get_db, get_connection, pool, pool_stats
+from app.core.deps import usuarios_cache, require_roles
+from app.core.security import revocaciones_activas
+from app.core.hashing import hash_pool
+from app.routers.auth import router as auth_router, tarea_purga_refresh_tokens
 from app.routers.catalogos import router as catalogos_router
 from app.routers.reportes import router as reportes_router
 from app.routers.historial import router as historial_router
@@ -10,11 +17,79 @@ from app.routers.notificaciones import router as notificaciones_router
 from app.routers.infraestructura import router as infraestructura_router
 from app.routers.usuarios import router as usuarios_router
 from app.routers import auditoria
+from app.routers.mapa import router as mapa_router
+from app.routers.teselas import router as teselas_router
+from app.routers.estadisticas import router as estadisticas_router
+from app.services.clusters import cache_clusters
+from app.services.mvt import cache_mvt
+from app.services.puntos import capa_infraestructura
+from app.services.indice_espacial import indice_infraestructura
+from app.services.municipios import cargar_municipios, indice_municipios
+from app.services.heatmap import mapa_calor
+from app.services.estadisticas import tarea_dia_actual
+from app.services.catalogos import almacen_catalogos
+from app.services.canal_notificaciones import canal_notificaciones
+
+logger = logging.getLogger("geovisor")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Abrir las conexiones mínimas del pool; si la BD no está lista, se abrirán bajo demanda
+    try:
+        pool.warmup()
+    except Exception as e:
+        logger.warning("No se pudo precalentar el pool de conexiones: %s", e)
+
+    # Capa de infraestructura + índice espacial listos antes de la primera consulta
+    try:
+        conn = get_connection()
+        try:
+            capa_infraestructura.cargar(conn)
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning("No se pudo cargar la infraestructura en memoria: %s", e)
+
+    # Catálogos (estado_reporte, tipo_incidente, ...) en memoria con su versión para ETag
+    try:
+        conn = get_connection()
+        try:
+            almacen_catalogos.cargar(conn)
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning("No se pudieron cargar los catálogos en memoria: %s", e)
+
+    # Polígonos de municipios (archivo local) + entidad responsable de cada uno (BD)
+    try:
+        conn = get_connection()
+    except Exception as e:
+        logger.warning("Sin BD para cargar municipio_entidad: %s", e)
+        conn = None
+    try:
+        cargar_municipios(conn)
+    finally:
+        if conn is not None:
+            conn.close()
+
+    # Rollups de /estadisticas/serie: solo el día en curso se recalcula en segundo plano
+    tarea_serie = asyncio.create_task(tarea_dia_actual(get_connection))
+    # Refresh tokens expirados / de sesiones revocadas
+    tarea_purga = asyncio.create_task(tarea_purga_refresh_tokens(get_connection))
+    yield
+    tarea_serie.cancel()
+    tarea_purga.cancel()
+    canal_notificaciones.cerrar()   # termina los streams abiertos de /notificaciones/stream
+    hash_pool.shutdown()
+    pool.close()
+
 
 app = FastAPI(
     title="Geovisor API - Agua y Saneamiento",
     description="API REST para el Geovisor interactivo de agua y saneamiento en Cundinamarca",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # ✅ CORS SIEMPRE PRIMERO, antes de todos los routers
@@ -35,6 +110,9 @@ app.include_router(notificaciones_router)
 app.include_router(infraestructura_router)
 app.include_router(usuarios_router)
 app.include_router(auditoria.router)
+app.include_router(mapa_router)
+app.include_router(teselas_router)
+app.include_router(estadisticas_router)
 
 
 @app.get("/", tags=["Health"])
@@ -48,12 +126,36 @@ def health():
 
 
 @app.get("/db-test", tags=["Health"])
-def db_test():
-    conn = get_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT 1 AS ok;")
-            result = cursor.fetchone()
-        return {"db": "connected", "result": result}
-    finally:
-        conn.close()
+def db_test(conn=Depends(get_db)):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1 AS ok;")
+        result = cursor.fetchone()
+    return {"db": "connected", "result": result}
+
+
+# Diagnóstico interno (capacidad y carga): solo ADMIN, igual que /catalogos/recargar
+ROLE_ADMIN = 4
+
+
+@app.get("/db-pool", tags=["Health"], dependencies=[Depends(require_roles(ROLE_ADMIN))])
+def db_pool():
+    return pool_stats()
+
+
+@app.get("/cache-stats", tags=["Health"], dependencies=[Depends(require_roles(ROLE_ADMIN))])
+def cache_stats():
+    return {
+        "usuarios": usuarios_cache.stats(),
+        "tokens_revocados": revocaciones_activas(),
+        "clusters": cache_clusters.stats(),
+        "teselas_mvt": cache_mvt.stats(),
+        "indice_infraestructura": indice_infraestructura.stats(),
+        "municipios": indice_municipios.stats(),
+        "heatmap": mapa_calor.stats(),
+        "stream_notificaciones": canal_notificaciones.stats(),
+    }
+
+
+@app.get("/hash-stats", tags=["Health"], dependencies=[Depends(require_roles(ROLE_ADMIN))])
+def hash_stats():
+    return hash_pool.stats()
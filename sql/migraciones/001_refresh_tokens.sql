@@ -0,0 +1,18 @@
+-- Refresh tokens de larga duración (rotativos) para /auth/refresh.
+-- Solo se guarda el SHA-256 del token, nunca el token en claro.
+-- `familia` agrupa todas las rotaciones de una misma sesión: si se reutiliza
+-- un token ya rotado, se revoca la familia completa.
+CREATE TABLE IF NOT EXISTS refresh_tokens (
+    id_refresh        BIGINT AUTO_INCREMENT PRIMARY KEY,
+    id_usuario        INT          NOT NULL,
+    token_hash        CHAR(64)     NOT NULL,
+    familia           CHAR(32)     NOT NULL,
+    fecha_expiracion  DATETIME     NOT NULL,
+    revocado          TINYINT(1)   NOT NULL DEFAULT 0,
+    created_at        DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_refresh_token_hash (token_hash),
+    KEY idx_refresh_usuario (id_usuario, revocado),
+    KEY idx_refresh_familia (familia),
+    CONSTRAINT fk_refresh_usuario FOREIGN KEY (id_usuario)
+        REFERENCES usuarios (id_usuario) ON DELETE CASCADE
+);
@@ -0,0 +1,6 @@
+-- Índices para la paginación keyset de GET /reportes:
+-- ORDER BY created_at DESC, id_reporte DESC con los filtros por rol más comunes.
+CREATE INDEX idx_reportes_created      ON reportes (created_at, id_reporte);
+CREATE INDEX idx_reportes_usuario_fecha ON reportes (id_usuario, created_at, id_reporte);
+CREATE INDEX idx_reportes_entidad_fecha ON reportes (id_entidad, created_at, id_reporte);
+CREATE INDEX idx_reportes_estado_fecha  ON reportes (id_estado, created_at, id_reporte);
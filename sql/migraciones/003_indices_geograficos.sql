@@ -0,0 +1,4 @@
+-- Índices para los filtros por vista del mapa (bbox) y por radio:
+-- el prefiltro por rango de latitud/longitud se resuelve con estos índices.
+CREATE INDEX idx_reportes_lat_lon        ON reportes (latitud, longitud);
+CREATE INDEX idx_infraestructura_lat_lon ON infraestructura_hidrica (latitud, longitud);
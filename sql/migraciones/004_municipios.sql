@@ -0,0 +1,15 @@
+-- Municipio de cada reporte (asignado por punto en polígono al crearlo;
+-- los reportes anteriores se completan con: python tools_municipios.py backfill)
+ALTER TABLE reportes
+    ADD COLUMN codigo_municipio VARCHAR(10)  NULL AFTER longitud,
+    ADD COLUMN municipio        VARCHAR(120) NULL AFTER codigo_municipio;
+
+CREATE INDEX idx_reportes_municipio ON reportes (codigo_municipio);
+
+-- Entidad responsable de cada municipio / área de servicio.
+-- Los reportes ciudadanos se enrutan a esta entidad.
+CREATE TABLE IF NOT EXISTS municipio_entidad (
+    codigo_municipio VARCHAR(10) NOT NULL PRIMARY KEY,
+    id_entidad       INT         NOT NULL,
+    KEY idx_municipio_entidad_entidad (id_entidad)
+);
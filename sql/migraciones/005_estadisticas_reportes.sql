@@ -0,0 +1,14 @@
+-- Resumen de reportes para GET /estadisticas: un contador por combinación de
+-- día de creación, estado, tipo, severidad y entidad (0 = sin entidad).
+-- crear_reporte y cambiar_estado lo actualizan en la misma transacción;
+-- si se desajusta: python tools_estadisticas.py reconstruir
+CREATE TABLE IF NOT EXISTS estadisticas_reportes (
+    dia                DATE NOT NULL,
+    id_estado          INT  NOT NULL,
+    id_tipo_incidente  INT  NOT NULL,
+    id_severidad       INT  NOT NULL,
+    id_entidad         INT  NOT NULL DEFAULT 0,
+    total              INT  NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, id_estado, id_tipo_incidente, id_severidad, id_entidad),
+    KEY idx_estadisticas_entidad (id_entidad, dia)
+);
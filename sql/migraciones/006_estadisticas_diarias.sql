@@ -0,0 +1,17 @@
+-- Rollups diarios para GET /estadisticas/serie: reportes creados (reportes.created_at)
+-- y resueltos (historial_reportes.fecha_cambio hacia un estado de ESTADOS_RESUELTOS)
+-- por día, tipo de incidente y entidad (0 = sin entidad).
+-- Días cerrados: python tools_estadisticas.py serie --desde AAAA-MM-DD
+-- El día en curso lo recalcula la tarea de fondo de la API.
+CREATE TABLE IF NOT EXISTS estadisticas_diarias (
+    dia                DATE NOT NULL,
+    id_tipo_incidente  INT  NOT NULL,
+    id_entidad         INT  NOT NULL DEFAULT 0,
+    creados            INT  NOT NULL DEFAULT 0,
+    resueltos          INT  NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, id_tipo_incidente, id_entidad),
+    KEY idx_estadisticas_diarias_entidad (id_entidad, dia)
+);
+
+-- Para recalcular un rango de días sin recorrer todo el historial
+CREATE INDEX idx_historial_fecha_cambio ON historial_reportes (fecha_cambio);
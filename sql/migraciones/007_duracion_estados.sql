@@ -0,0 +1,27 @@
+-- Tiempo que pasa cada reporte en cada estado: un tramo por transición,
+-- abierto (hasta NULL) mientras el reporte siga en ese estado.
+-- Lo llena _insertar_historial en la misma transacción que historial_reportes.
+CREATE TABLE IF NOT EXISTS reportes_duracion_estado (
+    id_reporte  INT          NOT NULL,
+    estado      VARCHAR(50)  NOT NULL,
+    desde       DATETIME     NOT NULL,
+    hasta       DATETIME     NULL,
+    segundos    INT          NULL,
+    PRIMARY KEY (id_reporte, desde, estado),
+    KEY idx_duracion_abiertos (id_reporte, hasta),
+    KEY idx_duracion_estado (estado, hasta)
+);
+
+-- Una fila por reporte resuelto: tiempo desde created_at hasta la resolución.
+-- Si el reporte se reabre la fila se borra; al resolverse de nuevo se reescribe.
+CREATE TABLE IF NOT EXISTS reportes_resolucion (
+    id_reporte         INT      NOT NULL PRIMARY KEY,
+    id_entidad         INT      NOT NULL DEFAULT 0,
+    id_tipo_incidente  INT      NOT NULL,
+    creado             DATETIME NOT NULL,
+    resuelto           DATETIME NOT NULL,
+    segundos           INT      NOT NULL,
+    KEY idx_resolucion_entidad (id_entidad, resuelto),
+    KEY idx_resolucion_tipo (id_tipo_incidente, resuelto),
+    KEY idx_resolucion_fecha (resuelto)
+);
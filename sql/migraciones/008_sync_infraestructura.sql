@@ -0,0 +1,22 @@
+-- Feed de cambios de infraestructura (GET /infraestructura/cambios?since=...):
+-- fecha_actualizacion se llena también al insertar y tiene índice para el rango.
+UPDATE infraestructura_hidrica SET fecha_actualizacion = NOW() WHERE fecha_actualizacion IS NULL;
+
+ALTER TABLE infraestructura_hidrica
+    MODIFY fecha_actualizacion DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+
+CREATE INDEX idx_infraestructura_actualizacion ON infraestructura_hidrica (fecha_actualizacion);
+
+-- Lápidas: ids borrados y cuándo, para que los clientes los quiten en su próxima sincronización.
+CREATE TABLE IF NOT EXISTS infraestructura_eliminada (
+    id_infraestructura  INT      NOT NULL PRIMARY KEY,
+    fecha_eliminacion   DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_infraestructura_eliminada_fecha (fecha_eliminacion)
+);
+
+-- Cualquier DELETE (API o a mano) deja su lápida
+CREATE TRIGGER trg_infraestructura_eliminada
+    AFTER DELETE ON infraestructura_hidrica
+    FOR EACH ROW
+    REPLACE INTO infraestructura_eliminada (id_infraestructura, fecha_eliminacion)
+    VALUES (OLD.id_infraestructura, NOW());
@@ -0,0 +1,6 @@
+-- Clave de idempotencia generada por el cliente (POST /reportes/lote): reenviar
+-- el mismo lote después de un corte de red no duplica reportes.
+-- Es única por usuario; los reportes creados sin clave la dejan en NULL.
+ALTER TABLE reportes
+    ADD COLUMN clave_idempotencia VARCHAR(64) NULL AFTER fuente_reporte,
+    ADD UNIQUE KEY uq_reportes_idempotencia (id_usuario, clave_idempotencia);
@@ -0,0 +1,7 @@
+-- Clave natural para la importación masiva (POST /infraestructura/importar,
+-- tools_importar.py): el código del punto en su fuente (ej: id SIASAR).
+-- Reimportar el mismo inventario actualiza los puntos en vez de duplicarlos.
+-- Los puntos creados a mano lo dejan en NULL (no chocan con el índice único).
+ALTER TABLE infraestructura_hidrica
+    ADD COLUMN codigo_externo VARCHAR(100) NULL AFTER fuente,
+    ADD UNIQUE KEY uq_infraestructura_codigo (fuente, codigo_externo);
@@ -0,0 +1,101 @@
+"""
+Una ráfaga de logins esperando el hash PBKDF2 (más que conexiones en el pool)
+no debe retener conexiones: los demás endpoints siguen respondiendo.
+"""
+import asyncio
+import time
+
+import httpx
+from fastapi import Depends
+
+import main
+from app.db import database
+from app.routers import auth
+
+POOL_MAX = 2
+LOGINS = 10            # > POOL_MAX: todos esperan el hash al mismo tiempo
+HASH_SEG = 0.5
+
+
+class _Cursor:
+    lastrowid = 1
+    rowcount = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, params=None):
+        self._sql = sql
+
+    def fetchone(self):
+        if "FROM usuarios" in self._sql:
+            return {
+                "id_usuario": 1, "id_rol": 1, "id_estado_cuenta": 1, "id_entidad": None,
+                "nombre_completo": "Prueba", "correo": "a@b.co",
+                "password_hash": "$pbkdf2-sha256$29000$c2FsdA$hash",
+            }
+        return {"ok": 1}
+
+
+class _Conexion:
+    open = True
+    server_status = 0
+    _result = None
+
+    def cursor(self, *args):
+        return _Cursor()
+
+    def get_autocommit(self):
+        return True
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        pass
+
+
+async def _hash_lento(password, hashed):
+    await asyncio.sleep(HASH_SEG)
+    return True, None
+
+
+def _ping_db(conn=Depends(database.get_db)):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1 AS ok;")
+        return cursor.fetchone()
+
+
+def test_logins_esperando_hash_no_agotan_el_pool(monkeypatch):
+    pool = database.ConnectionPool(connect=_Conexion, min_size=0, max_size=POOL_MAX, timeout=HASH_SEG / 2)
+    monkeypatch.setattr(database, "pool", pool)
+    monkeypatch.setattr(auth, "hash_soportado", lambda hashed: True)
+    monkeypatch.setattr(auth, "verify_and_update_password_async", _hash_lento)
+    main.app.add_api_route("/_prueba/ping-db", _ping_db)
+
+    async def escenario():
+        transporte = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://test") as cliente:
+            logins = [
+                asyncio.create_task(cliente.post("/auth/login", json={"correo": "a@b.co", "password": "x"}))
+                for _ in range(LOGINS)
+            ]
+            await asyncio.sleep(HASH_SEG / 5)     # todos los logins ya están esperando el hash
+            t0 = time.perf_counter()
+            ping = await cliente.get("/_prueba/ping-db")
+            espera = time.perf_counter() - t0
+            return ping, espera, await asyncio.gather(*logins)
+
+    try:
+        ping, espera, logins = asyncio.run(escenario())
+    finally:
+        main.app.router.routes = [r for r in main.app.router.routes
+                                  if getattr(r, "path", None) != "/_prueba/ping-db"]
+
+    assert ping.status_code == 200
+    assert espera < HASH_SEG / 2
+    assert [r.status_code for r in logins] == [200] * LOGINS
+    assert pool.stats()["timeouts"] == 0
@@ -0,0 +1,99 @@
+"""
+Mantenimiento de las tablas de estadísticas de reportes.
+
+    python tools_estadisticas.py verificar     -> compara el resumen con un conteo directo sobre reportes
+    python tools_estadisticas.py reconstruir   -> recalcula el resumen completo (repara desajustes)
+    python tools_estadisticas.py serie [--desde AAAA-MM-DD] [--hasta AAAA-MM-DD] [--bloque-dias 31]
+        -> llena los rollups diarios de estadisticas_diarias (por defecto, desde el primer reporte hasta hoy)
+    python tools_estadisticas.py duraciones
+        -> rehace reportes_duracion_estado y reportes_resolucion desde historial_reportes
+"""
+import argparse
+import sys
+from datetime import date, timedelta
+
+from app.db.database import get_connection
+from app.services import estadisticas
+
+
+def verificar() -> None:
+    conn = get_connection()
+    try:
+        resultado = estadisticas.diferencias(conn)
+    finally:
+        conn.close()
+    print(f"Grupos en reportes: {resultado['grupos']}")
+    print(f"Grupos desajustados: {resultado['desajustados']}")
+    for clave, (resumen, real) in sorted(resultado["detalle"].items(), key=lambda kv: str(kv[0]))[:50]:
+        dia, estado, tipo, severidad, entidad = clave
+        print(f"  {dia} estado={estado} tipo={tipo} severidad={severidad} entidad={entidad}: "
+              f"resumen={resumen} real={real}")
+    if resultado["desajustados"]:
+        print("Ejecuta: python tools_estadisticas.py reconstruir")
+        sys.exit(1)
+
+
+def reconstruir() -> None:
+    conn = get_connection()
+    try:
+        grupos = estadisticas.reconstruir(conn)
+    finally:
+        conn.close()
+    print(f"Resumen reconstruido: {grupos} grupos")
+
+
+def serie(desde: date, hasta: date, bloque_dias: int) -> None:
+    conn = get_connection()
+    try:
+        if desde is None:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT MIN(DATE(created_at)) AS primero FROM reportes;")
+                desde = cursor.fetchone()["primero"] or date.today()
+        # Por bloques: cada uno es una transacción corta
+        inicio = desde
+        while inicio < hasta:
+            fin = min(inicio + timedelta(days=bloque_dias), hasta)
+            grupos = estadisticas.recalcular_dias(conn, inicio, fin)
+            print(f"  {inicio} .. {fin}: {grupos} grupos")
+            inicio = fin
+    finally:
+        conn.close()
+    print(f"Rollups diarios listos: {desde} .. {hasta}")
+
+
+def duraciones() -> None:
+    lectura, escritura = get_connection(), get_connection()
+    try:
+        totales = estadisticas.reconstruir_duraciones(lectura, escritura)
+    finally:
+        lectura.close()
+        escritura.close()
+    print(f"Duraciones reconstruidas: {totales['tramos']} tramos, {totales['resueltos']} reportes resueltos")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Tablas de estadísticas de reportes")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("verificar", help="Compara el resumen con reportes")
+    sub.add_parser("reconstruir", help="Recalcula el resumen desde reportes")
+
+    p_serie = sub.add_parser("serie", help="Llena los rollups diarios de la serie de tiempo")
+    p_serie.add_argument("--desde", type=date.fromisoformat, default=None)
+    p_serie.add_argument("--hasta", type=date.fromisoformat, default=date.today() + timedelta(days=1))
+    p_serie.add_argument("--bloque-dias", type=int, default=31)
+
+    sub.add_parser("duraciones", help="Rehace las duraciones por estado y los tiempos de resolución")
+
+    args = parser.parse_args()
+    if args.comando == "duraciones":
+        duraciones()
+    elif args.comando == "reconstruir":
+        reconstruir()
+    elif args.comando == "serie":
+        serie(args.desde, args.hasta, args.bloque_dias)
+    else:
+        verificar()
+
+
+if __name__ == "__main__":
+    main()
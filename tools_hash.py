@@ -1,3 +1,67 @@
-from app.core.security import hash_password
+"""
+Utilidades de contraseñas.
 
-print(hash_password("123456"))
+    python tools_hash.py hash [password]          -> imprime el hash PBKDF2 (por defecto de "123456")
+    python tools_hash.py calibrar [--objetivo-ms 250] [--muestras 5]
+        -> mide hashes/seg en este equipo y recomienda PBKDF2_ROUNDS
+           para que un hash tarde aproximadamente el objetivo.
+"""
+import argparse
+import time
+
+from passlib.hash import pbkdf2_sha256
+
+from app.core.security import PBKDF2_ROUNDS, hash_password
+
+
+def _medir_ms(rounds: int, muestras: int) -> float:
+    handler = pbkdf2_sha256.using(rounds=rounds)
+    handler.hash("calibracion")  # calentamiento
+    tiempos = []
+    for _ in range(muestras):
+        t0 = time.perf_counter()
+        handler.hash("calibracion")
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    tiempos.sort()
+    return tiempos[len(tiempos) // 2]  # mediana
+
+
+def calibrar(objetivo_ms: float, muestras: int) -> None:
+    ms_actual = _medir_ms(PBKDF2_ROUNDS, muestras)
+    print(f"Rondas actuales:     {PBKDF2_ROUNDS}")
+    print(f"Tiempo por hash:     {ms_actual:.1f} ms  (~{1000 / ms_actual:.1f} hashes/seg por núcleo)")
+
+    # El costo de PBKDF2 es lineal en las rondas
+    recomendadas = int(PBKDF2_ROUNDS * objetivo_ms / ms_actual)
+    recomendadas = max(1000, round(recomendadas / 1000) * 1000)
+    ms_recomendadas = _medir_ms(recomendadas, muestras)
+
+    print(f"Objetivo:            {objetivo_ms:.0f} ms")
+    print(f"Rondas recomendadas: {recomendadas}  (medido: {ms_recomendadas:.1f} ms, "
+          f"~{1000 / ms_recomendadas:.1f} hashes/seg por núcleo)")
+    print()
+    print("Agrega al .env:")
+    print(f"PBKDF2_ROUNDS={recomendadas}")
+    print("Los usuarios existentes se rehashean solos en su próximo login.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Utilidades de contraseñas PBKDF2")
+    sub = parser.add_subparsers(dest="comando")
+
+    p_hash = sub.add_parser("hash", help="Imprime el hash de una contraseña")
+    p_hash.add_argument("password", nargs="?", default="123456")
+
+    p_cal = sub.add_parser("calibrar", help="Recomienda PBKDF2_ROUNDS para este equipo")
+    p_cal.add_argument("--objetivo-ms", type=float, default=250.0)
+    p_cal.add_argument("--muestras", type=int, default=5)
+
+    args = parser.parse_args()
+    if args.comando == "calibrar":
+        calibrar(args.objetivo_ms, args.muestras)
+    else:
+        print(hash_password(getattr(args, "password", "123456")))
+
+
+if __name__ == "__main__":
+    main()
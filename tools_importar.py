@@ -0,0 +1,55 @@
+"""
+Importación masiva de infraestructura hídrica (inventarios SIASAR u otros).
+
+    python tools_importar.py ARCHIVO [--formato csv|geojson] [--fuente SIASAR] [--lote 500]
+        -> valida cada fila y hace upsert por lotes sobre (fuente, codigo_externo).
+           Reimportar el mismo archivo actualiza los puntos, no los duplica.
+
+El formato se deduce de la extensión (.csv / .geojson / .json) si no se indica.
+Columnas reconocidas: ver ALIAS en app/services/importacion.py.
+"""
+import argparse
+import os
+import sys
+
+from app.db.database import get_connection
+from app.routers.infraestructura import InfraestructuraCreate
+from app.services.importacion import IMPORTACION_LOTE, ArchivoInvalido, importar
+
+
+def _progreso(resumen) -> None:
+    print(f"  {resumen['leidos']} leídos: {resumen['insertados']} nuevos, "
+          f"{resumen['actualizados']} actualizados, {resumen['invalidos']} inválidos")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Importar infraestructura hídrica desde CSV o GeoJSON")
+    parser.add_argument("archivo")
+    parser.add_argument("--formato", choices=["csv", "geojson"])
+    parser.add_argument("--fuente", default="SIASAR")
+    parser.add_argument("--lote", type=int, default=IMPORTACION_LOTE)
+    args = parser.parse_args()
+
+    formato = args.formato or ("csv" if os.path.splitext(args.archivo)[1].lower() == ".csv" else "geojson")
+    conn = get_connection()
+    try:
+        with open(args.archivo, "rb") as archivo:
+            resumen = importar(conn, archivo, formato, args.fuente, InfraestructuraCreate,
+                               lote=args.lote, progreso=_progreso)
+    except ArchivoInvalido as e:
+        print(f"Archivo mal formado: {e} (los lotes anteriores ya quedaron guardados)")
+        sys.exit(2)
+    finally:
+        conn.close()
+
+    print(f"Listo en {resumen['segundos']} s: {resumen['leidos']} leídos, {resumen['insertados']} nuevos, "
+          f"{resumen['actualizados']} actualizados, {resumen['sin_cambios']} sin cambios, "
+          f"{resumen['duplicados']} repetidos en el archivo, {resumen['invalidos']} inválidos")
+    for error in resumen["errores"]:
+        print(f"  fila {error['fila']}: {error['error']}")
+    if resumen["invalidos"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
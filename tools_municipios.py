@@ -0,0 +1,182 @@
+"""
+Municipios de los reportes (punto en polígono).
+
+    python tools_municipios.py backfill [--lote 2000] [--todos] [--enrutar]
+        -> asigna codigo_municipio / municipio a los reportes que no lo tienen
+           (--todos: recalcula todos; --enrutar: además asigna id_entidad a los
+           reportes ciudadanos sin entidad, según municipio_entidad, y mueve sus
+           contadores: estadisticas_reportes y reportes_resolucion en la misma
+           transacción, y los días afectados de estadisticas_diarias al final).
+    python tools_municipios.py ubicar LAT LON
+        -> imprime el municipio que contiene el punto.
+
+Los polígonos se leen de MUNICIPIOS_GEOJSON (por defecto data/municipios_cundinamarca.geojson).
+"""
+import argparse
+import sys
+from datetime import date, timedelta
+from typing import Iterator, Set, Tuple
+
+from app.db.database import get_connection
+from app.services import estadisticas
+from app.services.municipios import MUNICIPIOS_GEOJSON, indice_municipios
+
+
+def _cargar(conn=None) -> None:
+    n = indice_municipios.cargar()
+    if conn is not None:
+        indice_municipios.cargar_entidades(conn)
+    print(f"{n} municipios cargados de {MUNICIPIOS_GEOJSON}")
+
+
+def _enrutar(cursor, rutas) -> Tuple[int, Set[date]]:
+    """
+    Asigna la entidad a los reportes que siguen sin ella (se bloquean y se releen
+    dentro de la transacción) y mueve sus contadores. Devuelve cuántos se
+    enrutaron y los días de estadisticas_diarias que hay que recalcular.
+    """
+    ids = [id_reporte for _, id_reporte in rutas]
+    marcas = ", ".join(["%s"] * len(ids))
+    cursor.execute(f"""
+        SELECT id_reporte, id_entidad, id_estado, id_tipo_incidente, id_severidad, created_at
+        FROM reportes
+        WHERE id_reporte IN ({marcas}) AND id_entidad IS NULL
+        FOR UPDATE;
+    """, ids)
+    vigentes = {r["id_reporte"]: r for r in cursor.fetchall()}
+    rutas = [(id_entidad, id_reporte) for id_entidad, id_reporte in rutas if id_reporte in vigentes]
+    if not rutas:
+        return 0, set()
+
+    cursor.executemany("UPDATE reportes SET id_entidad = %s WHERE id_reporte = %s;", rutas)
+    estadisticas.registrar_reasignaciones(
+        cursor, [(vigentes[id_reporte], id_entidad) for id_entidad, id_reporte in rutas]
+    )
+
+    # Días donde cuentan: el de creación y los de cada resolución
+    dias = {vigentes[id_reporte]["created_at"].date() for _, id_reporte in rutas}
+    if estadisticas.ESTADOS_RESUELTOS:
+        ids = list(vigentes)
+        cursor.execute(f"""
+            SELECT DISTINCT DATE(fecha_cambio) AS dia
+            FROM historial_reportes
+            WHERE id_reporte IN ({", ".join(["%s"] * len(ids))})
+              AND UPPER(estado_nuevo) IN ({", ".join(["%s"] * len(estadisticas.ESTADOS_RESUELTOS))});
+        """, [*ids, *estadisticas.ESTADOS_RESUELTOS])
+        dias.update(r["dia"] for r in cursor.fetchall())
+    return len(rutas), dias
+
+
+def _rangos(dias: Set[date]) -> Iterator[Tuple[date, date]]:
+    """Días sueltos agrupados en rangos consecutivos [desde, hasta)."""
+    desde = hasta = None
+    for dia in sorted(dias):
+        if hasta is not None and dia == hasta:
+            hasta = dia + timedelta(days=1)
+            continue
+        if desde is not None:
+            yield desde, hasta
+        desde, hasta = dia, dia + timedelta(days=1)
+    if desde is not None:
+        yield desde, hasta
+
+
+def backfill(lote: int, todos: bool, enrutar: bool) -> None:
+    conn = get_connection()
+    try:
+        _cargar(conn)
+        filtro = "" if todos else " AND codigo_municipio IS NULL"
+        ultimo_id, revisados, asignados, enrutados = 0, 0, 0, 0
+        dias_afectados: Set[date] = set()
+
+        while True:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT id_reporte, latitud, longitud, id_entidad, fuente_reporte
+                    FROM reportes
+                    WHERE id_reporte > %s
+                      AND latitud IS NOT NULL AND longitud IS NOT NULL{filtro}
+                    ORDER BY id_reporte
+                    LIMIT %s;
+                """, (ultimo_id, lote))
+                rows = cursor.fetchall()
+            if not rows:
+                break
+
+            ubicaciones = indice_municipios.localizar_lote(
+                [r["latitud"] for r in rows], [r["longitud"] for r in rows]
+            )
+            cambios, rutas = [], []
+            for row, muni in zip(rows, ubicaciones):
+                if muni is None:
+                    continue
+                cambios.append((muni["codigo_municipio"], muni["municipio"], row["id_reporte"]))
+                if (enrutar and row["id_entidad"] is None and muni["id_entidad"]
+                        and row["fuente_reporte"] == "CIUDADANO"):
+                    rutas.append((muni["id_entidad"], row["id_reporte"]))
+
+            # Un lote = una transacción (reportes y sus contadores juntos)
+            conn.begin()
+            try:
+                with conn.cursor() as cursor:
+                    if cambios:
+                        cursor.executemany(
+                            "UPDATE reportes SET codigo_municipio = %s, municipio = %s WHERE id_reporte = %s;",
+                            cambios,
+                        )
+                    n_rutas, dias = _enrutar(cursor, rutas) if rutas else (0, set())
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+            revisados += len(rows)
+            asignados += len(cambios)
+            enrutados += n_rutas
+            dias_afectados |= dias
+            ultimo_id = rows[-1]["id_reporte"]
+            print(f"  hasta id {ultimo_id}: {revisados} revisados, {asignados} con municipio")
+
+        # Los rollups diarios se reescriben desde reportes: un rango por bloque de días seguidos
+        for desde, hasta in _rangos(dias_afectados):
+            estadisticas.recalcular_dias(conn, desde, hasta)
+        if dias_afectados:
+            print(f"  estadisticas_diarias recalculadas en {len(dias_afectados)} días")
+
+        print(f"Listo: {revisados} revisados, {asignados} con municipio, "
+              f"{revisados - asignados} fuera de los polígonos, {enrutados} enrutados a su entidad")
+    finally:
+        conn.close()
+
+
+def ubicar(lat: float, lon: float) -> None:
+    _cargar()
+    muni = indice_municipios.localizar(lat, lon)
+    if muni is None:
+        print("El punto no cae en ningún municipio cargado")
+        sys.exit(1)
+    print(muni)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Municipios de los reportes")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_back = sub.add_parser("backfill", help="Asigna municipio a los reportes existentes")
+    p_back.add_argument("--lote", type=int, default=2000)
+    p_back.add_argument("--todos", action="store_true", help="Recalcula también los que ya tienen municipio")
+    p_back.add_argument("--enrutar", action="store_true", help="Asigna id_entidad a reportes ciudadanos sin entidad")
+
+    p_ubicar = sub.add_parser("ubicar", help="Municipio que contiene un punto")
+    p_ubicar.add_argument("lat", type=float)
+    p_ubicar.add_argument("lon", type=float)
+
+    args = parser.parse_args()
+    if args.comando == "backfill":
+        backfill(args.lote, args.todos, args.enrutar)
+    else:
+        ubicar(args.lat, args.lon)
+
+
+if __name__ == "__main__":
+    main()